@@ -0,0 +1,169 @@
+"""Concurrency benchmark, WSGI against ASGI serving
+
+Serves the app with gunicorn threaded workers (``vm.wsgi``) then with uvicorn
+(``vm.asgi``) and has --connections kiosks poll the catalog for --duration
+seconds, each over a keep-alive connection of its own: a first catalog page then
+a product, again and again. Reports req/s, p50/p95/p99 latency and errors of
+each mode.
+
+    pip install -e .[asgi] gunicorn
+    python benchmarks/asgi_concurrency.py --connections 500 --duration 20
+    DATABASE_URI=postgresql://vm:vm@localhost/vm_bench python benchmarks/asgi_concurrency.py --workers 4
+
+The database is taken from DATABASE_URI, its tables are recreated with
+--catalog products, it defaults to a temporary SQLite file. The catalog
+response cache is disabled unless --cache is given, so both modes read the
+database. The kiosks run in this process on one event loop, with many
+connections it can saturate before the servers do: watch its CPU usage.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+MODES = {
+    "wsgi": lambda options: [
+        sys.executable, "-m", "gunicorn", "vm.wsgi:app", "--bind", f"127.0.0.1:{options.port}",
+        "--workers", str(options.workers), "--worker-class", "gthread", "--threads", str(options.threads),
+        "--log-level", "warning",
+    ],
+    "asgi": lambda options: [
+        sys.executable, "-m", "uvicorn", "vm.asgi:app", "--host", "127.0.0.1", "--port", str(options.port),
+        "--workers", str(options.workers), "--log-level", "warning", "--no-access-log",
+    ],
+}
+
+
+def setup_database(catalog):
+    from vm.app import create_app
+    from vm.extensions import db
+    from vm.models import Product, Role, User
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(Role(id=3, name="SELLER"))
+        seller = User(username="seller", password="stringString2", role_id=3)
+        db.session.add(seller)
+        db.session.flush()
+        db.session.bulk_insert_mappings(Product, [
+            {"product_name": f"product {i}", "cost": 5, "amount_available": 10, "seller_id": seller.id}
+            for i in range(catalog)
+        ])
+        db.session.commit()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def wait_ready(base_url, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with {server.returncode}")
+            try:
+                if (await client.get("/api/v1/products/1")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def kiosk(client, options, deadline, latencies, errors):
+    urls = ["/api/v1/products?cursor=&per_page=20&count=false"] + [
+        f"/api/v1/products/{product_id}" for product_id in random.sample(range(1, options.catalog + 1), 10)
+    ]
+    i = 0
+    while time.monotonic() < deadline:
+        began = time.perf_counter()
+        try:
+            rep = await client.get(urls[i % len(urls)])
+            failed = rep.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        latencies.append(time.perf_counter() - began)
+        errors[0] += failed
+        i += 1
+
+
+async def load(base_url, options):
+    latencies, errors = [], [0]
+    # one pooled connection per kiosk
+    limits = httpx.Limits(max_connections=options.connections, max_keepalive_connections=options.connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + options.duration
+        began = time.monotonic()
+        await asyncio.gather(*[
+            kiosk(client, options, deadline, latencies, errors) for _ in range(options.connections)
+        ])
+    elapsed = time.monotonic() - began
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def run(mode, options):
+    server = subprocess.Popen(MODES[mode](options), env=os.environ.copy())
+    base_url = f"http://127.0.0.1:{options.port}"
+    try:
+        asyncio.run(wait_ready(base_url, server))
+        return asyncio.run(load(base_url, options))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--connections", type=int, default=500, help="concurrent kiosk connections")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per mode")
+    parser.add_argument("--workers", type=int, default=2, help="server processes")
+    parser.add_argument("--threads", type=int, default=16, help="threads per gunicorn worker")
+    parser.add_argument("--catalog", type=int, default=1000, help="products in the catalog")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--cache", action="store_true", help="keep the catalog response cache on")
+    options = parser.parse_args(argv)
+
+    if not os.getenv("DATABASE_URI"):
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["DATABASE_URI"] = f"sqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["METRICS_ENABLED"] = "false"
+    if not options.cache:
+        os.environ["CATALOG_CACHE_TTL"] = "0"
+    setup_database(options.catalog)
+
+    print(f"{options.connections} kiosk connections, {options.workers} workers, {options.duration}s per mode")
+    print(f"{'mode':<6} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    failed = False
+    for mode in options.modes:
+        result = run(mode, options)
+        failed |= bool(result["errors"])
+        print(
+            f"{mode:<6} {result['requests']:>9} {result['rps']:>8} {result['p50_ms']:>8} "
+            f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['errors']:>7}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
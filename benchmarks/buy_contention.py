@@ -0,0 +1,120 @@
+"""Contention benchmark for the buy endpoint
+
+Fires N parallel buyers at a single hot product and checks that the stock is
+never oversold, for every level of parallelism given on the command line.
+Change is paid back on every purchase, so each attempt inserts the coin it
+spends first, req/s counts attempts.
+
+    python benchmarks/buy_contention.py --buyers 1 2 4 8 16 --stock 200
+
+The database is taken from DATABASE_URI (use a local Postgres to see
+throughput scale with the number of buyers), it defaults to a temporary
+SQLite file.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from flask_jwt_extended import create_access_token
+
+from vm.app import create_app
+from vm.extensions import db
+from vm.models import Product, Role, User
+
+
+def setup_database(app, buyers, stock):
+    """Create a fresh hot product and ``buyers`` users able to buy all of it"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([Role(id=2, name="BUYER"), Role(id=3, name="SELLER")])
+        seller = User(username="seller", password="stringString2", role_id=3)
+        db.session.add(seller)
+        db.session.flush()
+        product = Product(product_name="hot product", cost=5, amount_available=stock, seller_id=seller.id)
+        db.session.add(product)
+
+        users = [
+            User(username=f"buyer{i}", password="stringString2", role_id=2, deposit=0)
+            for i in range(buyers)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+
+        headers = []
+        for user in users:
+            token = create_access_token(identity=user.id)
+            headers.append({"authorization": f"Bearer {token}"})
+        return product.id, headers
+
+
+def run(app, buyers, stock, attempts):
+    product_id, headers = setup_database(app, buyers, stock)
+    results = {"sold": 0, "rejected": 0, "errors": 0}
+    lock = threading.Lock()
+    start = threading.Barrier(buyers)
+
+    def buyer(buyer_headers):
+        client = app.test_client()
+        start.wait()
+        for _ in range(attempts):
+            client.post("/api/v1/deposit", json={"deposit": 5}, headers=buyer_headers)
+            rep = client.post(
+                "/api/v1/buy", json=[{"id": product_id, "amount_to_buy": 1}], headers=buyer_headers
+            )
+            key = {201: "sold", 400: "rejected"}.get(rep.status_code, "errors")
+            with lock:
+                results[key] += 1
+
+    threads = [threading.Thread(target=buyer, args=(h,)) for h in headers]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    with app.app_context():
+        remaining = db.session.get(Product, product_id).amount_available
+
+    results.update(
+        buyers=buyers,
+        remaining=remaining,
+        oversold=results["sold"] > stock or remaining != stock - results["sold"] or remaining < 0,
+        rps=(buyers * attempts) / elapsed,
+    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--buyers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--attempts", type=int, default=None,
+                        help="purchases attempted per buyer, default oversubscribes stock twice")
+    args = parser.parse_args(argv)
+
+    if not os.getenv("DATABASE_URI"):
+        path = os.path.join(tempfile.mkdtemp(), "contention.db")
+        os.environ["DATABASE_URI"] = f"sqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    app = create_app(testing=True)
+
+    print(f"{'buyers':>7} {'sold':>6} {'rejected':>9} {'errors':>7} {'remaining':>10} {'req/s':>9}  oversold")
+    failed = False
+    for buyers in args.buyers:
+        attempts = args.attempts or max(1, (2 * args.stock) // buyers)
+        result = run(app, buyers, args.stock, attempts)
+        failed |= result["oversold"] or result["errors"] > 0
+        print(
+            f"{result['buyers']:>7} {result['sold']:>6} {result['rejected']:>9} {result['errors']:>7} "
+            f"{result['remaining']:>10} {result['rps']:>9.1f}  {result['oversold']}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
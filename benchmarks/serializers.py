@@ -0,0 +1,56 @@
+"""Micro-benchmark of product serialization
+
+Compares a ProductSchema instance built per call, as the resources used to
+do, a reused ProductSchema instance and the compiled serializer on 1, 50 and
+1000 products.
+
+    python benchmarks/serializers.py
+"""
+import argparse
+import json
+import sys
+import timeit
+
+from vm.api.schemas import ProductSchema, products_serializer
+from vm.models import Product
+
+
+def make_products(size):
+    return [
+        Product(id=i, product_name=f"product {i}", cost=5 * (i % 20 + 1), amount_available=i % 50)
+        for i in range(size)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 50, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    reused = ProductSchema(many=True)
+    candidates = {
+        "schema per call": lambda products: ProductSchema(many=True).dump(products),
+        "reused schema": reused.dump,
+        "compiled": products_serializer.dump,
+    }
+
+    print(f"{'products':>8}  {'serializer':<16} {'usec/call':>10} {'speedup':>8}")
+    for size in args.sizes:
+        products = make_products(size)
+        expected = json.dumps(ProductSchema(many=True).dump(products))
+        number = max(1, 20000 // size)
+        baseline = None
+        for name, dump in candidates.items():
+            if json.dumps(dump(products)) != expected:
+                print(f"{name} output differs from ProductSchema", file=sys.stderr)
+                return 1
+            best = min(timeit.repeat(lambda: dump(products), number=number, repeat=args.repeat))
+            usec = best / number * 1e6
+            baseline = baseline or usec
+            print(f"{size:>8}  {name:<16} {usec:>10.1f} {baseline / usec:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
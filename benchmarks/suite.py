@@ -0,0 +1,306 @@
+"""Benchmark suite for the vending API
+
+Runs each scenario with concurrent clients and reports req/s, p50/p95/p99
+latency and SQL statements per request, then compares the results with the
+baseline stored for the database backend and fails on regressions.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --scenarios buy_10 buy_100 --concurrency 16
+    DATABASE_URI=postgresql://vm:vm@localhost/vm_bench python benchmarks/suite.py
+    python benchmarks/suite.py --save-baseline
+
+Requests go through the Flask test client, in process, so the numbers
+measure the application and the database, not an HTTP server. The database
+is taken from DATABASE_URI and is dropped and recreated by every scenario,
+it defaults to a temporary SQLite file. The catalog response cache is
+disabled so catalog scenarios measure the queries.
+
+A scenario regresses when its req/s drops or its p95 rises by more than
+--tolerance, or when it runs more SQL statements per request than in the
+baseline. Timings depend on the machine, refresh the baseline with
+--save-baseline when moving to another one.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PASSWORD = "stringString2"
+
+Scenario = namedtuple("Scenario", ["setup", "prepare", "request"])
+Result = namedtuple("Result", ["requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "sql_per_request"])
+
+BASELINE_KEYS = ("rps", "p50_ms", "p95_ms", "p99_ms", "sql_per_request")
+
+_sql = threading.local()
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_sql, "active", False):
+        _sql.count += 1
+
+
+def reset_database(db, workers):
+    """Recreate the schema with roles, a seller and ``workers`` buyers
+
+    :return: seller id and buyer ids
+    """
+    from vm.models import Role, User
+
+    db.drop_all()
+    db.create_all()
+    db.session.add_all([Role(id=1, name="ADMIN"), Role(id=2, name="BUYER"), Role(id=3, name="SELLER")])
+    seller = User(username="seller", password=PASSWORD, role_id=3)
+    buyers = [User(username=f"buyer{i}", password=PASSWORD, role_id=2) for i in range(workers)]
+    db.session.add(seller)
+    db.session.add_all(buyers)
+    db.session.commit()
+    return seller.id, [buyer.id for buyer in buyers]
+
+
+def bearer(token):
+    return {"authorization": f"Bearer {token}"}
+
+
+def create_catalog(db, seller_id, size, stock):
+    from vm.models import Product
+
+    db.session.bulk_insert_mappings(Product, [
+        {"product_name": f"product {i}", "cost": 5, "amount_available": stock, "seller_id": seller_id}
+        for i in range(size)
+    ])
+    db.session.commit()
+    return [product_id for product_id, in db.session.query(Product.id).order_by(Product.id)]
+
+
+def login_scenario():
+    def setup(app, db, workers, options):
+        reset_database(db, workers)
+        return [{"username": f"buyer{i}", "password": PASSWORD} for i in range(workers)]
+
+    def request(client, credentials, i):
+        return client.post("/auth/login", json=credentials)
+
+    return Scenario(setup, None, request)
+
+
+def refresh_scenario():
+    def setup(app, db, workers, options):
+        _, buyers = reset_database(db, workers)
+        return [bearer(create_refresh_token(identity=buyer)) for buyer in buyers]
+
+    def request(client, headers, i):
+        return client.post("/auth/refresh", headers=headers)
+
+    return Scenario(setup, None, request)
+
+
+def deposit_scenario():
+    def setup(app, db, workers, options):
+        _, buyers = reset_database(db, workers)
+        return [bearer(create_access_token(identity=buyer)) for buyer in buyers]
+
+    def request(client, headers, i):
+        return client.post("/api/v1/deposit", json={"deposit": 5}, headers=headers)
+
+    return Scenario(setup, None, request)
+
+
+def buy_scenario(basket_size):
+    def setup(app, db, workers, options):
+        seller, buyers = reset_database(db, workers)
+        ids = create_catalog(db, seller, basket_size, stock=options.requests + 1)
+        basket = [{"id": product_id, "amount_to_buy": 1} for product_id in ids]
+        return [(bearer(create_access_token(identity=buyer)), basket) for buyer in buyers]
+
+    def prepare(client, context, i):
+        # change is paid back by every purchase, insert the coins it spends
+        headers, basket = context
+        coins = [{"deposit": 5}] * len(basket)
+        client.post("/api/v1/deposit", json=coins, headers=headers)
+
+    def request(client, context, i):
+        headers, basket = context
+        return client.post("/api/v1/buy", json=basket, headers=headers)
+
+    return Scenario(setup, prepare, request)
+
+
+def catalog_offset_scenario():
+    def setup(app, db, workers, options):
+        seller, _ = reset_database(db, workers)
+        create_catalog(db, seller, options.catalog, stock=1)
+        last_page = options.catalog // 50
+        return [last_page] * workers
+
+    def request(client, last_page, i):
+        return client.get(f"/api/v1/products?per_page=50&page={last_page - i % 10}")
+
+    return Scenario(setup, None, request)
+
+
+def catalog_keyset_scenario():
+    def setup(app, db, workers, options):
+        from vm.commons.pagination import encode_cursor
+
+        seller, _ = reset_database(db, workers)
+        ids = create_catalog(db, seller, options.catalog, stock=1)
+        cursors = [encode_cursor("next", [ids[-50 * (page + 2)]]) for page in range(10)]
+        return [cursors] * workers
+
+    def request(client, cursors, i):
+        return client.get(f"/api/v1/products?per_page=50&count=false&cursor={cursors[i % 10]}")
+
+    return Scenario(setup, None, request)
+
+
+SCENARIOS = {
+    "login": login_scenario(),
+    "refresh": refresh_scenario(),
+    "deposit": deposit_scenario(),
+    "buy_1": buy_scenario(1),
+    "buy_10": buy_scenario(10),
+    "buy_100": buy_scenario(100),
+    "catalog_offset_deep": catalog_offset_scenario(),
+    "catalog_keyset_deep": catalog_keyset_scenario(),
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(app, db, scenario, options):
+    with app.app_context():
+        contexts = scenario.setup(app, db, options.concurrency, options)
+
+    latencies, statements = [], []
+    errors = [0]
+    lock = threading.Lock()
+    start = threading.Barrier(options.concurrency)
+    per_worker = options.requests // options.concurrency
+
+    def worker(context):
+        client = app.test_client()
+        start.wait()
+        for i in range(per_worker):
+            if scenario.prepare is not None:
+                scenario.prepare(client, context, i)
+            _sql.count, _sql.active = 0, True
+            began = time.perf_counter()
+            rep = scenario.request(client, context, i)
+            elapsed = time.perf_counter() - began
+            _sql.active = False
+            with lock:
+                latencies.append(elapsed)
+                statements.append(_sql.count)
+                errors[0] += rep.status_code >= 400
+
+    threads = [threading.Thread(target=worker, args=(context,)) for context in contexts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # prepare steps are not timed, throughput is derived from request latencies
+    busy = sum(latencies) / options.concurrency
+
+    return Result(
+        requests=len(latencies),
+        errors=errors[0],
+        rps=round(len(latencies) / busy, 1),
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 2),
+        sql_per_request=round(statistics.mean(statements), 2),
+    )
+
+
+def regressions(result, baseline, tolerance):
+    """Return a description of every regression of ``result`` against ``baseline``"""
+    found = []
+    if result.errors:
+        found.append(f"{result.errors} failed requests")
+    # the slack absorbs the periodic revocation sync queries
+    if result.sql_per_request > baseline["sql_per_request"] + 0.1:
+        found.append(f"sql/req {baseline['sql_per_request']} -> {result.sql_per_request}")
+    if result.rps < baseline["rps"] * (1 - tolerance):
+        found.append(f"req/s {baseline['rps']} -> {result.rps}")
+    if result.p95_ms > baseline["p95_ms"] * (1 + tolerance):
+        found.append(f"p95 {baseline['p95_ms']}ms -> {result.p95_ms}ms")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--catalog", type=int, default=5000, help="products for the catalog scenarios")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed relative drop of req/s and rise of p95 before failing")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    options = parser.parse_args(argv)
+
+    if not os.getenv("DATABASE_URI"):
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["DATABASE_URI"] = f"sqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["CATALOG_CACHE_TTL"] = "0"
+    os.environ["METRICS_ENABLED"] = "false"
+
+    from vm.app import create_app
+    from vm.extensions import db
+
+    app = create_app(testing=True)
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    with app.app_context():
+        backend = db.engine.dialect.name
+
+    stored = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            stored = json.load(f)
+    baseline = stored.get(backend, {})
+
+    print(f"backend {backend}, {options.concurrency} clients, {options.requests} requests per scenario")
+    print(f"{'scenario':<20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8} "
+          f"{'errors':>7}  status")
+    failed = False
+    results = {}
+    for name in options.scenarios:
+        result = run(app, db, SCENARIOS[name], options)
+        results[name] = result._asdict()
+        found = regressions(result, baseline[name], options.tolerance) if name in baseline else []
+        status = "; ".join(found) if found else ("ok" if name in baseline else "no baseline")
+        failed |= bool(found)
+        print(
+            f"{name:<20} {result.rps:>8} {result.p50_ms:>8} {result.p95_ms:>8} {result.p99_ms:>8} "
+            f"{result.sql_per_request:>8} {result.errors:>7}  {status}"
+        )
+
+    if options.save_baseline:
+        stored[backend] = dict(baseline)
+        for name, result in results.items():
+            stored[backend][name] = {key: result[key] for key in BASELINE_KEYS}
+        with open(options.baseline, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline saved to {options.baseline}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
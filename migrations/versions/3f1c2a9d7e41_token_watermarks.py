@@ -0,0 +1,32 @@
+"""token watermarks, blocklist keeps revoked tokens only
+
+Revision ID: 3f1c2a9d7e41
+Revises: b0b8cf4538ec
+Create Date: 2026-10-18 09:12:41.532817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e41'
+down_revision = 'b0b8cf4538ec'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_watermark',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('revoked_before', sa.DateTime(), nullable=True),
+    sa.Column('active_until', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # issued tokens are not recorded anymore, only revocations
+    op.execute("DELETE FROM token_blocklist WHERE revoked = false")
+
+
+def downgrade():
+    op.drop_table('token_watermark')
@@ -0,0 +1,28 @@
+"""purchase journal settlement watermark
+
+Revision ID: 5e9b3d1f8a62
+Revises: c41a7f9e2d35
+Create Date: 2026-10-18 18:19:43.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9b3d1f8a62'
+down_revision = 'c41a7f9e2d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('journal_watermark',
+    sa.Column('machine_id', sa.String(length=64), nullable=False),
+    sa.Column('last_order_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('machine_id')
+    )
+
+
+def downgrade():
+    op.drop_table('journal_watermark')
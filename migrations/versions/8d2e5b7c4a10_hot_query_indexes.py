@@ -0,0 +1,32 @@
+"""indexes for hot lookup columns
+
+Revision ID: 8d2e5b7c4a10
+Revises: 3f1c2a9d7e41
+Create Date: 2026-10-18 17:52:17.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e5b7c4a10'
+down_revision = '3f1c2a9d7e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_product_seller_id_id', 'product', ['seller_id', 'id'], unique=False)
+    op.create_index(op.f('ix_token_blocklist_user_id'), 'token_blocklist', ['user_id'], unique=False)
+    op.create_index(op.f('ix_token_blocklist_expires'), 'token_blocklist', ['expires'], unique=False)
+    op.create_index('ix_token_watermark_revoked_before', 'token_watermark', ['revoked_before'], unique=False,
+                    postgresql_where=sa.text('revoked_before IS NOT NULL'),
+                    sqlite_where=sa.text('revoked_before IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_token_watermark_revoked_before', table_name='token_watermark')
+    op.drop_index(op.f('ix_token_blocklist_expires'), table_name='token_blocklist')
+    op.drop_index(op.f('ix_token_blocklist_user_id'), table_name='token_blocklist')
+    op.drop_index('ix_product_seller_id_id', table_name='product')
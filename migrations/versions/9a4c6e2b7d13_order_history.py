@@ -0,0 +1,55 @@
+"""order history
+
+Revision ID: 9a4c6e2b7d13
+Revises: 5e9b3d1f8a62
+Create Date: 2026-10-18 18:25:39.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c6e2b7d13'
+down_revision = '5e9b3d1f8a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('orders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('total_spent', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_orders_user_id_created_at_id', 'orders', ['user_id', 'created_at', 'id'], unique=False)
+    op.create_table('order_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('seller_id', sa.Integer(), nullable=True),
+    sa.Column('product_name', sa.String(length=80), nullable=False),
+    sa.Column('cost', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.ForeignKeyConstraint(['seller_id'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_items_order_id'), 'order_items', ['order_id'], unique=False)
+    op.create_index('ix_order_items_product_id_created_at_id', 'order_items', ['product_id', 'created_at', 'id'],
+                    unique=False)
+    op.create_index('ix_order_items_seller_id_created_at_id', 'order_items', ['seller_id', 'created_at', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_order_items_seller_id_created_at_id', table_name='order_items')
+    op.drop_index('ix_order_items_product_id_created_at_id', table_name='order_items')
+    op.drop_index(op.f('ix_order_items_order_id'), table_name='order_items')
+    op.drop_table('order_items')
+    op.drop_index('ix_orders_user_id_created_at_id', table_name='orders')
+    op.drop_table('orders')
@@ -0,0 +1,29 @@
+"""coin inventory per machine
+
+Revision ID: c41a7f9e2d35
+Revises: 8d2e5b7c4a10
+Create Date: 2026-10-18 17:54:59.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41a7f9e2d35'
+down_revision = '8d2e5b7c4a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('coin_inventory',
+    sa.Column('machine_id', sa.String(length=64), nullable=False),
+    sa.Column('coin', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('machine_id', 'coin')
+    )
+
+
+def downgrade():
+    op.drop_table('coin_inventory')
@@ -0,0 +1,39 @@
+"""sales rollups
+
+Revision ID: d7f2a8c5e914
+Revises: 9a4c6e2b7d13
+Create Date: 2026-10-18 18:27:35.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f2a8c5e914'
+down_revision = '9a4c6e2b7d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('seller_id', sa.Integer(), nullable=True),
+    sa.Column('granularity', sa.String(length=4), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['seller_id'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('seller_id', 'granularity', 'bucket', 'product_id', name='uq_sales_rollup_bucket')
+    )
+    op.create_index('ix_sales_rollup_product_id', 'sales_rollup', ['product_id', 'granularity', 'bucket'],
+                    unique=False)
+    # orders recorded before the rollups are added up by ``flask vm rollup-sales``
+
+
+def downgrade():
+    op.drop_index('ix_sales_rollup_product_id', table_name='sales_rollup')
+    op.drop_table('sales_rollup')
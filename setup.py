@@ -20,5 +20,6 @@ setup(
         "apispec[yaml]",
         "apispec-webframeworks",
     ],
+    extras_require={"asgi": ["asgiref>=3.5", "uvicorn", "asyncpg", "aiosqlite"]},
     entry_points={"flask.commands": ["vm = vm.manage:cli"]},
 )
@@ -1,10 +1,16 @@
+import importlib
 import json
 import pytest
+from collections import Counter, namedtuple
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from flask import url_for
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
-from vm.models import User
+from vm.models import Product, Role, User
 from vm.app import create_app
-from vm.extensions import db as _db
+from vm.extensions import db as _db, apispec, catalog_cache, replicas, revocation_cache
 from pytest_factoryboy import register
 from tests.factories import UserFactory
 
@@ -30,6 +36,38 @@ def db(app):
 
     _db.session.close()
     _db.drop_all()
+    catalog_cache.invalidate()
+
+
+@pytest.fixture
+def file_app(app, tmp_path, monkeypatch):
+    """Factory of apps on SQLite files, for settings read by the app factory
+
+        flask_app = file_app(DATABASE_REPLICAS={...})
+
+    The primary database is a file of ``tmp_path`` with its tables created.
+    """
+    # vm.config is read once the test app loaded .testenv
+    config = importlib.import_module("vm.config")
+    spec = apispec.spec
+
+    def make_app(**settings):
+        monkeypatch.setattr(config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'primary.db'}")
+        for key, value in settings.items():
+            monkeypatch.setattr(config, key, value)
+        flask_app = create_app(testing=True)
+        with flask_app.app_context():
+            _db.create_all()
+        return flask_app
+
+    yield make_app
+    # extension singletons hold the settings of the last app created
+    apispec.spec = spec
+    catalog_cache.init_app(app)
+    revocation_cache.init_app(app)
+    replicas.init_app(app, _db)
+    for key in set(_db.metadatas) - set(app.config["SQLALCHEMY_BINDS"]) - {None}:
+        del _db.metadatas[key]
 
 
 @pytest.fixture
@@ -102,3 +140,134 @@ def admin_refresh_headers(admin_user, client):
         'content-type': 'application/json',
         'authorization': 'Bearer %s' % tokens['refresh_token']
     }
+
+
+@pytest.fixture
+def add_roles():
+    """Add the roles users register with to the database of the current app"""
+
+    def add():
+        _db.session.add_all([Role(id=2, name="BUYER"), Role(id=3, name="SELLER")])
+        _db.session.commit()
+
+    return add
+
+
+@pytest.fixture
+def roles(db, add_roles):
+    add_roles()
+
+
+@pytest.fixture
+def create_user_headers():
+    """Register and log in a user, return it with its headers
+
+        seller, seller_headers = create_user_headers(client, "seller", "SELLER")
+    """
+
+    def create(client, username, role_name):
+        credentials = {"username": username, "password": "stringString2"}
+        rep = client.post(url_for('api.users'), json=dict(credentials, role_name=role_name))
+        data = rep.get_json()
+        user = namedtuple('Struct', data['user'].keys())(*data['user'].values())
+        tokens = client.post('/auth/login', json=credentials).get_json()
+        return user, {
+            'content-type': 'application/json',
+            'authorization': 'Bearer %s' % tokens['access_token']
+        }
+
+    return create
+
+
+@pytest.fixture
+def create_products():
+    """Create products of a seller from ``(name, cost, amount_available)``, return their ids"""
+
+    def create(client, headers, *products):
+        ids = []
+        for name, cost, amount_available in products:
+            rep = client.post(url_for('api.products'),
+                              json={"product_name": name, "cost": cost, "amount_available": amount_available},
+                              headers=headers)
+            ids.append(rep.get_json()['Product']['id'])
+        return ids
+
+    return create
+
+
+@pytest.fixture
+def create_catalog():
+    """Add ``size`` products without seller, return their ids"""
+
+    def create(db, size):
+        products = [Product(product_name="product %d" % i, cost=5, amount_available=1) for i in range(size)]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+    return create
+
+
+@pytest.fixture
+def deposit():
+    """Insert coins for a buyer"""
+
+    def insert(client, headers, *coins):
+        return client.post(url_for('api.deposit'), json=[{"deposit": coin} for coin in coins], headers=headers)
+
+    return insert
+
+
+@pytest.fixture
+def buy(deposit):
+    """Deposit 100 and buy ``(product id, amount)`` line items"""
+
+    def buy_basket(client, headers, *basket):
+        deposit(client, headers, 100)
+        rep = client.post(url_for('api.buy'), json=[{"id": id, "amount_to_buy": amount} for id, amount in basket],
+                          headers=headers)
+        assert rep.status_code == 201
+        return rep
+
+    return buy_basket
+
+
+def format_statements(statements, limit):
+    """Captured SQL as a diff against the budget, statements over it are marked with +"""
+    lines = ["--- budget: %d statements" % limit, "+++ captured: %d statements" % len(statements)]
+    for i, statement in enumerate(statements):
+        lines.append("%s %3d  %s" % ("+" if i >= limit else " ", i + 1, " ".join(statement.split())))
+    repeated = [(count, statement) for statement, count in Counter(statements).most_common() if count > 1]
+    if repeated:
+        lines.append("repeated statements:")
+        lines.extend("  x%d  %s" % (count, " ".join(statement.split())) for count, statement in repeated)
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def assert_max_queries(db):
+    """Context manager failing when the block runs more than ``limit`` SQL statements
+
+        with assert_max_queries(5):
+            client.post(url_for('api.buy'), ...)
+
+    Yields the list of captured statements.
+    """
+
+    @contextmanager
+    def assert_max(limit):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", capture)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, "before_cursor_execute", capture)
+        if len(statements) > limit:
+            pytest.fail("expected at most %d SQL statements, got %d\n%s"
+                        % (limit, len(statements), format_statements(statements, limit)), pytrace=False)
+
+    return assert_max
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+
+pytest.importorskip("asgiref")
+pytest.importorskip("aiosqlite")
+httpx = pytest.importorskip("httpx")
+
+from vm.commons.asgi import AsyncApp  # noqa: E402
+from vm.commons.pagination import encode_cursor  # noqa: E402
+from vm.extensions import db as _db, catalog_cache  # noqa: E402
+from vm.models import Product  # noqa: E402
+
+
+@pytest.fixture
+def flask_app(file_app, add_roles):
+    # the async engine can not share an in-memory database with the sync one
+    flask_app = file_app()
+    with flask_app.app_context():
+        add_roles()
+        _db.session.add_all([Product(product_name="product %d" % i, cost=5, amount_available=1) for i in range(7)])
+        _db.session.commit()
+    return flask_app
+
+
+def run(flask_app, scenario):
+    """Run ``scenario(client, asgi)`` against an AsyncApp of flask_app"""
+    async def main():
+        asgi = AsyncApp(flask_app)
+        transport = httpx.ASGITransport(app=asgi)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+                return await scenario(client, asgi)
+        finally:
+            await asgi.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("url", [
+    "/api/v1/products",
+    "/api/v1/products?page=2&per_page=3",
+    "/api/v1/products?page=3&per_page=3&count=false",
+    "/api/v1/products?page=1&per_page=500",
+    "/api/v1/products?cursor=&per_page=3",
+    "/api/v1/products?cursor=%s&per_page=3&count=false" % encode_cursor("next", [3]),
+    "/api/v1/products?cursor=%s&per_page=3" % encode_cursor("prev", [7]),
+    "/api/v1/products/2",
+])
+def test_async_catalog_matches_flask(flask_app, url):
+    async def scenario(client, asgi):
+        catalog_cache.invalidate()
+        rep = await client.get(url)
+        # only async handlers open the async engine
+        assert asgi.engine is not None
+        return rep
+
+    rep = run(flask_app, scenario)
+    catalog_cache.invalidate()
+    expected = flask_app.test_client().get(url)
+
+    assert rep.status_code == expected.status_code == 200
+    assert rep.content == expected.data
+    assert rep.headers["etag"] == expected.headers["etag"]
+    assert rep.headers["content-type"] == "application/json"
+
+
+def test_async_catalog_pages_like_flask_past_a_hundred(flask_app):
+    with flask_app.app_context():
+        _db.session.add_all([Product(product_name="more %d" % i, cost=5, amount_available=1) for i in range(150)])
+        _db.session.commit()
+    url = "/api/v1/products?page=1&per_page=120"
+
+    async def scenario(client, asgi):
+        catalog_cache.invalidate()
+        return await client.get(url)
+
+    rep = run(flask_app, scenario)
+    catalog_cache.invalidate()
+    expected = flask_app.test_client().get(url)
+
+    assert len(rep.json()["results"]) == 120
+    assert rep.json()["pages"] == 2
+    assert rep.content == expected.data
+
+
+def test_async_app_bridges_to_flask(flask_app):
+    async def scenario(client, asgi):
+        reps = {}
+        for url in ("/api/v1/products/99", "/api/v1/products?page=9", "/api/v1/products?cursor=bad"):
+            reps[url] = await client.get(url)
+        assert asgi.engine is not None
+
+        rep = await client.get("/api/v1/products?per_page=3")
+        reps["not_modified"] = await client.get(
+            "/api/v1/products?per_page=3", headers={"if-none-match": rep.headers["etag"]}
+        )
+
+        # writes go through Flask and invalidate the cache of the async reads
+        await client.post("/api/v1/users", json={"username": "seller", "role_name": "SELLER",
+                                                 "password": "stringString2"})
+        tokens = (await client.post("/auth/login", json={"username": "seller", "password": "stringString2"})).json()
+        reps["created"] = await client.post(
+            "/api/v1/products", json={"product_name": "new", "cost": 10, "amount_available": 2},
+            headers={"authorization": "Bearer %s" % tokens["access_token"]},
+        )
+        reps["total"] = (await client.get("/api/v1/products?per_page=3")).json()["total"]
+        return reps
+
+    reps = run(flask_app, scenario)
+    client = flask_app.test_client()
+    for url in ("/api/v1/products/99", "/api/v1/products?page=9", "/api/v1/products?cursor=bad"):
+        expected = client.get(url)
+        assert reps[url].status_code == expected.status_code
+        assert reps[url].content == expected.data
+
+    assert reps["not_modified"].status_code == 304
+    assert reps["not_modified"].content == b""
+    assert reps["created"].status_code == 201
+    assert reps["total"] == 8
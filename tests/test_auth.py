@@ -9,3 +9,88 @@ def test_revoke_refresh_token(client, admin_refresh_headers):
 
     resp = client.post("/auth/refresh", headers=admin_refresh_headers)
     assert resp.status_code == 401
+
+
+def test_revoked_token_is_not_served_from_cache(client, admin_user, admin_headers):
+    user_url = "/api/v1/users/%d" % admin_user.id
+    # first call caches the token as valid
+    assert client.get(user_url, headers=admin_headers).status_code == 200
+
+    resp = client.delete("/auth/logout/all", headers=admin_headers)
+    assert resp.status_code == 200
+
+    resp = client.get(user_url, headers=admin_headers)
+    assert resp.status_code == 401
+
+
+def test_tokens_issued_right_after_revoking_all_are_valid(client, admin_user, admin_headers):
+    user_url = "/api/v1/users/%d" % admin_user.id
+    assert client.delete("/auth/logout/all", headers=admin_headers).status_code == 200
+
+    # most likely within the second of the revocation
+    rep = client.post("/auth/login", json={"username": admin_user.username, "password": "admin"})
+    headers = {"authorization": "Bearer %s" % rep.get_json()["access_token"]}
+    assert client.get(user_url, headers=headers).status_code == 200
+    assert client.get(user_url, headers=admin_headers).status_code == 401
+
+
+def test_revocation_from_other_worker_is_synced(client, db, admin_user, admin_headers):
+    from datetime import datetime, timedelta
+    from vm.extensions import revocation_cache
+    from vm.models import TokenWatermark
+
+    user_url = "/api/v1/users/%d" % admin_user.id
+    assert client.get(user_url, headers=admin_headers).status_code == 200
+
+    # revoke behind the cache back, as another worker would
+    watermark = db.session.get(TokenWatermark, admin_user.id)
+    watermark.revoked_before = datetime.now() + timedelta(seconds=1)
+    db.session.commit()
+
+    sync_interval = revocation_cache.sync_interval
+    revocation_cache.sync_interval = 0
+    try:
+        assert client.get(user_url, headers=admin_headers).status_code == 401
+    finally:
+        revocation_cache.sync_interval = sync_interval
+
+
+def test_login_rehashes_outdated_password(client, db):
+    from passlib.hash import pbkdf2_sha256
+    from vm.models import User
+
+    user = User(username="legacy", password="unused")
+    user._password = pbkdf2_sha256.using(rounds=2000).hash("stringString2")
+    db.session.add(user)
+    db.session.commit()
+
+    data = {"username": "legacy", "password": "stringString2"}
+    resp = client.post("/auth/login", json=data)
+    assert resp.status_code == 200
+    assert "msg" not in resp.get_json()
+
+    db.session.refresh(user)
+    assert "$2000$" not in user.password
+    assert pbkdf2_sha256.verify("stringString2", user.password)
+
+    resp = client.post("/auth/login", json=data)
+    assert resp.get_json()["msg"] == "There is already an active session using your account"
+
+
+def test_purge_expired_tokens(app, db, admin_user):
+    from datetime import datetime, timedelta
+    from vm.auth.helpers import purge_expired_tokens
+    from vm.models import TokenBlocklist, TokenWatermark
+
+    now = datetime.now()
+    db.session.add_all([
+        TokenBlocklist(jti="expired", token_type="access", user_id=admin_user.id, revoked=True,
+                       expires=now - timedelta(seconds=1)),
+        TokenBlocklist(jti="alive", token_type="access", user_id=admin_user.id, revoked=True,
+                       expires=now + timedelta(hours=1)),
+        TokenWatermark(user_id=admin_user.id, revoked_before=now - timedelta(days=60)),
+    ])
+    db.session.commit()
+
+    assert purge_expired_tokens() == (1, 1)
+    assert [token.jti for token in TokenBlocklist.query.all()] == ["alive"]
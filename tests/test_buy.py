@@ -0,0 +1,132 @@
+from flask import url_for
+from vm.models import Product, User
+from vm.commons.purchase import adjust_stock
+from vm.commons.change import set_inventory, load_inventory
+
+
+def test_buy_basket(client, db, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, chips = create_products(client, seller_headers, ("cola", 15, 5), ("chips", 20, 5))
+
+    for coin in (100, 50):
+        client.post(url_for('api.deposit'), json={"deposit": coin}, headers=buyer_headers)
+
+    rep = client.post(url_for('api.buy'),
+                      json=[{"id": cola, "amount_to_buy": 2}, {"id": chips, "amount_to_buy": 3}],
+                      headers=buyer_headers)
+    assert rep.status_code == 201
+    data = rep.get_json()
+    assert data['total_spent'] == 90
+    assert data['Products'] == ["cola", "chips"]
+    assert data['change_to_return'] == {'50': 1, '10': 1}
+
+    assert db.session.get(Product, cola).amount_available == 3
+    assert db.session.get(Product, chips).amount_available == 2
+    # the change is paid back
+    assert db.session.get(User, buyer.id).deposit == 0
+
+
+def test_buy_not_available(client, db, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, chips = create_products(client, seller_headers, ("cola", 15, 5), ("chips", 20, 1))
+    client.post(url_for('api.deposit'), json={"deposit": 100}, headers=buyer_headers)
+
+    rep = client.post(url_for('api.buy'),
+                      json=[{"id": cola, "amount_to_buy": 1}, {"id": chips, "amount_to_buy": 2}],
+                      headers=buyer_headers)
+    assert rep.status_code == 400
+    assert rep.get_json()['msg'] == f"Product {chips} not available in this quantity"
+
+    # nothing is applied when one line item fails
+    assert db.session.get(Product, cola).amount_available == 5
+    assert db.session.get(User, buyer.id).deposit == 100
+
+
+def test_adjust_stock_never_goes_negative(db):
+    cola = Product(product_name="cola", cost=15, amount_available=1)
+    chips = Product(product_name="chips", cost=20, amount_available=5)
+    db.session.add_all([cola, chips])
+    db.session.commit()
+
+    # another buyer drained the stock between the read and the write
+    assert adjust_stock({cola.id: -2, chips.id: -1}) is False
+    db.session.rollback()
+
+    assert adjust_stock({cola.id: -1, chips.id: -1}) is True
+    db.session.commit()
+    assert db.session.get(Product, cola.id).amount_available == 0
+    assert db.session.get(Product, chips.id).amount_available == 4
+
+
+def test_buy_basket_duplicates_and_unknown_products(client, db, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, = create_products(client, seller_headers, ("cola", 15, 5))
+    client.post(url_for('api.deposit'), json={"deposit": 100}, headers=buyer_headers)
+
+    rep = client.post(url_for('api.buy'), json=[{"id": cola + 1, "amount_to_buy": 1}], headers=buyer_headers)
+    assert rep.status_code == 400
+    assert rep.get_json()['msg'] == f"Product {cola + 1} does not exist"
+
+    rep = client.post(url_for('api.buy'), json=[], headers=buyer_headers)
+    assert rep.status_code == 400
+
+    # duplicated line items are merged before checking the stock
+    rep = client.post(url_for('api.buy'),
+                      json=[{"id": cola, "amount_to_buy": 3}, {"id": cola, "amount_to_buy": 3}],
+                      headers=buyer_headers)
+    assert rep.status_code == 400
+
+    rep = client.post(url_for('api.buy'),
+                      json=[{"id": cola, "amount_to_buy": 2}, {"id": cola, "amount_to_buy": 3}],
+                      headers=buyer_headers)
+    assert rep.status_code == 201
+    assert rep.get_json()['total_spent'] == 75
+    assert db.session.get(Product, cola).amount_available == 0
+
+
+def test_buy_and_reset_with_coin_inventory(client, db, roles, create_user_headers, create_products):
+    set_inventory({100: 0, 50: 0, 20: 1, 10: 0, 5: 0})
+
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, = create_products(client, seller_headers, ("cola", 15, 5))
+    client.post(url_for('api.deposit'), json=[{"deposit": 20}, {"deposit": 20}], headers=buyer_headers)
+
+    # 25 can not be paid back with 20 coins only
+    rep = client.post(url_for('api.buy'), json=[{"id": cola, "amount_to_buy": 1}], headers=buyer_headers)
+    assert rep.status_code == 400
+    assert rep.get_json()['msg'] == "Not able to return change for this purchase"
+    assert db.session.get(Product, cola).amount_available == 5
+
+    client.post(url_for('api.deposit'), json={"deposit": 10}, headers=buyer_headers)
+    rep = client.post(url_for('api.buy'), json=[{"id": cola, "amount_to_buy": 2}], headers=buyer_headers)
+    assert rep.status_code == 201
+    assert rep.get_json()['change_to_return'] == {'20': 1}
+    assert load_inventory() == {100: 0, 50: 0, 20: 2, 10: 1, 5: 0}
+    assert db.session.get(User, buyer.id).deposit == 0
+
+    # reset pays back what the coins allow, the rest stays deposited
+    client.post(url_for('api.deposit'), json={"deposit": 50}, headers=buyer_headers)
+    set_inventory({50: 0, 20: 1, 10: 0})
+    rep = client.get(url_for('api.reset'), headers=buyer_headers)
+    assert rep.status_code == 201
+    assert rep.get_json() == {"msg": "Deposit reset", "current_deposit": 30,
+                              "change_to_return": {'20': 1}}
+
+
+def test_buy_pays_back_the_leftover_deposit(client, db, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, = create_products(client, seller_headers, ("cola", 15, 5))
+    client.post(url_for('api.deposit'), json={"deposit": 50}, headers=buyer_headers)
+
+    rep = client.post(url_for('api.buy'), json=[{"id": cola, "amount_to_buy": 1}], headers=buyer_headers)
+    assert rep.get_json()['change_to_return'] == {'20': 1, '10': 1, '5': 1}
+    # the leftover is handed out as change, not kept as credit
+    assert db.session.get(User, buyer.id).deposit == 0
+    rep = client.post(url_for('api.buy'), json=[{"id": cola, "amount_to_buy": 1}], headers=buyer_headers)
+    assert rep.status_code == 400
+    assert rep.get_json()['msg'] == "Deposit not sufficient for this product(s)"
@@ -0,0 +1,51 @@
+from vm.commons.change import make_change, largest_change, load_inventory, set_inventory, dispense, insert_coins
+
+
+def test_make_change_unlimited():
+    assert make_change(0) == {}
+    assert make_change(65) == {50: 1, 10: 1, 5: 1}
+    assert make_change(2040)[100] == 20
+    assert make_change(7) is None
+
+
+def test_make_change_bounded():
+    # greedy would take the 50 and get stuck
+    assert make_change(60, {50: 1, 20: 3}) == {20: 3}
+    assert make_change(60, {50: 1, 20: 2}) is None
+    assert make_change(40, {20: 1, 10: 1, 5: 10}) == {20: 1, 10: 1, 5: 2}
+
+    assert largest_change(65, {50: 1, 20: 2}) == (50, {50: 1})
+    assert largest_change(15, {}) == (0, {})
+
+
+def test_inventory(app, db):
+    with app.test_request_context():
+        assert load_inventory() is None
+        insert_coins([5, 5])
+        assert load_inventory() is None
+
+        # no row for the 10 coins yet
+        set_inventory({100: 0, 50: 1, 20: 3, 5: 0})
+        insert_coins([10, 20])
+        inventory = load_inventory()
+        assert inventory == {100: 0, 50: 1, 20: 4, 10: 1, 5: 0}
+
+        change = make_change(60, inventory)
+        assert change == {50: 1, 10: 1}
+        assert dispense(change, inventory)
+        db.session.commit()
+
+        # the same coins can not be handed out twice
+        assert not dispense({50: 1, 20: 2}, inventory)
+        db.session.rollback()
+        assert load_inventory() == {100: 0, 50: 0, 20: 4, 10: 0, 5: 0}
+
+
+def test_deposit_of_missing_user_leaves_inventory(app, db):
+    from vm.commons.purchase import add_deposit
+
+    with app.test_request_context():
+        set_inventory({50: 1, 20: 3})
+        assert add_deposit(404, [20, 50]) is None
+        db.session.commit()
+        assert load_inventory() == {50: 1, 20: 3}
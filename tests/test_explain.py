@@ -0,0 +1,19 @@
+from vm.commons.explain import HOT_QUERIES, explain_hot_queries
+
+
+def test_hot_queries_use_indexes(db):
+    plans = list(explain_hot_queries())
+    assert len(plans) == len(HOT_QUERIES)
+    for name, plan, scans in plans:
+        assert plan, name
+        assert scans == [], "%s: %s" % (name, plan)
+
+
+def test_explain_command_rejects_unsupported_databases(app, db, monkeypatch):
+    from vm import manage
+    from vm.commons import explain
+
+    monkeypatch.setattr(explain, "explain_supported", lambda: False)
+    result = app.test_cli_runner().invoke(manage.explain)
+    assert result.exit_code == 1
+    assert "explain supports Postgres and SQLite, not sqlite" in result.output
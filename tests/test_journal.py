@@ -0,0 +1,146 @@
+import pytest
+from sqlalchemy import update
+
+from vm.commons.journal import PurchaseJournal
+from vm.extensions import db
+from vm.models import JournalWatermark, Order, Product, User
+
+
+@pytest.fixture
+def journal_app(file_app, tmp_path, add_roles):
+    flask_app = file_app(
+        PURCHASE_JOURNAL_PATH=str(tmp_path / "journal.db"),
+        PURCHASE_JOURNAL_SETTLE_INTERVAL=0,
+        CATALOG_CACHE_TTL=0,
+    )
+    with flask_app.app_context():
+        add_roles()
+    return flask_app
+
+
+def stored(flask_app, model, id):
+    with flask_app.app_context():
+        return db.session.get(model, id)
+
+
+def test_purchases_are_journaled_then_settled(journal_app, create_user_headers, create_products, deposit):
+    client = journal_app.test_client()
+    _, seller = create_user_headers(client, "seller", "SELLER")
+    _, buyer = create_user_headers(client, "buyer", "BUYER")
+    cola, chips = create_products(client, seller, ("cola", 15, 2), ("chips", 5, 5))
+    deposit(client, buyer, 100, 50)
+
+    rep = client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 2}], headers=buyer)
+    assert rep.status_code == 201
+    assert rep.get_json()["change_to_return"] == {"100": 1, "20": 1}
+    # nothing written to the database yet
+    assert stored(journal_app, Product, cola).amount_available == 2
+    assert stored(journal_app, User, 2).deposit == 150
+
+    # held deposit and stock can not be spent twice
+    rep = client.post("/api/v1/buy", json=[{"id": chips, "amount_to_buy": 1}], headers=buyer)
+    assert rep.get_json()["msg"] == "Deposit not sufficient for this product(s)"
+    deposit(client, buyer, 20)
+    rep = client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 1}], headers=buyer)
+    assert rep.get_json()["msg"] == f"Product {cola} not available in this quantity"
+    rep = client.get("/api/v1/reset", headers=buyer)
+    assert rep.get_json()["current_deposit"] == 0
+    assert rep.get_json()["change_to_return"]["20"] == 1
+
+    with journal_app.app_context():
+        journal = journal_app.extensions["purchase_journal"]
+        assert len(journal.pending()) == 1
+        assert journal.settle_all() == 1
+        assert journal.pending() == []
+        assert journal._connection().execute("SELECT count(*) FROM journal_hold").fetchone()[0] == 0
+    assert stored(journal_app, Product, cola).amount_available == 0
+    assert stored(journal_app, User, 2).deposit == 0
+    assert stored(journal_app, JournalWatermark, "default").last_order_id == 1
+    rep = client.get("/api/v1/orders", headers=buyer).get_json()
+    assert [order["total_spent"] for order in rep["results"]] == [30]
+    assert rep["results"][0]["items"] == [{"product_id": cola, "product_name": "cola", "cost": 15, "amount": 2}]
+
+
+def test_refused_and_already_applied_orders(journal_app, create_user_headers, create_products, deposit):
+    client = journal_app.test_client()
+    _, seller = create_user_headers(client, "seller", "SELLER")
+    buyers = [create_user_headers(client, "buyer%d" % i, "BUYER")[1] for i in range(2)]
+    cola, = create_products(client, seller, ("cola", 5, 3))
+    for buyer in buyers:
+        deposit(client, buyer, 5)
+        assert client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 1}], headers=buyer).status_code == 201
+    # the seller lowers the stock before the orders are settled
+    client.put(f"/api/v1/products/{cola}", json={"amount_available": 1}, headers=seller)
+
+    with journal_app.app_context():
+        journal = journal_app.extensions["purchase_journal"]
+        assert journal.settle_all() == 2
+        statuses = journal._connection().execute("SELECT status, error FROM journal_order ORDER BY id").fetchall()
+    assert statuses == [("settled", None), ("failed", "Products not available in this quantity anymore")]
+    assert stored(journal_app, Product, cola).amount_available == 0
+    assert [stored(journal_app, User, id).deposit for id in (2, 3)] == [0, 5]
+    # only the settled order is recorded
+    with journal_app.app_context():
+        assert [order.user_id for order in Order.query.all()] == [2]
+
+    # a worker applied this order then stopped before marking it settled
+    client.put(f"/api/v1/products/{cola}", json={"amount_available": 5}, headers=seller)
+    assert client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 1}], headers=buyers[1]).status_code == 201
+    with journal_app.app_context():
+        db.session.execute(update(JournalWatermark).values(last_order_id=3))
+        db.session.commit()
+        assert journal.settle_all() == 1
+        assert journal.pending() == []
+    assert stored(journal_app, Product, cola).amount_available == 5
+
+
+def test_concurrent_settlers_release_holds_once(journal_app, monkeypatch, create_user_headers, create_products,
+                                                deposit):
+    client = journal_app.test_client()
+    _, seller = create_user_headers(client, "seller", "SELLER")
+    _, buyer = create_user_headers(client, "buyer", "BUYER")
+    cola, = create_products(client, seller, ("cola", 5, 3))
+    deposit(client, buyer, 5)
+    assert client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 1}], headers=buyer).status_code == 201
+
+    with journal_app.app_context():
+        journal = journal_app.extensions["purchase_journal"]
+        # a second process read the same batch before the first one settled it
+        other = PurchaseJournal(journal.path, journal.batch_size, 0, journal.machine_id)
+        batch = other.pending()
+        monkeypatch.setattr(other, "pending", lambda limit=None: batch)
+        assert journal.settle() == 1
+        assert other.settle() == 0
+        assert journal._connection().execute("SELECT count(*) FROM journal_hold").fetchone()[0] == 0
+    assert stored(journal_app, Product, cola).amount_available == 2
+
+    # the next purchase sees the real stock
+    client.put(f"/api/v1/products/{cola}", json={"amount_available": 1}, headers=seller)
+    deposit(client, buyer, 5)
+    deposit(client, buyer, 5)
+    assert client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 2}], headers=buyer).status_code == 400
+
+
+def test_deposit_returned_while_settling_is_not_negative(journal_app, create_user_headers, create_products, deposit):
+    client = journal_app.test_client()
+    _, seller = create_user_headers(client, "seller", "SELLER")
+    _, buyer = create_user_headers(client, "buyer", "BUYER")
+    cola, = create_products(client, seller, ("cola", 5, 3))
+    deposit(client, buyer, 5)
+    assert client.post("/api/v1/buy", json=[{"id": cola, "amount_to_buy": 1}], headers=buyer).status_code == 201
+
+    with journal_app.app_context():
+        # the settlement committed, its holds are not released yet
+        db.session.execute(update(User).where(User.id == 2).values(deposit=0))
+        db.session.commit()
+    rep = client.get("/api/v1/reset", headers=buyer)
+    assert rep.get_json()["current_deposit"] == 0
+    assert rep.get_json()["change_to_return"] == {}
+
+
+def test_connection_is_not_shared_with_a_forked_process(journal_app, monkeypatch):
+    journal = journal_app.extensions["purchase_journal"]
+    conn = journal._connection()
+    assert journal._connection() is conn
+    monkeypatch.setattr("vm.commons.journal.os.getpid", lambda: -1)
+    assert journal._connection() is not conn
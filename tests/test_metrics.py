@@ -0,0 +1,92 @@
+import logging
+import pytest
+from flask import url_for
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import NullPool
+from vm.commons.database import engine_options, TimedQueuePool, checkout_wait, checkout_timeouts
+from vm.commons.instrumentation import request_latency, request_statements, request_total
+
+
+def test_engine_options(app):
+    config = dict(app.config, SQLALCHEMY_DATABASE_URI="sqlite:///vm.db")
+    assert engine_options(config) == {}
+
+    config.update(SQLALCHEMY_DATABASE_URI="postgresql://vm:vm@db/vm", DATABASE_POOL_SIZE=3,
+                  DATABASE_STATEMENT_TIMEOUT=5000)
+    options = engine_options(config)
+    assert options["poolclass"] is TimedQueuePool
+    assert options["pool_size"] == 3
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+
+    config["DATABASE_PGBOUNCER"] = True
+    assert engine_options(config) == {"poolclass": NullPool}
+
+
+def test_pool_checkout_wait_and_timeouts():
+    engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.01)
+    waits, timeouts = checkout_wait.count(), checkout_timeouts.get()
+
+    connection = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    connection.close()
+
+    assert checkout_wait.count() == waits + 2
+    assert checkout_timeouts.get() == timeouts + 1
+    assert engine.pool.checkedout() == 0
+
+
+METRICS_HEADERS = {"authorization": "Bearer testing"}
+
+
+def test_metrics_endpoint(client):
+    assert client.get(url_for('metrics.serve_metrics')).status_code == 401
+    assert client.get(url_for('metrics.serve_metrics'), headers={"authorization": "Bearer nope"}).status_code == 401
+
+    rep = client.get(url_for('metrics.serve_metrics'), headers=METRICS_HEADERS)
+    assert rep.status_code == 200
+    assert rep.content_type.startswith("text/plain; version=0.0.4")
+    body = rep.get_data(as_text=True)
+    assert "# TYPE db_pool_checkout_wait_seconds histogram" in body
+    assert 'db_pool_checkout_wait_seconds_bucket{le="+Inf"}' in body
+
+
+def test_request_metrics(client, app, db, caplog):
+    labels = {"method": "GET", "endpoint": "/api/v1/products"}
+    requests, statements = request_latency.count(**labels), request_statements.count(**labels)
+
+    rep = client.get(url_for('api.products', page=1, per_page=5))
+    assert rep.status_code == 200
+    assert request_latency.count(**labels) == requests + 1
+    assert request_statements.count(**labels) == statements + 1
+    assert request_total.get(status="200", **labels) >= 1
+
+    app.config["SLOW_REQUEST_QUERIES"] = 0
+    try:
+        with caplog.at_level(logging.WARNING):
+            client.get(url_for('api.products', page=2, per_page=5))
+    finally:
+        app.config["SLOW_REQUEST_QUERIES"] = 20
+    assert "slow request GET /api/v1/products" in caplog.text
+
+    body = client.get(url_for('metrics.serve_metrics'), headers=METRICS_HEADERS).get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",endpoint="/api/v1/products"}' in body
+
+
+def test_metrics_are_not_served_without_a_token(file_app):
+    flask_app = file_app(METRICS_TOKEN=None)
+    assert flask_app.test_client().get("/metrics").status_code == 404
+
+
+def test_failed_statement_is_not_timed_with_the_next_one(app, db):
+    from flask import g
+    from sqlalchemy import text
+
+    with app.test_request_context("/api/v1/products"):
+        app.preprocess_request()
+        with pytest.raises(exc.OperationalError):
+            db.session.execute(text("SELECT * FROM missing_table"))
+        db.session.rollback()
+        db.session.execute(text("SELECT 1"))
+        assert g.sql_count == 1
+        assert not db.session.connection().info.get("statement_started")
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from flask import url_for
+from sqlalchemy import text
+from vm.models import Order, OrderItem
+from vm.commons.pagination import encode_cursor
+from vm.commons.purchase import OrderLine, PlacedOrder, record_orders
+
+
+def test_orders_are_recorded(client, db, roles, create_user_headers, create_products, buy):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, chips = create_products(client, seller_headers, ("cola", 15, 5), ("chips", 20, 5))
+
+    buy(client, buyer_headers, (cola, 2), (chips, 1), (cola, 1))
+    # the seller changes the price afterwards, the order keeps what was paid
+    client.put(url_for('api.product_by_id', product_id=cola), json={"cost": 50}, headers=seller_headers)
+
+    rep = client.get(url_for('api.orders'), headers=buyer_headers)
+    assert rep.status_code == 200
+    [order] = rep.get_json()["results"]
+    assert order["total_spent"] == 65
+    assert order["items"] == [
+        {"product_id": cola, "product_name": "cola", "cost": 15, "amount": 3},
+        {"product_id": chips, "product_name": "chips", "cost": 20, "amount": 1},
+    ]
+
+    # a deleted product stays in the sales
+    client.delete(url_for('api.product_by_id', product_id=chips), headers=seller_headers)
+    rep = client.get(url_for('api.sales', product_id=chips), headers=seller_headers)
+    [sale] = rep.get_json()["results"]
+    assert (sale["order_id"], sale["product_name"], sale["amount"]) == (order["id"], "chips", 1)
+
+    assert client.get(url_for('api.sales'), headers=buyer_headers).status_code == 401
+    assert client.get(url_for('api.orders'), headers=seller_headers).status_code == 401
+
+
+def test_orders_keyset_pages_most_recent_first(client, db, roles, create_user_headers, create_products, buy):
+    seller, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    _, other_headers = create_user_headers(client, "other", "BUYER")
+    [cola] = create_products(client, seller_headers, ("cola", 5, 100))
+    buy(client, other_headers, (cola, 1))
+
+    # five orders an hour apart, two of them at the same time
+    start = datetime(2022, 10, 1)
+    dates = [start, start + timedelta(hours=1), start + timedelta(hours=1), start + timedelta(hours=2),
+             start + timedelta(hours=3)]
+    for i, created_at in enumerate(dates):
+        order = Order(user_id=buyer.id, total_spent=5 * (i + 1), created_at=created_at)
+        order.items.append(OrderItem(product_id=cola, seller_id=seller.id, product_name="cola", cost=5,
+                                     amount=i + 1, created_at=created_at))
+        db.session.add(order)
+    db.session.commit()
+
+    rep = client.get(url_for('api.orders', cursor="", per_page=2), headers=buyer_headers).get_json()
+    assert rep["total"] == 5
+    seen = [order["total_spent"] for order in rep["results"]]
+    while rep["next"]:
+        rep = client.get(rep["next"], headers=buyer_headers).get_json()
+        seen += [order["total_spent"] for order in rep["results"]]
+    assert seen == [25, 20, 15, 10, 5]
+
+    previous = client.get(rep["prev"], headers=buyer_headers).get_json()
+    assert [order["total_spent"] for order in previous["results"]] == [15, 10]
+
+    rep = client.get(url_for('api.sales', cursor="", since="2022-10-01T01:00:00", until="2022-10-01T03:00:00"),
+                     headers=seller_headers).get_json()
+    assert [sale["amount"] for sale in rep["results"]] == [4, 3, 2]
+
+    rep = client.get(url_for('api.orders', since="yesterday"), headers=buyer_headers)
+    assert rep.status_code == 400
+    for values in ([20221001, 3], ["2022-10-01T00:00:00", "3"]):
+        rep = client.get(url_for('api.orders', cursor=encode_cursor("next", values)), headers=buyer_headers)
+        assert rep.status_code == 400, values
+
+
+def test_user_with_orders_can_be_deleted(client, db, roles, create_user_headers, create_products, buy):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    buyer, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    [cola] = create_products(client, seller_headers, ("cola", 5, 10))
+    buy(client, buyer_headers, (cola, 1))
+
+    # enforced like Postgres does
+    db.session.execute(text("PRAGMA foreign_keys = ON"))
+    try:
+        rep = client.delete(url_for('api.user_by_id', user_id=buyer.id), headers=buyer_headers)
+        assert rep.status_code == 200
+    finally:
+        db.session.execute(text("PRAGMA foreign_keys = OFF"))
+    # the seller keeps the sale
+    [sale] = client.get(url_for('api.sales'), headers=seller_headers).get_json()["results"]
+    assert db.session.get(Order, sale["order_id"]).user_id is None
+
+
+def test_record_orders_statements_do_not_grow_with_the_batch(db, assert_max_queries):
+    orders = [
+        PlacedOrder(user_id=1, created_at=datetime(2022, 10, 1, i),
+                    lines=[OrderLine(product_id=i, seller_id=2, product_name="p%d" % i, cost=5, amount=1)] * 2)
+        for i in range(20)
+    ]
+    # ids, orders, items and rollups
+    with assert_max_queries(4):
+        ids = record_orders(orders)
+    assert len(set(ids)) == 20
+    for order_id, order in zip(ids, orders):
+        assert [item.product_id for item in db.session.get(Order, order_id).items] == [order.lines[0].product_id] * 2
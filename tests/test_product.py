@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+from flask import url_for
+from vm.models import Product
+from vm.extensions import catalog_cache
+from vm.commons.pagination import encode_cursor
+
+
+def test_get_products_offset(client, db, create_catalog):
+    create_catalog(db, 7)
+
+    rep = client.get(url_for('api.products', page=2, per_page=3))
+    assert rep.status_code == 200
+    data = rep.get_json()
+    assert data["total"] == 7
+    assert data["pages"] == 3
+    assert [p["product_name"] for p in data["results"]] == ["product 3", "product 4", "product 5"]
+    assert "page=3" in data["next"]
+    assert "page=1" in data["prev"]
+
+
+def test_get_products_keyset(client, db, create_catalog):
+    ids = create_catalog(db, 7)
+
+    rep = client.get(url_for('api.products', cursor="", per_page=3))
+    data = rep.get_json()
+    assert data["total"] == 7
+    assert data["prev"] is None
+    assert [p["id"] for p in data["results"]] == ids[:3]
+
+    data = client.get(data["next"]).get_json()
+    assert [p["id"] for p in data["results"]] == ids[3:6]
+
+    last = client.get(data["next"]).get_json()
+    assert [p["id"] for p in last["results"]] == ids[6:]
+    assert last["next"] is None
+
+    data = client.get(last["prev"]).get_json()
+    assert [p["id"] for p in data["results"]] == ids[3:6]
+
+    rep = client.get(url_for('api.products', cursor="", per_page=3, count="false"))
+    data = rep.get_json()
+    assert data["total"] is None
+    assert data["pages"] is None
+    assert "count=false" in data["next"]
+
+    rep = client.get(url_for('api.products', cursor="not a cursor"))
+    assert rep.status_code == 400
+    for values in (["3"], [True], [{"id": 3}], [3, 4], []):
+        rep = client.get(url_for('api.products', cursor=encode_cursor("next", values)))
+        assert rep.status_code == 400, values
+
+
+def test_get_products_conditional(client, db, create_catalog):
+    ids = create_catalog(db, 2)
+    product_url = url_for('api.product_by_id', product_id=ids[0])
+
+    rep = client.get(product_url)
+    assert rep.status_code == 200
+    etag = rep.headers["ETag"]
+    assert not etag.startswith("W/")
+
+    rep = client.get(product_url, headers={"If-None-Match": etag})
+    assert rep.status_code == 304
+    assert rep.get_data() == b""
+
+    # writes made outside the resources are only seen once the cache is invalidated
+    db.session.get(Product, ids[0]).amount_available = 42
+    db.session.commit()
+    rep = client.get(product_url, headers={"If-None-Match": etag})
+    assert rep.status_code == 304
+    catalog_cache.invalidate()
+    rep = client.get(product_url, headers={"If-None-Match": etag})
+    assert rep.status_code == 200
+    assert rep.get_json()["Product"]["amount_available"] == 42
+    assert rep.headers["ETag"] != etag
+
+
+def test_export_products(client, app, db, create_catalog):
+    ids = create_catalog(db, 7)
+    app.config["PRODUCT_EXPORT_BATCH_SIZE"] = 3
+    try:
+        rep = client.get(url_for('api.products_export'))
+        assert rep.status_code == 200
+        assert rep.mimetype == "application/x-ndjson"
+        lines = rep.get_data(as_text=True).splitlines()
+        assert [json.loads(line)["id"] for line in lines] == ids
+        assert json.loads(lines[0]) == {"id": ids[0], "product_name": "product 0", "cost": 5, "amount_available": 1}
+
+        rep = client.get(url_for('api.products_export', format="csv", since_id=ids[4]))
+        assert rep.mimetype == "text/csv"
+        rows = list(csv.reader(io.StringIO(rep.get_data(as_text=True))))
+        assert rows[0] == ["id", "cost", "amount_available", "product_name"]
+        assert rows[1:] == [[str(ids[5]), "5", "1", "product 5"], [str(ids[6]), "5", "1", "product 6"]]
+
+        assert client.get(url_for('api.products_export', since_id="x")).status_code == 400
+        assert client.get(url_for('api.products_export', format="xml")).status_code == 400
+    finally:
+        app.config["PRODUCT_EXPORT_BATCH_SIZE"] = 1000
+
+
+def test_bulk_upsert_products(client, app, db, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    _, other_headers = create_user_headers(client, "other", "SELLER")
+    other_id, = create_products(client, other_headers, ("taken", 5, 1))
+    cola_id, = create_products(client, seller_headers, ("cola", 15, 5))
+
+    app.config["PRODUCT_BULK_BATCH_SIZE"] = 2
+    try:
+        rep = client.post(url_for('api.products_bulk'), headers=seller_headers, json=[
+            {"product_name": "cola", "cost": 20, "amount_available": 8},
+            {"product_name": "chips", "cost": 10, "amount_available": 3},
+            {"product_name": "taken", "cost": 10, "amount_available": 3},
+            {"product_name": "bad", "cost": 7, "amount_available": 3},
+            {"product_name": "chips", "cost": 15, "amount_available": 3},
+            "cola",
+        ])
+    finally:
+        app.config["PRODUCT_BULK_BATCH_SIZE"] = 500
+    assert rep.status_code == 200
+    data = rep.get_json()
+    assert (data["created"], data["updated"], data["errors"]) == (1, 1, 4)
+    results = data["results"]
+    assert [result["index"] for result in results] == list(range(6))
+    assert results[0] == {"index": 0, "status": "updated", "id": cola_id}
+    assert results[1]["status"] == "created"
+    assert results[2] == {"index": 2, "status": "error", "msg": "product exist with this name"}
+    assert "cost" in results[3]["errors"]
+    assert results[4]["status"] == results[5]["status"] == "error"
+
+    assert db.session.get(Product, cola_id).cost == 20
+    assert db.session.get(Product, cola_id).amount_available == 8
+    assert db.session.get(Product, other_id).cost == 5
+    chips = db.session.get(Product, results[1]["id"])
+    assert (chips.product_name, chips.amount_available) == ("chips", 3)
+
+    lines = '{"product_name": "chips", "cost": 25, "amount_available": 4}\n\nnot json\n'
+    rep = client.post(url_for('api.products_bulk'), data=lines,
+                      headers=dict(seller_headers, **{"content-type": "application/x-ndjson"}))
+    assert [result["status"] for result in rep.get_json()["results"]] == ["updated", "error"]
+    assert db.session.get(Product, chips.id).cost == 25
+
+    rep = client.post(url_for('api.products_bulk'), json={"product_name": "cola"}, headers=seller_headers)
+    assert rep.status_code == 400
+
+
+def test_restock_products(client, db, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    _, other_headers = create_user_headers(client, "other", "SELLER")
+    cola, chips = create_products(client, seller_headers, ("cola", 15, 5), ("chips", 20, 2))
+    taken, = create_products(client, other_headers, ("taken", 5, 1))
+    restock_url = url_for('api.products_restock')
+
+    rep = client.post(restock_url, json={str(cola): 10, str(chips): -2}, headers=seller_headers)
+    assert rep.status_code == 200
+    assert rep.get_json() == {"msg": "Products restocked", "restocked": 2}
+    assert db.session.get(Product, cola).amount_available == 15
+    assert db.session.get(Product, chips).amount_available == 0
+
+    # nothing is applied when one delta is refused
+    rep = client.post(restock_url, json={str(cola): 1, str(chips): -1}, headers=seller_headers)
+    assert rep.status_code == 400
+    rep = client.post(restock_url, json={str(cola): 1, str(taken): 1}, headers=seller_headers)
+    assert rep.status_code == 401
+    rep = client.post(restock_url, json={str(cola): 1, str(taken + 1): 1}, headers=seller_headers)
+    assert rep.status_code == 404
+    assert db.session.get(Product, cola).amount_available == 15
+
+    for body in ({"x": 1}, {str(cola): "1"}, [1]):
+        assert client.post(restock_url, json=body, headers=seller_headers).status_code == 400
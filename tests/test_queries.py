@@ -0,0 +1,46 @@
+import re
+from flask import url_for
+from vm.commons.pagination import encode_cursor
+
+
+def test_buy_statements(client, db, assert_max_queries, roles, create_user_headers, create_products):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    _, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    products = create_products(client, seller_headers, *[("product %d" % i, 5, 10) for i in range(20)])
+    client.post(url_for('api.deposit'), json=[{"deposit": 100}], headers=buyer_headers)
+
+    # user, products, coins, stock, deposit and its read back, the order, its
+    # items and the sales rollups, the token revocation answer is cached
+    # since the deposit
+    basket = [{"id": product_id, "amount_to_buy": 1} for product_id in products]
+    with assert_max_queries(9) as statements:
+        rep = client.post(url_for('api.buy'), json=basket, headers=buyer_headers)
+    assert rep.status_code == 201
+    # the basket size does not change the number of statements
+    assert len([statement for statement in statements if re.search(r"\bproduct\b", statement.lower())]) <= 2
+
+
+def test_deposit_statements(client, db, assert_max_queries, roles, create_user_headers):
+    _, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+
+    with assert_max_queries(5):
+        rep = client.post(url_for('api.deposit'), json=[{"deposit": 5}] * 10, headers=buyer_headers)
+    assert rep.status_code == 201
+
+
+def test_products_statements(client, db, assert_max_queries, create_catalog):
+    ids = create_catalog(db, 120)
+
+    with assert_max_queries(2):
+        rep = client.get(url_for('api.products', page=3, per_page=50))
+    assert len(rep.get_json()["results"]) == 20
+
+    with assert_max_queries(1):
+        rep = client.get(url_for('api.products', cursor=encode_cursor("next", [ids[49]]), count="false"))
+    assert len(rep.get_json()["results"]) == 50
+
+    with assert_max_queries(1):
+        client.get(url_for('api.product_by_id', product_id=ids[0]))
+    # answered from the catalog cache
+    with assert_max_queries(0):
+        client.get(url_for('api.product_by_id', product_id=ids[0]))
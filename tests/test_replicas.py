@@ -0,0 +1,109 @@
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import create_engine, text
+
+from vm.extensions import db, replicas, revocation_cache
+from vm.models import Product, Role, User
+
+
+@pytest.fixture
+def replica_app(file_app, tmp_path):
+    """App whose replica is a second SQLite file, nothing replicates to it"""
+    flask_app = file_app(
+        DATABASE_REPLICAS={"replica_0": f"sqlite:///{tmp_path / 'replica.db'}"},
+        DATABASE_REPLICA_PIN_SECONDS=60,
+        CATALOG_CACHE_TTL=0,
+    )
+    with flask_app.app_context():
+        db.metadata.create_all(db.engines["replica_0"])
+        for bind in (None, "replica_0"):
+            with db.engines[bind].begin() as connection:
+                connection.execute(Role.__table__.insert(), [{"id": 2, "name": "BUYER"}, {"id": 3, "name": "SELLER"}])
+                connection.execute(User.__table__.insert(), [
+                    {"id": 1, "username": "seller", "password": "x", "role_id": 3, "active": True},
+                    # the username tells which database answered
+                    {"id": 2, "username": "buyer" if bind is None else "replica buyer", "password": "x",
+                     "role_id": 2, "active": True},
+                ])
+        seller_headers = {"authorization": "Bearer %s" % create_access_token(identity=1)}
+        buyer_headers = {"authorization": "Bearer %s" % create_access_token(identity=2)}
+    return flask_app, seller_headers, buyer_headers
+
+
+def product_names(client, headers=None):
+    return [p["product_name"] for p in client.get("/api/v1/products", headers=headers).get_json()["results"]]
+
+
+def test_reads_go_to_replica_and_writers_are_pinned(replica_app):
+    flask_app, seller_headers, buyer_headers = replica_app
+    client = flask_app.test_client()
+
+    rep = client.post("/api/v1/products", json={"product_name": "cola", "cost": 5, "amount_available": 3},
+                      headers=seller_headers)
+    assert rep.status_code == 201
+    product_id = rep.get_json()["Product"]["id"]
+
+    # anonymous and other users read the replica, which did not get the write
+    assert product_names(client) == []
+    assert product_names(client, buyer_headers) == []
+    assert client.get(f"/api/v1/products/{product_id}").status_code == 404
+    # but the token user is loaded from the primary
+    assert client.get("/api/v1/users/2", headers=buyer_headers).get_json()["user"]["username"] == "buyer"
+
+    # the writer reads its own write from the primary
+    assert product_names(client, seller_headers) == ["cola"]
+    assert client.get(f"/api/v1/products/{product_id}", headers=seller_headers).status_code == 200
+
+    replicas.pins.clear()
+    assert product_names(client, seller_headers) == []
+
+
+def test_anonymous_writes_pin_the_user_written(replica_app):
+    flask_app, seller_headers, buyer_headers = replica_app
+    client = flask_app.test_client()
+    credentials = {"username": "newcomer", "password": "stringString2"}
+
+    rep = client.post("/api/v1/users", json=dict(credentials, role_name="BUYER"))
+    assert rep.status_code == 201
+    user_id = rep.get_json()["user"]["id"]
+    assert replicas.pins.get(user_id)
+
+    replicas.pins.clear()
+    access_token = client.post("/auth/login", json=credentials).get_json()["access_token"]
+    assert replicas.pins.get(user_id)
+    # the replica does not have the user yet
+    rep = client.get(f"/api/v1/users/{user_id}", headers={"authorization": "Bearer %s" % access_token})
+    assert rep.get_json()["user"]["username"] == "newcomer"
+
+
+def test_lagging_or_unreachable_replica_falls_back_to_primary(replica_app, monkeypatch):
+    flask_app, seller_headers, buyer_headers = replica_app
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        with db.engines[None].begin() as connection:
+            connection.execute(Product.__table__.insert(), {"product_name": "chips", "cost": 5,
+                                                            "amount_available": 1, "seller_id": 1})
+
+    for lag in (replicas.max_lag + 1, None):
+        replicas._lags.clear()
+        monkeypatch.setattr(replicas, "measure_lag", lambda key: lag)
+        assert product_names(client) == ["chips"]
+        assert client.get("/api/v1/users/2", headers=buyer_headers).get_json()["user"]["username"] == "buyer"
+
+    replicas._lags.clear()
+    monkeypatch.setattr(replicas, "measure_lag", lambda key: replicas.max_lag)
+    assert product_names(client) == []
+
+
+def test_revocation_is_checked_on_primary(replica_app):
+    flask_app, seller_headers, buyer_headers = replica_app
+    client = flask_app.test_client()
+    assert client.delete("/auth/revoke_access", headers=buyer_headers).status_code == 200
+
+    replica = create_engine(flask_app.config["SQLALCHEMY_BINDS"]["replica_0"])
+    with replica.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM token_blocklist")).scalar() == 0
+    # forget what this worker knows, the check has to read the database
+    revocation_cache.entries.clear()
+    rep = client.get("/api/v1/users/2", headers=buyer_headers)
+    assert rep.status_code == 401
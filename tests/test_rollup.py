@@ -0,0 +1,77 @@
+from datetime import datetime
+from flask import url_for
+from sqlalchemy import text
+from vm.models import OrderItem, SalesRollup
+from vm.commons.rollup import add_sales, rebuild_sales_rollups
+
+
+def rollups(db):
+    rows = db.session.query(SalesRollup).order_by(SalesRollup.granularity, SalesRollup.bucket,
+                                                  SalesRollup.product_id)
+    return [(row.granularity, row.bucket, row.product_id, row.units, row.revenue) for row in rows]
+
+
+def test_purchases_are_rolled_up(client, db, roles, create_user_headers, create_products, buy):
+    _, seller_headers = create_user_headers(client, "seller", "SELLER")
+    _, other_headers = create_user_headers(client, "other seller", "SELLER")
+    _, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    cola, chips = create_products(client, seller_headers, ("cola", 15, 10), ("chips", 20, 10))
+    [gum] = create_products(client, other_headers, ("gum", 5, 10))
+
+    buy(client, buyer_headers, (cola, 2), (chips, 1))
+    buy(client, buyer_headers, (cola, 1), (gum, 4))
+
+    rep = client.get(url_for('api.sales_rollup'), headers=seller_headers)
+    assert rep.status_code == 200
+    assert [(row["product_id"], row["units"], row["revenue"]) for row in rep.get_json()["results"]] == [
+        (chips, 1, 20), (cola, 3, 45),
+    ]
+    rep = client.get(url_for('api.sales_rollup', granularity="hour", product_id=gum), headers=other_headers)
+    [row] = rep.get_json()["results"]
+    assert (row["units"], row["revenue"]) == (4, 20)
+    assert datetime.fromisoformat(row["bucket"]).minute == 0
+
+    assert client.get(url_for('api.sales_rollup'), headers=buyer_headers).status_code == 401
+    assert client.get(url_for('api.sales_rollup', granularity="week"), headers=seller_headers).status_code == 400
+
+    # rebuilt from the order history, the rollups are the same
+    incremental = rollups(db)
+    assert rebuild_sales_rollups() == len(incremental) == 6
+    assert rollups(db) == incremental
+
+
+def test_rollup_buckets(db):
+    item = {"seller_id": 1, "product_id": 7, "cost": 5}
+    add_sales([
+        dict(item, amount=1, created_at=datetime(2022, 10, 1, 9, 59)),
+        dict(item, amount=2, created_at=datetime(2022, 10, 1, 10, 0)),
+        dict(item, amount=3, created_at=datetime(2022, 10, 1, 10, 30)),
+        # nobody to report to
+        dict(item, seller_id=None, amount=1, created_at=datetime(2022, 10, 1, 10, 30)),
+    ])
+    add_sales([dict(item, amount=4, created_at=datetime(2022, 10, 2, 0, 0))])
+
+    assert rollups(db) == [
+        ("day", datetime(2022, 10, 1), 7, 6, 30),
+        ("day", datetime(2022, 10, 2), 7, 4, 20),
+        ("hour", datetime(2022, 10, 1, 9), 7, 1, 5),
+        ("hour", datetime(2022, 10, 1, 10), 7, 5, 25),
+        ("hour", datetime(2022, 10, 2), 7, 4, 20),
+    ]
+
+
+def test_seller_with_sales_can_be_deleted(client, db, roles, create_user_headers, create_products, buy):
+    seller, seller_headers = create_user_headers(client, "seller", "SELLER")
+    _, buyer_headers = create_user_headers(client, "buyer", "BUYER")
+    [cola] = create_products(client, seller_headers, ("cola", 5, 10))
+    buy(client, buyer_headers, (cola, 1))
+
+    # enforced like Postgres does
+    db.session.execute(text("PRAGMA foreign_keys = ON"))
+    try:
+        rep = client.delete(url_for('api.user_by_id', user_id=seller.id), headers=seller_headers)
+        assert rep.status_code == 200
+    finally:
+        db.session.execute(text("PRAGMA foreign_keys = OFF"))
+    assert [row.seller_id for row in db.session.query(SalesRollup)] == [None, None]
+    assert [item.seller_id for item in db.session.query(OrderItem)] == [None]
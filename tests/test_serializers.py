@@ -0,0 +1,42 @@
+import json
+from marshmallow import Schema, fields, post_dump
+from vm.api.schemas import ProductSchema, UserSchema, UserRegisterSchema, \
+    product_serializer, products_serializer, user_serializer, user_register_serializer
+from vm.commons.serializers import CompiledSchema
+from vm.models import Product, User
+
+
+def test_compiled_output_is_identical():
+    products = [Product(id=i, product_name="product %d" % i, cost=5 * i, amount_available=i) for i in range(3)]
+    products.append(Product(id=None, product_name=None, cost=None, amount_available=None))
+    user = User(id=1, username="user", password="stringString2", active=True, deposit=20)
+
+    cases = [
+        (product_serializer, ProductSchema(), products[0]),
+        (products_serializer, ProductSchema(many=True), products),
+        (user_serializer, UserSchema(), user),
+        (user_register_serializer, UserRegisterSchema(), user),
+    ]
+    for serializer, schema, obj in cases:
+        assert serializer._dump_one is not None
+        assert json.dumps(serializer.dump(obj)) == json.dumps(schema.dump(obj))
+
+
+def test_uncompilable_schema_falls_back():
+    class HookSchema(Schema):
+        id = fields.Int()
+
+        @post_dump
+        def wrap(self, data, **kwargs):
+            return {"wrapped": data}
+
+    class NestedSchema(Schema):
+        id = fields.Int()
+        items = fields.List(fields.Int())
+
+    obj = Product(id=3)
+    obj.items = [1, 2]
+    for schema in (HookSchema(), NestedSchema()):
+        serializer = CompiledSchema(schema)
+        assert serializer._dump_one is None
+        assert serializer.dump(obj) == schema.dump(obj)
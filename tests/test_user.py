@@ -202,7 +202,7 @@ def test_buy(client, db):
     data = resp.get_json()
     assert data['msg'] == "Order created"
     assert resp.status_code == 201
-    assert data['change_to_return'] == {'100': 0, '50': 1, '20': 0, '10': 1, '5': 1}
+    assert data['change_to_return'] == {'50': 1, '10': 1, '5': 1}
 
 
 
@@ -210,3 +210,29 @@ def test_buy(client, db):
 
 
 
+
+
+def test_deposit_coins_batch(client, db):
+    deposit_url = url_for('api.deposit')
+    users_url = url_for('api.users')
+    db.session.add(Role(id=2, name="BUYER"))
+
+    rep = client.post(users_url, json={"username": "created",
+                                       "role_name": "BUYER",
+                                       "password": "stringString2"})
+    data = rep.get_json()
+    d_named = namedtuple('Struct', data['user'].keys())(*data['user'].values())
+    current_user_headers = get_current_user_token(client, d_named)
+
+    # a single invalid coin rejects the whole batch
+    data = [{"deposit": 5}, {"deposit": 13}]
+    rep = client.post(deposit_url, json=data, headers=current_user_headers)
+    assert rep.status_code == 400
+
+    data = [{"deposit": 5}, {"deposit": 10}, {"deposit": 100}]
+    rep = client.post(deposit_url, json=data, headers=current_user_headers)
+    assert rep.status_code == 201
+    assert rep.get_json()["current_deposit"] == 115
+
+    rep = client.post(deposit_url, json={"deposit": 20}, headers=current_user_headers)
+    assert rep.get_json()["current_deposit"] == 135
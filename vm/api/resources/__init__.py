@@ -1,6 +1,9 @@
 from vm.api.resources.user import UserResource, UserList
-from vm.api.resources.product import ProductResource, ProductList
+from vm.api.resources.product import ProductResource, ProductList, ProductExport, ProductBulk, \
+    ProductRestock
 from vm.api.resources.buyer import DepositResource, ResetResource, BuyResource
+from vm.api.resources.order import OrderList, SaleList, SalesRollupList
 
-__all__ = ["UserResource", "UserList", "ProductResource", "ProductList",
-           "DepositResource", "ResetResource", "BuyResource"]
+__all__ = ["UserResource", "UserList", "ProductResource", "ProductList", "ProductExport", "ProductBulk",
+           "ProductRestock", "DepositResource", "ResetResource", "BuyResource",
+           "OrderList", "SaleList", "SalesRollupList"]
@@ -1,11 +1,11 @@
 from flask import request, current_app
 from flask_restful import Resource
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user
 from vm.api.schemas import UserSchema, ProductSchema, UserDepositSchema, BuyProductSchema
-from vm.models import User, Product
-from vm.extensions import db
+from vm.extensions import catalog_cache
 from vm.commons.pagination import paginate
 from vm.commons.decorators_helper import error_handler_jwt_extended, check_is_role
+from vm.commons.purchase import buy_products, add_deposit, return_deposit, PurchaseError
 from marshmallow import ValidationError
 
 
@@ -16,6 +16,10 @@ class BuyResource(Resource):
    post:
       tags:
         - api
+      description: >
+        The deposit is spent as a whole, what the basket does not cost is paid
+        back as change_to_return and the deposit is left at 0, as the reset
+        would. A purchase the machine can not give the change of is refused.
       requestBody:
         content:
           application/json:
@@ -39,6 +43,7 @@ class BuyResource(Resource):
                     type: integer
                   change_to_return:
                     type: object
+                    description: coins paid back, coin -> count, coins not used are left out
 
     """
 
@@ -51,35 +56,18 @@ class BuyResource(Resource):
             products_to_buy = schema.load(request.json)
         except ValidationError as e:
             return {"msg": str(e)}, 400
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        total_spent = 0
-        products_bought = []
-
-        for product_buy in products_to_buy:
-            product = Product.query.get(product_buy.id)
-            if product is None:
-                return {"msg": f"Product {product_buy.id} does not exist"}
-            if product.amount_available < product_buy.amount_to_buy :
-                return {"msg": f"Product {product_buy.id} not available in this quantity"}
-            total_spent += product_buy.amount_to_buy * product.cost
-            products_bought.append(product.product_name)
-            product.amount_available = product.amount_available - product_buy.amount_to_buy
-            db.session.add(product)
-        current_user.deposit -= total_spent
-        if current_user.deposit < 0:
-            return {"msg": "Deposit not sufficient for this product(s)"}
-        db.session.add(current_user)
-        db.session.commit()
-
-        change_to_return = {}
-        for coins in [100, 50, 20, 10, 5]:
-            if current_user.deposit / coins > 0:
-                change_to_return[coins] = int(current_user.deposit / coins)
-                current_user.deposit -= coins * change_to_return[coins]
-
-        return {"msg": "Order created", "change_to_return": change_to_return,
-                "Products": products_bought, "total_spent": total_spent}, 201
+        try:
+            journal = current_app.extensions.get("purchase_journal")
+            if journal is not None:
+                receipt = journal.buy(get_current_user(), products_to_buy)
+            else:
+                receipt = buy_products(get_current_user(), products_to_buy)
+        except PurchaseError as e:
+            return {"msg": str(e)}, 400
+        catalog_cache.invalidate()
+
+        return {"msg": "Order created", "change_to_return": receipt.change,
+                "Products": receipt.products, "total_spent": receipt.total_spent}, 201
 
 
 class DepositResource(Resource):
@@ -90,10 +78,14 @@ class DepositResource(Resource):
       tags:
         - api
       requestBody:
+        description: a single coin or a list of coins inserted at once
         content:
           application/json:
             schema:
-              UserDepositSchema
+              oneOf:
+                - UserDepositSchema
+                - type: array
+                  items: UserDepositSchema
       responses:
         201:
           content:
@@ -115,18 +107,17 @@ class DepositResource(Resource):
     @check_is_role(role_name='BUYER')
     def post(self):
         try:
-            current_user_id = get_jwt_identity()
-            current_user = User.query.get_or_404(current_user_id)
-            schema = UserDepositSchema()
-            user = schema.load(request.json)
-            current_app.logger.warning(user)
-            current_user.deposit += user.deposit
-
-            db.session.add(current_user)
-            db.session.commit()
+            many = isinstance(request.json, list)
+            schema = UserDepositSchema(many=many)
+            coins = schema.load(request.json)
         except ValidationError as e:
             return {"msg": str(e)}, 400
-        return {"msg": "Deposit added", "current_deposit": current_user.deposit}, 201
+
+        inserted = [coin.deposit for coin in coins] if many else [coins.deposit]
+        deposit = add_deposit(get_jwt_identity(), inserted)
+        if deposit is None:
+            return {"msg": "User not found"}, 404
+        return {"msg": "Deposit added", "current_deposit": deposit}, 201
 
 
 class ResetResource(Resource):
@@ -146,25 +137,24 @@ class ResetResource(Resource):
                     example: Deposit reset
                   change_to_return:
                     type: object
+                  current_deposit:
+                    type: integer
+                    description: part of the deposit the machine had no coins to pay back
+                    example: 0
     """
 
     @error_handler_jwt_extended
     @jwt_required()
     @check_is_role(role_name='BUYER')
     def get(self):
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get_or_404(current_user_id)
-
-        deposit = current_user.deposit
-        current_user.deposit = 0
-
-        db.session.add(current_user)
-        db.session.commit()
-        change_to_return = {}
-
-        for coins in [100, 50, 20, 10, 5]:
-            if deposit / coins > 0:
-                change_to_return[coins] = int(deposit / coins)
-                deposit -= coins * change_to_return[coins]
+        try:
+            journal = current_app.extensions.get("purchase_journal")
+            if journal is not None:
+                deposit, change_to_return = journal.return_deposit(get_current_user())
+            else:
+                deposit, change_to_return = return_deposit(get_current_user())
+        except PurchaseError as e:
+            return {"msg": str(e)}, 400
 
-        return {"msg": "Deposit reset", "change_to_return": change_to_return}, 201
+        return {"msg": "Deposit reset", "change_to_return": change_to_return,
+                "current_deposit": deposit}, 201
@@ -0,0 +1,255 @@
+from datetime import timezone
+
+from flask import request
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import selectinload
+from vm.api.schemas import OrderRangeSchema, RollupRangeSchema, orders_serializer, sales_serializer, \
+    rollups_serializer
+from vm.models import Order, OrderItem, SalesRollup
+from vm.extensions import replicas
+from vm.commons.pagination import paginate
+from vm.commons.decorators_helper import error_handler_jwt_extended, check_is_role
+
+
+def naive_utc(value):
+    """Dates are stored as naive UTC"""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def in_range(query, column, args):
+    """Filter query on ``since <= column < until`` from the loaded query string"""
+    if "since" in args:
+        query = query.filter(column >= naive_utc(args["since"]))
+    if "until" in args:
+        query = query.filter(column < naive_utc(args["until"]))
+    return query
+
+
+ORDERS_KEYSET = (Order.created_at, Order.id)
+SALES_KEYSET = (OrderItem.created_at, OrderItem.id)
+ROLLUPS_KEYSET = (SalesRollup.bucket, SalesRollup.product_id)
+
+
+def orders_query(user_id, args):
+    """Orders of a buyer in the loaded range, most recent first"""
+    query = (
+        Order.query.filter(Order.user_id == user_id)
+        .options(selectinload(Order.items))
+        .order_by(Order.created_at.desc(), Order.id.desc())
+    )
+    return in_range(query, Order.created_at, args)
+
+
+def sales_query(seller_id, args):
+    """Items sold by a seller in the loaded range, most recent first"""
+    query = OrderItem.query.filter(OrderItem.seller_id == seller_id)
+    if "product_id" in args:
+        query = query.filter(OrderItem.product_id == args["product_id"])
+    return in_range(query, OrderItem.created_at, args).order_by(OrderItem.created_at.desc(), OrderItem.id.desc())
+
+
+def rollups_query(seller_id, args):
+    """Sales rollups of a seller in the loaded range, most recent first"""
+    query = SalesRollup.query.filter(SalesRollup.seller_id == seller_id, SalesRollup.granularity == args["granularity"])
+    if "product_id" in args:
+        query = query.filter(SalesRollup.product_id == args["product_id"])
+    return in_range(query, SalesRollup.bucket, args).order_by(SalesRollup.bucket.desc(), SalesRollup.product_id.desc())
+
+
+class OrderList(Resource):
+    """Orders of the current buyer, most recent first
+
+    ---
+    get:
+      tags:
+        - api
+      parameters:
+        - in: query
+          name: since
+          description: only list what was bought at or after this date, ISO 8601 UTC
+          schema:
+            type: string
+            format: date-time
+        - in: query
+          name: until
+          description: only list what was bought before this date, ISO 8601 UTC
+          schema:
+            type: string
+            format: date-time
+        - in: query
+          name: cursor
+          description: keyset pagination, empty for the first page then the cursor of next/prev links
+          schema:
+            type: string
+        - in: query
+          name: per_page
+          schema:
+            type: integer
+        - in: query
+          name: count
+          description: set to false to skip the total count in keyset mode
+          schema:
+            type: boolean
+      responses:
+        200:
+          content:
+            application/json:
+              schema:
+                allOf:
+                  - $ref: '#/components/schemas/PaginatedResult'
+                  - type: object
+                    properties:
+                      results:
+                        type: array
+                        items:
+                          $ref: '#/components/schemas/OrderSchema'
+        400:
+          description: invalid date or cursor
+    """
+
+    @error_handler_jwt_extended
+    @jwt_required()
+    @replicas.read_only
+    @check_is_role(role_name='BUYER')
+    def get(self):
+        query = orders_query(get_jwt_identity(), OrderRangeSchema().load(request.args))
+        return paginate(query, orders_serializer, keyset=ORDERS_KEYSET, descending=True)
+
+
+class SaleList(Resource):
+    """Items sold of the current seller products, most recent first
+
+    ---
+    get:
+      tags:
+        - api
+      parameters:
+        - in: query
+          name: product_id
+          description: only list the sales of this product
+          schema:
+            type: integer
+        - in: query
+          name: since
+          description: only list what was bought at or after this date, ISO 8601 UTC
+          schema:
+            type: string
+            format: date-time
+        - in: query
+          name: until
+          description: only list what was bought before this date, ISO 8601 UTC
+          schema:
+            type: string
+            format: date-time
+        - in: query
+          name: cursor
+          description: keyset pagination, empty for the first page then the cursor of next/prev links
+          schema:
+            type: string
+        - in: query
+          name: per_page
+          schema:
+            type: integer
+        - in: query
+          name: count
+          description: set to false to skip the total count in keyset mode
+          schema:
+            type: boolean
+      responses:
+        200:
+          content:
+            application/json:
+              schema:
+                allOf:
+                  - $ref: '#/components/schemas/PaginatedResult'
+                  - type: object
+                    properties:
+                      results:
+                        type: array
+                        items:
+                          $ref: '#/components/schemas/OrderItemSchema'
+        400:
+          description: invalid date, product_id or cursor
+    """
+
+    @error_handler_jwt_extended
+    @jwt_required()
+    @replicas.read_only
+    @check_is_role(role_name='SELLER')
+    def get(self):
+        query = sales_query(get_jwt_identity(), OrderRangeSchema().load(request.args))
+        return paginate(query, sales_serializer, keyset=SALES_KEYSET, descending=True)
+
+
+class SalesRollupList(Resource):
+    """Units sold and revenue of the current seller products per hour or day, most recent first
+
+    Read from the rollups, a page costs one row per product and bucket.
+
+    ---
+    get:
+      tags:
+        - api
+      parameters:
+        - in: query
+          name: granularity
+          schema:
+            type: string
+            enum: [hour, day]
+            default: day
+        - in: query
+          name: product_id
+          description: only list the buckets of this product
+          schema:
+            type: integer
+        - in: query
+          name: since
+          description: only list the buckets starting at or after this date, ISO 8601 UTC
+          schema:
+            type: string
+            format: date-time
+        - in: query
+          name: until
+          description: only list the buckets starting before this date, ISO 8601 UTC
+          schema:
+            type: string
+            format: date-time
+        - in: query
+          name: cursor
+          description: keyset pagination, empty for the first page then the cursor of next/prev links
+          schema:
+            type: string
+        - in: query
+          name: per_page
+          schema:
+            type: integer
+        - in: query
+          name: count
+          description: set to false to skip the total count in keyset mode
+          schema:
+            type: boolean
+      responses:
+        200:
+          content:
+            application/json:
+              schema:
+                allOf:
+                  - $ref: '#/components/schemas/PaginatedResult'
+                  - type: object
+                    properties:
+                      results:
+                        type: array
+                        items:
+                          $ref: '#/components/schemas/SalesRollupSchema'
+        400:
+          description: invalid granularity, date, product_id or cursor
+    """
+
+    @error_handler_jwt_extended
+    @jwt_required()
+    @replicas.read_only
+    @check_is_role(role_name='SELLER')
+    def get(self):
+        query = rollups_query(get_jwt_identity(), RollupRangeSchema().load(request.args))
+        return paginate(query, rollups_serializer, keyset=ROLLUPS_KEYSET, descending=True)
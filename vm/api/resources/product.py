@@ -1,11 +1,17 @@
-from flask import request, current_app
+import csv
+import io
+import json
+
+from flask import request, current_app, Response, stream_with_context
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from vm.api.schemas import ProductSchema
+from vm.api.schemas import ProductSchema, product_serializer, products_serializer, restock_deltas
 from vm.models import Product
-from vm.extensions import db
+from vm.extensions import db, catalog_cache, replicas
 from vm.commons.pagination import paginate
 from vm.commons.decorators_helper import error_handler_jwt_extended, check_is_role
+from vm.commons.catalog import upsert_products, restock_products, CatalogError, ERROR
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from marshmallow import ValidationError
 
@@ -81,10 +87,11 @@ class ProductResource(Resource):
           description: Product does not exists
     """
 
+    @catalog_cache.cached
+    @replicas.read_only
     def get(self, product_id):
-        schema = ProductSchema()
         product = Product.query.get_or_404(product_id)
-        return {"Product": schema.dump(product)}
+        return {"Product": product_serializer.dump(product)}
 
     @error_handler_jwt_extended
     @jwt_required()
@@ -98,8 +105,9 @@ class ProductResource(Resource):
         product = schema.load(request.json, instance=product)
 
         db.session.commit()
+        catalog_cache.invalidate()
 
-        return {"msg": "Product updated", "Product": schema.dump(product)}
+        return {"msg": "Product updated", "Product": product_serializer.dump(product)}
 
     @error_handler_jwt_extended
     @jwt_required()
@@ -111,6 +119,7 @@ class ProductResource(Resource):
             return {"msg": "not authorized to perform this action"}, 401
         db.session.delete(product)
         db.session.commit()
+        catalog_cache.invalidate()
 
         return {"msg": "Product deleted"}
 
@@ -122,6 +131,25 @@ class ProductList(Resource):
     get:
       tags:
         - api
+      parameters:
+        - in: query
+          name: page
+          schema:
+            type: integer
+        - in: query
+          name: per_page
+          schema:
+            type: integer
+        - in: query
+          name: cursor
+          description: keyset pagination, empty for the first page then the cursor of next/prev links
+          schema:
+            type: string
+        - in: query
+          name: count
+          description: set to false to skip the total count in keyset mode
+          schema:
+            type: boolean
       responses:
         200:
           content:
@@ -156,10 +184,11 @@ class ProductList(Resource):
                   Product: ProductSchema
     """
 
+    @catalog_cache.cached
+    @replicas.read_only
     def get(self):
-        schema = ProductSchema(many=True)
         query = Product.query
-        return paginate(query, schema)
+        return paginate(query, products_serializer, keyset=(Product.id,))
 
     @error_handler_jwt_extended
     @jwt_required()
@@ -171,9 +200,254 @@ class ProductList(Resource):
             product.seller_id = get_jwt_identity()
             db.session.add(product)
             db.session.commit()
+            catalog_cache.invalidate()
         except IntegrityError as e:
             return {"msg": "product exist with this name"}, 400
         except ValidationError as e:
             return {"msg": str(e)}, 400
 
-        return {"msg": "Product created", "Product": schema.dump(product)}, 201
+        return {"msg": "Product created", "Product": product_serializer.dump(product)}, 201
+
+
+class ProductExport(Resource):
+    """Whole catalog as a stream, for jobs syncing every product
+
+    ---
+    get:
+      tags:
+        - api
+      parameters:
+        - in: query
+          name: format
+          schema:
+            type: string
+            enum: [ndjson, csv]
+            default: ndjson
+        - in: query
+          name: since_id
+          description: only export products with a greater id, for incremental pulls
+          schema:
+            type: integer
+      responses:
+        200:
+          description: one product per line, ordered by id
+          content:
+            application/x-ndjson:
+              schema: ProductSchema
+            text/csv:
+              schema:
+                type: string
+        400:
+          description: invalid format or since_id
+    """
+
+    formats = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+    def get(self):
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in self.formats:
+            raise ValidationError({"format": [f"Must be one of: {', '.join(self.formats)}."]})
+        try:
+            since_id = int(request.args.get("since_id", 0))
+        except ValueError:
+            raise ValidationError({"since_id": ["Not a valid integer."]})
+
+        # plain rows rather than entities, read through a server side cursor
+        # on Postgres so memory does not grow with the catalog
+        statement = (
+            select(*[getattr(Product, name) for name in product_serializer.schema.dump_fields])
+            .where(Product.id > since_id)
+            .order_by(Product.id)
+            .execution_options(stream_results=True)
+        )
+        generate = self.ndjson if export_format == "ndjson" else self.csv
+        return Response(stream_with_context(generate(statement)), mimetype=self.formats[export_format])
+
+    @staticmethod
+    def batches(statement):
+        result = db.session.execute(statement)
+        return result.partitions(current_app.config["PRODUCT_EXPORT_BATCH_SIZE"])
+
+    @classmethod
+    def ndjson(cls, statement):
+        for batch in cls.batches(statement):
+            lines = [json.dumps(item, separators=(",", ":")) for item in products_serializer.dump(batch)]
+            yield "\n".join(lines) + "\n"
+
+    @classmethod
+    def csv(cls, statement):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(product_serializer.schema.dump_fields)
+        for batch in cls.batches(statement):
+            writer.writerows(item.values() for item in products_serializer.dump(batch))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+class ProductBulk(Resource):
+    """Bulk upsert of the products of a seller
+
+    ---
+    post:
+      tags:
+        - api
+      requestBody:
+        description: products matched by product_name, created or updated
+        content:
+          application/json:
+            schema:
+              type: array
+              items: ProductSchema
+          application/x-ndjson:
+            schema: ProductSchema
+      responses:
+        200:
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  msg:
+                    type: string
+                    example: Products upserted
+                  created:
+                    type: integer
+                  updated:
+                    type: integer
+                  errors:
+                    type: integer
+                  results:
+                    type: array
+                    items:
+                      type: object
+                      properties:
+                        index:
+                          type: integer
+                        status:
+                          type: string
+                          enum: [created, updated, error]
+                        id:
+                          type: integer
+                        msg:
+                          type: string
+                        errors:
+                          type: object
+        400:
+          description: body is not an array or NDJSON, or has too many products
+    """
+
+    @error_handler_jwt_extended
+    @jwt_required()
+    @check_is_role(role_name='SELLER')
+    def post(self):
+        rows = self.read_rows()
+        if rows is None:
+            return {"msg": "expected an array of products or NDJSON"}, 400
+        max_rows = current_app.config["PRODUCT_BULK_MAX_ROWS"]
+        if len(rows) > max_rows:
+            return {"msg": f"at most {max_rows} products per request"}, 400
+
+        schema = ProductSchema(load_instance=False)
+        results, valid, names = {}, [], set()
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                results[index] = {"status": ERROR, "msg": "not a JSON object"}
+                continue
+            try:
+                product = schema.load(row)
+            except ValidationError as e:
+                results[index] = {"status": ERROR, "errors": e.messages}
+                continue
+            if product["product_name"] in names:
+                results[index] = {"status": ERROR, "msg": "product_name repeated in this request"}
+                continue
+            names.add(product["product_name"])
+            valid.append((index, product))
+
+        results.update(upsert_products(get_jwt_identity(), valid, current_app.config["PRODUCT_BULK_BATCH_SIZE"]))
+        db.session.commit()
+        catalog_cache.invalidate()
+
+        results = [dict(result, index=index) for index, result in sorted(results.items())]
+        statuses = [result["status"] for result in results]
+        return {"msg": "Products upserted", "created": statuses.count("created"),
+                "updated": statuses.count("updated"), "errors": statuses.count(ERROR),
+                "results": results}
+
+    @staticmethod
+    def read_rows():
+        """Rows of a JSON array or of an NDJSON body, None if the body is neither"""
+        if request.mimetype == "application/x-ndjson":
+            rows = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    rows.append(None)
+            return rows
+        rows = request.get_json(silent=True)
+        return rows if isinstance(rows, list) else None
+
+
+class ProductRestock(Resource):
+    """Stock deltas for many products of a seller at once
+
+    ---
+    post:
+      tags:
+        - api
+      requestBody:
+        description: product id -> amount to add to amount_available, negative to remove
+        content:
+          application/json:
+            schema:
+              type: object
+              additionalProperties:
+                type: integer
+              example: {"1": 20, "2": -3}
+      responses:
+        200:
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  msg:
+                    type: string
+                    example: Products restocked
+                  restocked:
+                    type: integer
+        400:
+          description: invalid deltas or stock would become negative
+        401:
+          description: a product belongs to another seller
+        404:
+          description: a product does not exist
+    """
+
+    @error_handler_jwt_extended
+    @jwt_required()
+    @check_is_role(role_name='SELLER')
+    def post(self):
+        try:
+            deltas = restock_deltas.deserialize(request.get_json(silent=True))
+        except ValidationError as e:
+            return {"msg": str(e)}, 400
+        deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+        max_rows = current_app.config["PRODUCT_BULK_MAX_ROWS"]
+        if len(deltas) > max_rows:
+            return {"msg": f"at most {max_rows} products per request"}, 400
+
+        if deltas:
+            try:
+                restock_products(get_jwt_identity(), deltas)
+            except CatalogError as e:
+                return {"msg": str(e)}, e.status
+            catalog_cache.invalidate()
+
+        return {"msg": "Products restocked", "restocked": len(deltas)}
@@ -1,9 +1,9 @@
 from flask import request
 from flask_restful import Resource
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from vm.api.schemas import UserSchema, UserRegisterSchema
-from vm.models import User, Role
-from vm.extensions import db
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user
+from vm.api.schemas import UserSchema, UserRegisterSchema, user_serializer, user_register_serializer
+from vm.models import Role
+from vm.extensions import db, replicas
 from vm.commons.pagination import paginate
 from vm.commons.decorators_helper import error_handler_jwt_extended, check_is_role
 from sqlalchemy.exc import IntegrityError
@@ -82,38 +82,32 @@ class UserResource(Resource):
 
     @error_handler_jwt_extended
     @jwt_required()
+    @replicas.read_only
     def get(self, user_id):
-        schema = UserSchema()
-        user = User.query.get_or_404(user_id)
-        current_user_id = get_jwt_identity()
-        if user.id != current_user_id:
+        if user_id != get_jwt_identity():
             return {"msg": "user not authorized to perform this action"}, 400
-        return {"user": schema.dump(user)}
+        return {"user": user_serializer.dump(get_current_user())}
 
     @error_handler_jwt_extended
     @jwt_required()
     def put(self, user_id):
         try:
             schema = UserSchema(partial=True)
-            user = User.query.get_or_404(user_id)
-            current_user_id = get_jwt_identity()
-            if user.id != current_user_id:
+            if user_id != get_jwt_identity():
                 return {"msg": "user not authorized to perform this action"}, 400
-            user = schema.load(request.json, instance=user)
+            user = schema.load(request.json, instance=get_current_user())
             db.session.commit()
         except ValidationError as e:
             return {"msg": str(e)}, 400
 
-        return {"msg": "user updated", "user": schema.dump(user)}, 201
+        return {"msg": "user updated", "user": user_serializer.dump(user)}, 201
 
     @error_handler_jwt_extended
     @jwt_required()
     def delete(self, user_id):
-        user = User.query.get_or_404(user_id)
-        current_user_id = get_jwt_identity()
-        if user.id != current_user_id:
+        if user_id != get_jwt_identity():
             return {"msg": "user not authorized to perform this action"}, 400
-        db.session.delete(user)
+        db.session.delete(get_current_user())
         db.session.commit()
 
         return {"msg": "user deleted"}
@@ -175,10 +169,13 @@ class UserList(Resource):
             role = Role.query.filter_by(name=request.json['role_name'].upper()).first()
             user.role_id = role.id
             db.session.add(user)
+            db.session.flush()
+            # nobody is logged in yet, the new user reads their account from the primary
+            replicas.wrote_for(user.id)
             db.session.commit()
         except IntegrityError as e:
             return {"msg": "user exist with this username"}, 400
         except ValidationError as e:
             return {"msg": str(e)}, 400
 
-        return {"msg": "user created", "user": schema.dump(user)}, 201
+        return {"msg": "user created", "user": user_register_serializer.dump(user)}, 201
@@ -1,7 +1,14 @@
-from vm.api.schemas.user import UserSchema, UserRegisterSchema, UserDepositSchema
+from vm.api.schemas.user import UserSchema, UserRegisterSchema, UserDepositSchema, \
+    user_serializer, user_register_serializer
 from vm.api.schemas.role import RoleSchema
-from vm.api.schemas.product import ProductSchema, BuyProductSchema
+from vm.api.schemas.product import ProductSchema, BuyProductSchema, product_serializer, products_serializer, \
+    restock_deltas
+from vm.api.schemas.order import OrderSchema, OrderItemSchema, OrderRangeSchema, orders_serializer, \
+    sales_serializer, SalesRollupSchema, RollupRangeSchema, rollups_serializer
 
 
 __all__ = ["UserSchema", "ProductSchema", "RoleSchema", "UserRegisterSchema",
-           "UserDepositSchema", "BuyProductSchema"]
+           "UserDepositSchema", "BuyProductSchema", "user_serializer", "user_register_serializer",
+           "product_serializer", "products_serializer", "restock_deltas",
+           "OrderSchema", "OrderItemSchema", "OrderRangeSchema", "orders_serializer", "sales_serializer",
+           "SalesRollupSchema", "RollupRangeSchema", "rollups_serializer"]
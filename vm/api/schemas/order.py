@@ -0,0 +1,47 @@
+from marshmallow import EXCLUDE, validate
+from vm.models import Order, OrderItem, SalesRollup
+from vm.extensions import ma
+from vm.commons.rollup import GRANULARITIES
+
+
+class OrderItemSchema(ma.SQLAlchemyAutoSchema):
+
+    class Meta:
+        model = OrderItem
+        include_fk = True
+        exclude = ("seller_id", )
+
+
+class OrderSchema(ma.SQLAlchemyAutoSchema):
+    items = ma.Nested(OrderItemSchema, many=True, only=("product_id", "product_name", "cost", "amount"))
+
+    class Meta:
+        model = Order
+        exclude = ("user_id", )
+
+
+class OrderRangeSchema(ma.Schema):
+    """Query string of order and sales listings, pagination arguments are left out"""
+
+    since = ma.DateTime()
+    until = ma.DateTime()
+    product_id = ma.Int()
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class SalesRollupSchema(ma.SQLAlchemyAutoSchema):
+
+    class Meta:
+        model = SalesRollup
+        exclude = ("seller_id", "granularity")
+
+
+class RollupRangeSchema(OrderRangeSchema):
+    granularity = ma.String(load_default="day", validate=validate.OneOf(list(GRANULARITIES)))
+
+
+orders_serializer = OrderSchema(many=True)
+sales_serializer = OrderItemSchema(many=True)
+rollups_serializer = SalesRollupSchema(many=True)
@@ -1,7 +1,9 @@
 from flask import current_app
 from vm.models import Product
 from vm.extensions import ma, db
-from marshmallow import validates, ValidationError
+from marshmallow import validates, post_load, ValidationError
+from vm.commons.purchase import LineItem
+from vm.commons.serializers import CompiledSchema
 
 
 class ProductSchema(ma.SQLAlchemyAutoSchema):
@@ -28,18 +30,25 @@ class ProductSchema(ma.SQLAlchemyAutoSchema):
         return amount_available
 
 
-class BuyProductSchema(ma.SQLAlchemyAutoSchema):
+class BuyProductSchema(ma.Schema):
+    """Basket line item, loaded as a plain LineItem without touching the session"""
+
     id = ma.Int(required=True)
     amount_to_buy = ma.Int(required=True)
 
-    class Meta:
-        model = Product
-        sqla_session = db.session
-        load_instance = True
-        exclude = ("seller_id", "amount_available", "cost", "product_name")
+    @post_load
+    def make_line_item(self, data, **kwargs):
+        return LineItem(**data)
 
     @validates("amount_to_buy")
     def validate_amount_to_buy(self, amount_to_buy):
         if amount_to_buy <= 0:
             raise ValidationError("amount_to_buy must be  positive")
         return amount_to_buy
+
+
+# body of a restock, product id -> stock delta
+restock_deltas = ma.Dict(keys=ma.Int(), values=ma.Int(strict=True), required=True)
+
+product_serializer = CompiledSchema(ProductSchema())
+products_serializer = CompiledSchema(ProductSchema(many=True))
@@ -3,6 +3,7 @@ from vm.models import User
 from vm.extensions import ma, db
 from .role import RoleSchema
 from marshmallow import validates, ValidationError
+from vm.commons.serializers import CompiledSchema
 
 
 class UserSchema(ma.SQLAlchemyAutoSchema):
@@ -57,3 +58,7 @@ class UserDepositSchema(ma.SQLAlchemyAutoSchema):
         if deposit not in [5, 10, 20, 50, 100]:
             raise ValidationError("deposit must be 5 or 10 or 20 or 50 or 100 ")
         return deposit
+
+
+user_serializer = CompiledSchema(UserSchema())
+user_register_serializer = CompiledSchema(UserRegisterSchema())
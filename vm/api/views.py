@@ -2,9 +2,11 @@ from flask import Blueprint, current_app, jsonify
 from flask_restful import Api
 from marshmallow import ValidationError
 from vm.extensions import apispec
-from vm.api.resources import UserResource, UserList, ProductResource, ProductList, \
-    DepositResource, ResetResource, BuyResource
-from vm.api.schemas import UserSchema, ProductSchema, UserRegisterSchema
+from vm.api.resources import UserResource, UserList, ProductResource, ProductList, ProductExport, ProductBulk, \
+    ProductRestock, DepositResource, ResetResource, BuyResource, OrderList, SaleList, \
+    SalesRollupList
+from vm.api.schemas import UserSchema, ProductSchema, UserRegisterSchema, OrderSchema, OrderItemSchema, \
+    SalesRollupSchema
 
 
 blueprint = Blueprint("api", __name__, url_prefix="/api/v1")
@@ -16,11 +18,18 @@ api.add_resource(UserList, "/users", endpoint="users")
 
 api.add_resource(ProductResource, "/products/<int:product_id>", endpoint="product_by_id")
 api.add_resource(ProductList, "/products", endpoint="products")
+api.add_resource(ProductExport, "/products/export", endpoint="products_export")
+api.add_resource(ProductBulk, "/products/bulk", endpoint="products_bulk")
+api.add_resource(ProductRestock, "/products/restock", endpoint="products_restock")
 
 api.add_resource(DepositResource, "/deposit", endpoint="deposit")
 api.add_resource(ResetResource, "/reset", endpoint="reset")
 api.add_resource(BuyResource, "/buy", endpoint="buy")
 
+api.add_resource(OrderList, "/orders", endpoint="orders")
+api.add_resource(SaleList, "/sales", endpoint="sales")
+api.add_resource(SalesRollupList, "/sales/rollup", endpoint="sales_rollup")
+
 
 @blueprint.before_app_first_request
 def register_views():
@@ -31,11 +40,21 @@ def register_views():
     apispec.spec.components.schema("ProductSchema", schema=ProductSchema)
     apispec.spec.path(view=ProductResource, app=current_app)
     apispec.spec.path(view=ProductList, app=current_app)
+    apispec.spec.path(view=ProductExport, app=current_app)
+    apispec.spec.path(view=ProductBulk, app=current_app)
+    apispec.spec.path(view=ProductRestock, app=current_app)
 
     apispec.spec.path(view=DepositResource, app=current_app)
     apispec.spec.path(view=ResetResource, app=current_app)
     apispec.spec.path(view=BuyResource, app=current_app)
 
+    apispec.spec.components.schema("OrderSchema", schema=OrderSchema)
+    apispec.spec.components.schema("OrderItemSchema", schema=OrderItemSchema)
+    apispec.spec.path(view=OrderList, app=current_app)
+    apispec.spec.path(view=SaleList, app=current_app)
+    apispec.spec.components.schema("SalesRollupSchema", schema=SalesRollupSchema)
+    apispec.spec.path(view=SalesRollupList, app=current_app)
+
 
 @blueprint.errorhandler(ValidationError)
 def handle_marshmallow_error(e):
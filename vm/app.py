@@ -2,9 +2,17 @@ from flask import Flask
 from vm import api
 from vm import auth
 from vm.extensions import apispec
+from vm.extensions import catalog_cache
 from vm.extensions import db
 from vm.extensions import jwt
+from vm.extensions import metrics
 from vm.extensions import migrate
+from vm.extensions import pwd_context
+from vm.extensions import replicas
+from vm.extensions import revocation_cache
+from vm.commons import database
+from vm.commons import instrumentation
+from vm.commons import journal
 
 
 def create_app(testing=False):
@@ -24,9 +32,30 @@ def create_app(testing=False):
 
 def configure_extensions(app):
     """configure flask extensions"""
+    database.init_app(app)
     db.init_app(app)
+    replicas.init_app(app, db)
+    metrics.init_app(app)
+    database.instrument(app)
+    instrumentation.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
+    revocation_cache.init_app(app)
+    catalog_cache.init_app(app)
+    journal.init_app(app)
+    configure_password_hashing(app)
+
+
+def configure_password_hashing(app):
+    """Configure password hashing cost, hashes using another cost are rehashed on login"""
+    app.config.setdefault("PASSWORD_HASH_ROUNDS", 29000)
+    rounds = app.config["PASSWORD_HASH_ROUNDS"]
+    pwd_context.update(
+        pbkdf2_sha256__default_rounds=rounds,
+        pbkdf2_sha256__min_desired_rounds=rounds,
+        pbkdf2_sha256__max_desired_rounds=rounds,
+    )
+
 
 def configure_apispec(app):
     """Configure APISpec for swagger support"""
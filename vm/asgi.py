@@ -0,0 +1,4 @@
+from vm.app import create_app
+from vm.commons.asgi import AsyncApp
+
+app = AsyncApp(create_app())
@@ -1,93 +1,223 @@
 """Various helpers for auth. Mainly about tokens blocklisting
 
+Issued tokens are not stored. A token is revoked when its jti is listed in
+TokenBlocklist, or when it was issued before the ``revoked_before`` watermark
+of its user, so revoking every token of a user is a single row update.
+
+The ``iat`` claim only has a one second resolution, tokens also carry their
+issue time in microseconds in the ``iat_us`` claim, which the watermark is
+compared to. A user logging in again right after revoking every token keeps
+the new ones.
+
 Heavily inspired by
 https://github.com/vimalloc/flask-jwt-extended/blob/master/examples/blocklist_database.py
 """
+import time
 from datetime import datetime
 
-from flask_jwt_extended import decode_token
-from sqlalchemy.orm.exc import NoResultFound
+from flask import current_app
+from sqlalchemy import exists, func, insert, or_, select
+from sqlalchemy.orm import joinedload
 
-from vm.extensions import db
-from vm.models import TokenBlocklist
+from vm.commons.sql import dialect_insert
+from vm.extensions import db, pwd_context, revocation_cache
+from vm.models import TokenBlocklist, TokenWatermark, User
 
+# revocations are re-read this far behind the sync cursor, covers transactions
+# still in flight when the cursor moved and clock skew between hosts
+SYNC_ID_MARGIN = 100
+SYNC_TIME_MARGIN = 60
+
+ISSUED_AT_CLAIM = "iat_us"
+
+
+def login_query(username):
+    """User logging in with ``username``"""
+    return User.query.filter_by(username=username)
 
-def add_token_to_database(encoded_token, identity_claim):
-    """
-    Adds a new token to the database. It is not revoked when it is added.
 
-    :param identity_claim: configured key to get user identity
+def current_user_query(identity):
+    """User of a token, role included"""
+    return User.query.options(joinedload(User.role)).filter(User.id == identity)
+
+
+def verify_password(user, password):
+    """Check a password against the user hash
+
+    When the hash was made with outdated parameters the user is given a new
+    one, persisted with the next commit.
     """
-    decoded_token = decode_token(encoded_token)
-    jti = decoded_token["jti"]
-    token_type = decoded_token["type"]
-    user_identity = decoded_token[identity_claim]
-    expires = datetime.fromtimestamp(decoded_token["exp"])
-    revoked = False
-
-    db_token = TokenBlocklist(
-        jti=jti,
-        token_type=token_type,
-        user_id=user_identity,
-        expires=expires,
-        revoked=revoked,
-    )
-    db.session.add(db_token)
+    valid, new_hash = pwd_context.verify_and_update(password, user.password)
+    if valid and new_hash is not None:
+        user._password = new_hash
+    return valid
+
+
+def issued_at_claims():
+    """Claims added to every token issued, see ``issued_at``"""
+    return {ISSUED_AT_CLAIM: time.time_ns() // 1000}
+
+
+def issued_at(jwt_payload):
+    """Epoch timestamp the token was issued at, ``iat`` for tokens without ``iat_us``"""
+    if ISSUED_AT_CLAIM in jwt_payload:
+        return jwt_payload[ISSUED_AT_CLAIM] / 1e6
+    return jwt_payload["iat"]
+
+
+def _set_watermark(user, **values):
+    """Upsert the watermark row of a user, does not commit"""
+    statement = dialect_insert(TokenWatermark).values(user_id=user, **values)
+    statement = statement.on_conflict_do_update(index_elements=[TokenWatermark.user_id], set_=values)
+    db.session.execute(statement)
+
+
+def register_session(user):
+    """Record that a new refresh token was issued to the user and commit"""
+    expires = current_app.config["JWT_REFRESH_TOKEN_EXPIRES"]
+    active_until = datetime.now() + expires if expires else datetime.max
+    _set_watermark(user, active_until=active_until)
     db.session.commit()
 
 
 def is_token_revoked(jwt_payload):
     """
-    Checks if the given token is revoked or not. Because we are adding all the
-    tokens that we create into this database, if the token is not present
-    in the database we are going to consider it revoked, as we don't know where
-    it was created.
+    Checks if the given token is revoked or not, either because its jti was
+    revoked or because all tokens of its user were revoked after it was
+    issued. Both are read with a single indexed query.
+
+    Answers are kept in the in-process revocation cache, so the database is
+    only hit for tokens this worker has not seen yet.
     """
     jti = jwt_payload["jti"]
-    try:
-        token = TokenBlocklist.query.filter_by(jti=jti).one()
-        return token.revoked
-    except NoResultFound:
-        return True
+    revocation_cache.sync(fetch_revocations)
+    revoked = revocation_cache.get(jti)
+    if revoked is not None:
+        return revoked
+
+    user_identity = jwt_payload[current_app.config["JWT_IDENTITY_CLAIM"]]
+    blocked, revoked_before = db.session.execute(revocation_query(jti, user_identity)).one()
+
+    issued = issued_at(jwt_payload)
+    revoked = blocked or (revoked_before is not None and issued < revoked_before.timestamp())
+    revocation_cache.set(jti, revoked, user_identity, jwt_payload["exp"], issued)
+    return revoked
+
+
+def revocation_query(jti, user_id):
+    """Whether ``jti`` is revoked and the watermark of its user, in a single row"""
+    blocked = exists().where(TokenBlocklist.jti == jti, TokenBlocklist.revoked.is_(True))
+    revoked_before = (
+        select(TokenWatermark.revoked_before)
+        .where(TokenWatermark.user_id == user_id)
+        .scalar_subquery()
+    )
+    return select(blocked, revoked_before)
+
 
+def revoked_tokens_query(after_id):
+    """Revoked tokens recorded after the ``after_id`` blocklist row"""
+    return select(TokenBlocklist.id, TokenBlocklist.jti).where(
+        TokenBlocklist.id > after_id, TokenBlocklist.revoked.is_(True)
+    )
 
-def revoke_token(token_jti, user):
-    """Revokes the given token
 
-    Since we use it only on logout that already require a valid access token,
-    if token is not found we raise an exception
-    """
-    try:
-        token = TokenBlocklist.query.filter_by(jti=token_jti, user_id=user).one()
-        token.revoked = True
-        db.session.commit()
-    except NoResultFound:
-        raise Exception("Could not find the token {}".format(token_jti))
+def watermarks_query(since):
+    """Watermarks moved after the ``since`` datetime"""
+    return select(TokenWatermark.user_id, TokenWatermark.revoked_before).where(
+        TokenWatermark.revoked_before > since
+    )
+
+
+def expired_tokens_query(now):
+    """Revocations of the tokens expired at ``now``"""
+    return TokenBlocklist.query.filter(TokenBlocklist.expires < now)
+
+
+def fetch_revocations(cursor):
+    """Return revocations recorded since ``cursor``, see ``RevocationCache.sync``"""
+    now = time.time()
+    if cursor is None:
+        last_id = db.session.query(func.max(TokenBlocklist.id)).scalar() or 0
+        return [], [], (last_id, now)
+
+    last_id, since = cursor
+    tokens = db.session.execute(revoked_tokens_query(last_id - SYNC_ID_MARGIN)).all()
+    watermarks = db.session.execute(watermarks_query(datetime.fromtimestamp(since - SYNC_TIME_MARGIN))).all()
+
+    last_id = max([last_id] + [token_id for token_id, _ in tokens])
+    return (
+        [jti for _, jti in tokens],
+        [(user_id, revoked_before.timestamp()) for user_id, revoked_before in watermarks],
+        (last_id, now),
+    )
+
+
+def revoke_tokens(jwt_payloads):
+    """Revokes the given tokens with a single INSERT"""
+    identity_claim = current_app.config["JWT_IDENTITY_CLAIM"]
+    rows = [
+        {
+            "jti": jwt_payload["jti"],
+            "token_type": jwt_payload["type"],
+            "user_id": jwt_payload[identity_claim],
+            "revoked": True,
+            "expires": datetime.fromtimestamp(jwt_payload["exp"]),
+        }
+        for jwt_payload in jwt_payloads
+    ]
+    db.session.execute(insert(TokenBlocklist), rows)
+    db.session.commit()
+    for jwt_payload in jwt_payloads:
+        revocation_cache.revoke(jwt_payload["jti"])
+
+
+def revoke_token(jwt_payload):
+    """Revokes the given token"""
+    revoke_tokens([jwt_payload])
 
 
 def revoke_all_tokens(user):
-    """Revokes all token for user
+    """Revokes all token for user by moving its watermark to now
 
-    Since we use it only on logout that already require a valid access token,
-    if token is not found we raise an exception
+    The watermark keeps the microseconds of the ``iat_us`` claim it is
+    compared to, tokens issued after it in the same second stay valid.
     """
-    try:
-        tokens = TokenBlocklist.query.filter_by(user_id=user).all()
-        for token in tokens:
-            token.revoked = True
-            db.session.add(token)
-        db.session.commit()
-    except NoResultFound:
-        raise Exception(f"Could not find the user {user}")
+    revoked_before = datetime.fromtimestamp(time.time_ns() // 1000 / 1e6)
+    _set_watermark(user, revoked_before=revoked_before, active_until=None)
+    db.session.commit()
+    revocation_cache.revoke_user(user, revoked_before.timestamp())
 
 
 def has_other_tokens(user):
-    """ Check active tokens not revoked for a specific user
+    """ Check if the user may still have an active session
 
-    In case the are not revoked and we divide by 2 for every user there is,
-    access and refresh token in the db
+    True while the last refresh token issued to the user is not expired,
+    unless all of the user tokens were revoked since
     """
-    try:
-        return TokenBlocklist.query.filter_by(user_id=user, revoked=False).count()/2 > 1
-    except NoResultFound:
-        raise Exception(f"Could not find the user {user}")
+    active_until = db.session.query(TokenWatermark.active_until).filter_by(user_id=user).scalar()
+    return active_until is not None and active_until > datetime.now()
+
+
+def purge_expired_tokens():
+    """Delete revocations of expired tokens and watermarks that no longer matter
+
+    :return: number of deleted blocklist and watermark rows
+    """
+    now = datetime.now()
+    tokens = expired_tokens_query(now).delete(synchronize_session=False)
+
+    lifetimes = [
+        current_app.config["JWT_ACCESS_TOKEN_EXPIRES"],
+        current_app.config["JWT_REFRESH_TOKEN_EXPIRES"],
+    ]
+    watermarks = 0
+    if all(lifetimes):
+        # every token issued before the horizon is expired anyway
+        horizon = now - max(lifetimes)
+        watermarks = TokenWatermark.query.filter(
+            or_(TokenWatermark.revoked_before.is_(None), TokenWatermark.revoked_before < horizon),
+            or_(TokenWatermark.active_until.is_(None), TokenWatermark.active_until < now),
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    return tokens, watermarks
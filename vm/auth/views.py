@@ -7,10 +7,9 @@ from flask_jwt_extended import (
     get_jwt,
 )
 
-from vm.models import User
-from vm.extensions import pwd_context, jwt, apispec
-from vm.auth.helpers import revoke_token, is_token_revoked, \
-    add_token_to_database, revoke_all_tokens, has_other_tokens
+from vm.extensions import jwt, apispec, replicas
+from vm.auth.helpers import revoke_token, is_token_revoked, verify_password, \
+    register_session, revoke_all_tokens, has_other_tokens, issued_at_claims, login_query, current_user_query
 
 
 blueprint = Blueprint("auth", __name__, url_prefix="/auth")
@@ -63,19 +62,19 @@ def login():
     if not username or not password:
         return jsonify({"msg": "Missing username or password"}), 400
 
-    user = User.query.filter_by(username=username).first()
-    if user is None or not pwd_context.verify(password, user.password):
+    user = login_query(username).first()
+    if user is None or not verify_password(user, password):
         return jsonify({"msg": "Bad credentials"}), 400
 
     access_token = create_access_token(identity=user.id)
     refresh_token = create_refresh_token(identity=user.id)
-    add_token_to_database(access_token, app.config["JWT_IDENTITY_CLAIM"])
-    add_token_to_database(refresh_token, app.config["JWT_IDENTITY_CLAIM"])
-
     ret = {"access_token": access_token, "refresh_token": refresh_token}
     # check if the user is already logged in with another token
     if has_other_tokens(user.id):
         ret['msg'] = "There is already an active session using your account"
+    # a rehashed password is committed along with the session
+    replicas.wrote_for(user.id)
+    register_session(user.id)
 
     return jsonify(ret), 200
 
@@ -112,7 +111,6 @@ def refresh():
     current_user = get_jwt_identity()
     access_token = create_access_token(identity=current_user)
     ret = {"access_token": access_token}
-    add_token_to_database(access_token, app.config["JWT_IDENTITY_CLAIM"])
     return jsonify(ret), 200
 
 
@@ -140,9 +138,7 @@ def revoke_access_token():
         401:
           description: unauthorized
     """
-    jti = get_jwt()["jti"]
-    user_identity = get_jwt_identity()
-    revoke_token(jti, user_identity)
+    revoke_token(get_jwt())
     return jsonify({"message": "token revoked"}), 200
 
 
@@ -170,9 +166,8 @@ def logout_all_tokens():
         401:
           description: unauthorized
     """
-    jti = get_jwt()["jti"]
     user_identity = get_jwt_identity()
-    revoke_all_tokens( user_identity)
+    revoke_all_tokens(user_identity)
     return jsonify({"message": "tokens revoked"}), 200
 
 
@@ -200,21 +195,32 @@ def revoke_refresh_token():
         401:
           description: unauthorized
     """
-    jti = get_jwt()["jti"]
-    user_identity = get_jwt_identity()
-    revoke_token(jti, user_identity)
+    revoke_token(get_jwt())
     return jsonify({"message": "token revoked"}), 200
 
 
 @jwt.user_lookup_loader
 def user_loader_callback(jwt_headers, jwt_payload):
+    """Resolve the user once per request, role included
+
+    flask-jwt-extended keeps the result for the request lifetime, decorators
+    and resources read it back through ``get_current_user``.
+    """
     identity = jwt_payload["sub"]
-    return User.query.get(identity)
+    return current_user_query(identity).first()
+
+
+@jwt.additional_claims_loader
+def additional_claims_callback(identity):
+    # sub-second issue time the revocation watermark is compared to
+    return issued_at_claims()
 
 
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_headers, jwt_payload):
-    return is_token_revoked(jwt_payload)
+    # a lagging replica could miss a revocation
+    with replicas.primary():
+        return is_token_revoked(jwt_payload)
 
 
 @blueprint.before_app_first_request
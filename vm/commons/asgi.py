@@ -0,0 +1,223 @@
+"""ASGI application serving catalog reads on an async engine
+
+Kiosks mostly poll the catalog. The product list and product detail GETs are
+answered by async handlers reading through an async SQLAlchemy engine
+(asyncpg on Postgres, aiosqlite on SQLite), a worker holds hundreds of such
+connections without a thread for each of them.
+
+Every other route goes to the Flask app through asgiref's WSGI adapter and
+keeps its sync transactions, as do catalog requests the async handlers do not
+answer themselves: invalid parameters and missing pages or products, so that
+errors are the ones of Flask. At most ``ASGI_BRIDGE_THREADS`` requests run in
+Flask at a time, keep it at the sync pool size.
+
+Responses are the ones of the Flask resources, same JSON, pagination links
+and ETags. The catalog response cache is shared with them, writes going
+through Flask invalidate it. Async handlers record latency and status on
+``/metrics`` but not their SQL statements.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from marshmallow import ValidationError
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import generate_etag, parse_etags, quote_etag
+
+from vm.api.schemas import product_serializer, products_serializer
+from vm.commons.cache import TTLCache
+from vm.commons.database import async_database_uri, async_engine_options
+from vm.commons.instrumentation import request_latency, request_total
+from vm.commons.pagination import (
+    decode_cursor, extract_pagination, keyset_envelope, keyset_page, offset_envelope, with_count
+)
+from vm.extensions import catalog_cache
+from vm.models import Product
+
+_PRODUCT_COLUMNS = [getattr(Product, name) for name in product_serializer.schema.dump_fields]
+# keyset of the product list resource
+_PRODUCT_KEYSET = (Product.id,)
+
+
+class AsyncApp:
+    """ASGI application answering catalog reads itself and the rest through Flask"""
+
+    def __init__(self, flask_app):
+        flask_app.config.setdefault("ASYNC_DATABASE_URI", None)
+        flask_app.config.setdefault("ASGI_BRIDGE_THREADS", 15)
+
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.engine = None
+        self.handlers = {"api.products": self.product_list, "api.product_by_id": self.product_detail}
+        self._bridge_slots = None
+        self._count_cache = TTLCache(maxsize=256)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "GET" and await self.serve(scope, send):
+            return
+
+        if self._bridge_slots is None:
+            self._bridge_slots = asyncio.Semaphore(self.flask_app.config["ASGI_BRIDGE_THREADS"])
+        # a thread per request instead of asgiref's single shared one
+        async with self._bridge_slots, ThreadSensitiveContext():
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.connect()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def connect(self):
+        if self.engine is None:
+            config = self.flask_app.config
+            self.engine = create_async_engine(async_database_uri(config), **async_engine_options(config))
+        return self.engine
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def serve(self, scope, send):
+        """Answer a GET with an async handler, return False to leave it to Flask"""
+        started = time.perf_counter()
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+
+        urls = self.flask_app.url_map.bind("localhost", script_name=root_path or None)
+        try:
+            rule, view_args = urls.match(path, method="GET", return_rule=True)
+        except HTTPException:
+            return False
+        handler = self.handlers.get(rule.endpoint)
+        if handler is None:
+            return False
+
+        args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+        key = (rule.endpoint, tuple(sorted(view_args.items())), tuple(sorted(args.items(multi=True))))
+        entry = catalog_cache.entries.get(key)
+        if entry is None:
+            generation = catalog_cache.generation
+            data = await handler(urls, rule.endpoint, args, view_args)
+            if data is None:
+                return False
+            body = self.dumps(data).encode()
+            entry = (body, generate_etag(body))
+            if generation == catalog_cache.generation:
+                catalog_cache.entries.set(key, entry, time.time() + catalog_cache.ttl)
+
+        status = await self.respond(scope, send, *entry)
+        if self.flask_app.config["METRICS_ENABLED"]:
+            labels = {"method": "GET", "endpoint": rule.rule}
+            request_latency.observe(time.perf_counter() - started, **labels)
+            request_total.inc(status=str(status), **labels)
+        return True
+
+    def dumps(self, data):
+        """Serialize like flask-restful's ``output_json``"""
+        settings = dict(self.flask_app.config.get("RESTFUL_JSON", {}))
+        if self.flask_app.debug:
+            settings.setdefault("indent", 4)
+        return json.dumps(data, **settings) + "\n"
+
+    async def respond(self, scope, send, body, etag):
+        headers = [(b"etag", quote_etag(etag).encode())]
+        if_none_match = dict(scope["headers"]).get(b"if-none-match")
+        if if_none_match and parse_etags(if_none_match.decode("latin-1")).contains_weak(etag):
+            status, body = 304, b""
+        else:
+            status = 200
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+        return status
+
+    async def _execute(self, statements):
+        async with self.connect().connect() as conn:
+            config = self.flask_app.config
+            if config["DATABASE_PGBOUNCER"] and config["DATABASE_STATEMENT_TIMEOUT"]:
+                await conn.execute(text(f"SET LOCAL statement_timeout = {int(config['DATABASE_STATEMENT_TIMEOUT'])}"))
+            return [await statement(conn) for statement in statements]
+
+    async def _count(self, conn):
+        ttl = self.flask_app.config.get("PAGINATION_COUNT_CACHE_TTL", 0)
+        total = self._count_cache.get(Product.__tablename__) if ttl else None
+        if total is None:
+            total = (await conn.execute(select(func.count()).select_from(Product))).scalar()
+            if ttl:
+                self._count_cache.set(Product.__tablename__, total, time.time() + ttl)
+        return total
+
+    async def product_detail(self, urls, endpoint, args, view_args):
+        async def read(conn):
+            return (await conn.execute(select(*_PRODUCT_COLUMNS).where(Product.id == view_args["product_id"]))).first()
+
+        product, = await self._execute([read])
+        if product is None:
+            return None
+        return {"Product": product_serializer.dump(product)}
+
+    async def product_list(self, urls, endpoint, args, view_args):
+        """``vm.commons.pagination.paginate`` of the products on the async engine"""
+        try:
+            page, per_page, other_args = extract_pagination(**args)
+        except ValueError:
+            return None
+        if per_page < 1:
+            return None
+        if "cursor" in other_args:
+            return await self._keyset_page(urls, endpoint, per_page, other_args, view_args)
+        if page < 1:
+            return None
+
+        async def read(conn):
+            return (await conn.execute(select(*_PRODUCT_COLUMNS).limit(per_page).offset((page - 1) * per_page))).all()
+
+        items, total = await self._execute([read, self._count])
+        if not items and page != 1:
+            return None
+
+        def link(**params):
+            return urls.build(endpoint, dict(**params, per_page=per_page, **other_args, **view_args))
+
+        return offset_envelope(page, per_page, total, products_serializer.dump(items), link)
+
+    async def _keyset_page(self, urls, endpoint, per_page, request_args, view_args):
+        request_args = dict(request_args)
+        try:
+            direction, values = decode_cursor(request_args.pop("cursor"))
+            statement = keyset_page(select(*_PRODUCT_COLUMNS), _PRODUCT_KEYSET, per_page, direction, values)
+        except ValidationError:
+            return None
+
+        async def read(conn):
+            return (await conn.execute(statement)).all()
+
+        async def total(conn):
+            return await self._count(conn) if with_count(request_args) else None
+
+        total, rows = await self._execute([total, read])
+
+        def link(**params):
+            return urls.build(endpoint, dict(**params, per_page=per_page, **request_args, **view_args))
+
+        return keyset_envelope(rows, per_page, direction, values, total, _PRODUCT_KEYSET,
+                               products_serializer.dump, link)
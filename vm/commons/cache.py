@@ -0,0 +1,197 @@
+"""In-process caches
+
+Everything here lives in the memory of a single worker, entries are bounded
+in number and expire at a fixed timestamp.
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, current_app
+from flask_restful.representations.json import output_json
+from flask_restful.utils import unpack
+
+
+class TTLCache:
+    """Thread safe LRU mapping whose entries expire at a given epoch timestamp"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        if self.maxsize <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def items(self):
+        """Snapshot of the live ``(key, value)`` pairs"""
+        now = time.time()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items() if expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RevocationCache:
+    """Cache of token revocation status keyed by jti
+
+    A revoked token stays revoked, so revocations are cached until the token
+    expires. Tokens known as valid are cached for at most
+    ``JWT_REVOCATION_CACHE_TTL`` seconds. Every ``JWT_REVOCATION_SYNC_INTERVAL``
+    seconds the revocations recorded since the previous sync are replayed on
+    the cache, which bounds how long a revocation made by another worker can
+    go unnoticed.
+    """
+
+    def __init__(self, app=None):
+        self.entries = TTLCache(maxsize=0)
+        self.ttl = 0
+        self.sync_interval = 0
+        self._cursor = None
+        self._last_sync = time.time()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("JWT_REVOCATION_CACHE_SIZE", 4096)
+        app.config.setdefault("JWT_REVOCATION_CACHE_TTL", 300)
+        app.config.setdefault("JWT_REVOCATION_SYNC_INTERVAL", 5)
+
+        self.entries = TTLCache(maxsize=app.config["JWT_REVOCATION_CACHE_SIZE"])
+        self.ttl = app.config["JWT_REVOCATION_CACHE_TTL"]
+        self.sync_interval = app.config["JWT_REVOCATION_SYNC_INTERVAL"]
+        self._cursor = None
+
+    def get(self, jti):
+        """Return the cached revocation status of a token, None if unknown"""
+        entry = self.entries.get(jti)
+        return None if entry is None else entry[0]
+
+    def set(self, jti, revoked, user_id, expires, issued_at):
+        """Cache a revocation status, ``expires`` is the token ``exp`` claim
+        and ``issued_at`` its issue timestamp"""
+        expires_at = expires if revoked else min(expires, time.time() + self.ttl)
+        self.entries.set(jti, (revoked, user_id, expires, issued_at), expires_at)
+
+    def revoke(self, jti):
+        entry = self.entries.get(jti)
+        if entry is not None:
+            self.set(jti, True, *entry[1:])
+
+    def revoke_user(self, user_id, before):
+        """Revoke cached tokens of a user issued before the ``before`` timestamp"""
+        for jti, (revoked, entry_user_id, expires, issued_at) in self.entries.items():
+            if entry_user_id == user_id and not revoked and issued_at < before:
+                self.set(jti, True, user_id, expires, issued_at)
+
+    def sync(self, fetch_revocations):
+        """Replay revocations made since the last sync if the interval elapsed
+
+        :param fetch_revocations: callable receiving the cursor returned by its
+            previous call (None the first time) and returning a
+            ``(jtis, watermarks, cursor)`` tuple, ``watermarks`` being
+            ``(user_id, revoked_before)`` pairs
+        """
+        now = time.time()
+        # the first call only positions the cursor, it happens before
+        # anything is cached so no revocation can be missed
+        if self._cursor is not None and now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+
+        jtis, watermarks, self._cursor = fetch_revocations(self._cursor)
+        for jti in jtis:
+            self.revoke(jti)
+        for user_id, revoked_before in watermarks:
+            self.revoke_user(user_id, revoked_before)
+
+
+class ResponseCache:
+    """Cache of serialized JSON responses for read-only resources
+
+    Entries are keyed by endpoint, view arguments and query string and carry a
+    strong ETag, requests with a matching ``If-None-Match`` get a
+    ``304 Not Modified``. Any write to the cached data must call
+    ``invalidate``, other workers see it once their entries expire after
+    ``CATALOG_CACHE_TTL`` seconds.
+    """
+
+    def __init__(self, app=None):
+        self.entries = TTLCache(maxsize=0)
+        self.ttl = 0
+        self.generation = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CATALOG_CACHE_SIZE", 512)
+        app.config.setdefault("CATALOG_CACHE_TTL", 5)
+
+        self.entries = TTLCache(maxsize=app.config["CATALOG_CACHE_SIZE"])
+        self.ttl = app.config["CATALOG_CACHE_TTL"]
+
+    def invalidate(self):
+        self.generation += 1
+        self.entries.clear()
+
+    def cached(self, func):
+        """Decorate a resource GET method returning a JSON serializable body"""
+
+        @functools.wraps(func)
+        def inner_function(*args, **kwargs):
+            key = (
+                request.endpoint,
+                tuple(sorted(request.view_args.items())),
+                tuple(sorted(request.args.items(multi=True))),
+            )
+            entry = self.entries.get(key)
+            if entry is not None:
+                body, etag = entry
+                response = current_app.response_class(body, mimetype="application/json")
+                response.set_etag(etag)
+                return response.make_conditional(request)
+
+            generation = self.generation
+            data, code, headers = unpack(func(*args, **kwargs))
+            response = output_json(data, code, headers)
+            response.mimetype = "application/json"
+            if code != 200:
+                return response
+
+            response.add_etag()
+            if generation == self.generation:
+                self.entries.set(key, (response.get_data(), response.get_etag()[0]), time.time() + self.ttl)
+            return response.make_conditional(request)
+
+        return inner_function
@@ -0,0 +1,105 @@
+"""Bulk catalog writes for sellers
+
+Products are upserted by ``product_name`` with batched
+``INSERT ... ON CONFLICT (product_name) DO UPDATE`` statements. The update
+only applies to products of the same seller, a name owned by another seller
+is reported as an error for its row and left untouched.
+
+Restocks apply every delta with the single guarded UPDATE used by purchases.
+"""
+from sqlalchemy import select
+
+from vm.commons.purchase import adjust_stock
+from vm.commons.sql import dialect_insert
+from vm.extensions import db
+from vm.models import Product
+
+CREATED = "created"
+UPDATED = "updated"
+ERROR = "error"
+
+_UPSERTED_COLUMNS = ("product_name", "cost", "amount_available")
+
+
+class CatalogError(Exception):
+    """Catalog write refused, message is meant to be returned to the client"""
+
+    def __init__(self, msg, status=400):
+        super().__init__(msg)
+        self.status = status
+
+
+def _owners(names):
+    """Return ``{product_name: (id, seller_id)}`` of the existing products"""
+    rows = db.session.execute(
+        select(Product.product_name, Product.id, Product.seller_id).where(Product.product_name.in_(names))
+    )
+    return {name: (product_id, seller_id) for name, product_id, seller_id in rows}
+
+
+def _upsert(seller_id, rows):
+    statement = dialect_insert(Product).values(
+        [dict({column: row[column] for column in _UPSERTED_COLUMNS}, seller_id=seller_id) for row in rows]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Product.product_name],
+        set_={"cost": statement.excluded.cost, "amount_available": statement.excluded.amount_available},
+        where=Product.seller_id == statement.excluded.seller_id,
+    )
+    db.session.execute(statement)
+
+
+def upsert_products(seller_id, rows, batch_size):
+    """Create or update products of a seller, does not commit
+
+    :param rows: validated ``(index, row)`` pairs, row holding every column
+        of ``_UPSERTED_COLUMNS``
+    :return: ``{index: result}``, result holding ``status`` and either the
+        product ``id`` or a ``msg``
+    """
+    results = {}
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        names = [row["product_name"] for _, row in batch]
+        before = _owners(names)
+
+        writable = []
+        for index, row in batch:
+            owner = before.get(row["product_name"])
+            if owner is not None and owner[1] != seller_id:
+                results[index] = {"status": ERROR, "msg": "product exist with this name"}
+            else:
+                writable.append((index, row))
+        if not writable:
+            continue
+
+        _upsert(seller_id, [row for _, row in writable])
+        # read back ids, a name taken by another seller meanwhile is missing
+        after = _owners([row["product_name"] for _, row in writable])
+        for index, row in writable:
+            product_id, owner_id = after[row["product_name"]]
+            if owner_id != seller_id:
+                results[index] = {"status": ERROR, "msg": "product exist with this name"}
+            else:
+                status = UPDATED if row["product_name"] in before else CREATED
+                results[index] = {"status": status, "id": product_id}
+    return results
+
+
+def restock_products(seller_id, deltas):
+    """Apply ``{product_id: delta}`` to the stock of products of a seller and commit
+
+    :raise CatalogError: if a product does not exist, belongs to another
+        seller or its stock would become negative, nothing is applied then
+    """
+    owners = dict(db.session.execute(select(Product.id, Product.seller_id).where(Product.id.in_(deltas))).all())
+    missing = sorted(set(deltas) - set(owners))
+    if missing:
+        raise CatalogError(f"Products {missing} do not exist", 404)
+    if any(owner != seller_id for owner in owners.values()):
+        raise CatalogError("not authorized to perform this action", 401)
+
+    if not adjust_stock(deltas):
+        db.session.rollback()
+        raise CatalogError("amount_available can not become negative")
+    db.session.commit()
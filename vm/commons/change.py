@@ -0,0 +1,223 @@
+"""Change engine shared by the buy and reset endpoints
+
+Change is always made of the fixed ``DENOMINATIONS``, the fewest coins for
+every amount up to ``LOOKUP_LIMIT`` are computed once at import time, larger
+amounts are topped up with 100 coins.
+
+A machine keeps the coins it holds in ``CoinInventory``. When the lookup
+answer needs more coins of a kind than the machine has, greedy is no longer
+correct (with one 50, three 20 and no 10, greedy gives 50 for 60 and gets
+stuck, 3 x 20 works), the change is then solved with a bounded dynamic
+program over the coins actually available. A machine with no inventory row
+has an unlimited supply of every coin.
+
+Coins leave the inventory with a single conditional UPDATE, guarded like the
+stock of a product, so two purchases can not hand out the same coin.
+"""
+from flask import current_app
+from sqlalchemy import Integer, String, bindparam, case, exists, select, update
+
+from vm.commons.sql import dialect_insert
+from vm.extensions import db
+from vm.models import CoinInventory
+
+DENOMINATIONS = (100, 50, 20, 10, 5)
+UNIT = 5
+LOOKUP_LIMIT = 1000
+
+
+def _build_lookup(limit):
+    """Fewest coins for every multiple of ``UNIT`` up to ``limit``
+
+    :return: list indexed by ``amount // UNIT`` of coin count tuples ordered
+        like ``DENOMINATIONS``
+    """
+    size = limit // UNIT + 1
+    fewest = [0] + [None] * (size - 1)
+    last_coin = [None] * size
+    for units in range(1, size):
+        for index, coin in enumerate(DENOMINATIONS):
+            previous = units - coin // UNIT
+            if previous < 0 or fewest[previous] is None:
+                continue
+            if fewest[units] is None or fewest[previous] + 1 < fewest[units]:
+                fewest[units] = fewest[previous] + 1
+                last_coin[units] = index
+
+    table = [(0,) * len(DENOMINATIONS)]
+    for units in range(1, size):
+        counts = list(table[units - DENOMINATIONS[last_coin[units]] // UNIT])
+        counts[last_coin[units]] += 1
+        table.append(tuple(counts))
+    return table
+
+
+_LOOKUP = _build_lookup(LOOKUP_LIMIT)
+
+
+def as_change(counts):
+    """Return ``{coin: count}`` of the coins handed out, denominations not used are left out"""
+    return {coin: count for coin, count in zip(DENOMINATIONS, counts) if count}
+
+
+def _unlimited_change(amount):
+    extra = max(0, -(-(amount - LOOKUP_LIMIT) // DENOMINATIONS[0]))
+    counts = list(_LOOKUP[(amount - extra * DENOMINATIONS[0]) // UNIT])
+    counts[0] += extra
+    return counts
+
+
+def _reachable(amount, inventory):
+    """Bounded coin change, fewest coins for every reachable amount up to ``amount``
+
+    Each coin count is split in powers of two so every bundle is used at most
+    once (0/1 knapsack), keeping the work proportional to ``log(count)``.
+
+    :return: list indexed by ``amount // UNIT`` of coin count tuples, None
+        where the amount can not be made
+    """
+    size = amount // UNIT + 1
+    best = [(0,) * len(DENOMINATIONS)] + [None] * (size - 1)
+    for index, coin in enumerate(DENOMINATIONS):
+        available = min(inventory.get(coin, 0), amount // coin)
+        bundle = 1
+        while available > 0:
+            take = min(bundle, available)
+            available -= take
+            bundle *= 2
+            step = take * coin // UNIT
+            for units in range(size - 1, step - 1, -1):
+                previous = best[units - step]
+                if previous is None:
+                    continue
+                candidate = list(previous)
+                candidate[index] += take
+                if best[units] is None or sum(candidate) < sum(best[units]):
+                    best[units] = tuple(candidate)
+    return best
+
+
+def make_change(amount, inventory=None):
+    """Fewest coins adding up to ``amount``
+
+    :param inventory: ``{coin: count}`` available, None for an unlimited supply
+    :return: ``{coin: count}`` of the coins used, None if ``amount`` can not
+        be made with the coins available
+    """
+    if amount < 0 or amount % UNIT:
+        return None
+    counts = _unlimited_change(amount)
+    if inventory is None or all(
+        count <= inventory.get(coin, 0) for coin, count in zip(DENOMINATIONS, counts)
+    ):
+        return as_change(counts)
+
+    counts = _reachable(amount, inventory)[-1]
+    return as_change(counts) if counts is not None else None
+
+
+def largest_change(amount, inventory=None):
+    """Largest amount not above ``amount`` that can be paid back
+
+    :return: ``(paid amount, {coin: count})``
+    """
+    amount -= amount % UNIT
+    change = make_change(amount, inventory)
+    if change is not None:
+        return amount, change
+    reachable = _reachable(amount, inventory)
+    for units in range(len(reachable) - 1, -1, -1):
+        if reachable[units] is not None:
+            return units * UNIT, as_change(reachable[units])
+    return 0, as_change((0,) * len(DENOMINATIONS))
+
+
+def _machine_id(machine_id):
+    return machine_id if machine_id is not None else current_app.config["MACHINE_ID"]
+
+
+def inventory_query(machine_id=None):
+    """Coins held by the machine"""
+    return select(CoinInventory.coin, CoinInventory.count).where(CoinInventory.machine_id == _machine_id(machine_id))
+
+
+def load_inventory(machine_id=None):
+    """Return ``{coin: count}`` held by the machine, None when it is not tracked"""
+    rows = db.session.execute(inventory_query(machine_id)).all()
+    return dict(rows) if rows else None
+
+
+def _adjust_coins(deltas, machine_id):
+    """Apply ``{coin: delta}`` to the machine inventory in a single UPDATE
+
+    Rows whose count would become negative are left untouched. Does not
+    commit, caller owns the transaction.
+
+    :return: number of rows updated
+    """
+    deltas = {coin: delta for coin, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    delta = case(deltas, value=CoinInventory.coin)
+    statement = (
+        update(CoinInventory)
+        .where(
+            CoinInventory.machine_id == _machine_id(machine_id),
+            CoinInventory.coin.in_(deltas),
+            CoinInventory.count + delta >= 0,
+        )
+        .values(count=CoinInventory.count + delta)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(statement).rowcount
+
+
+def dispense(change, inventory, machine_id=None):
+    """Take the coins of ``change`` out of the machine, does not commit
+
+    :param inventory: as returned by ``load_inventory``, nothing is written
+        for an untracked machine
+    :return: True if every coin was still available
+    """
+    if inventory is None:
+        return True
+    taken = {coin: -count for coin, count in change.items() if count}
+    return _adjust_coins(taken, machine_id) == len(taken)
+
+
+def insert_coins(coins, machine_id=None):
+    """Add inserted coins to the machine inventory, does not commit
+
+    Denominations a tracked machine has no row for yet are added, untracked
+    machines are left untracked. One statement whatever the coins.
+    """
+    inserted = {}
+    for coin in coins:
+        inserted[coin] = inserted.get(coin, 0) + 1
+    if not inserted:
+        return
+    machine_id = _machine_id(machine_id)
+    tracked = exists().where(CoinInventory.machine_id == bindparam("machine_id", type_=String))
+    rows = select(
+        bindparam("machine_id", type_=String), bindparam("coin", type_=Integer), bindparam("count", type_=Integer)
+    ).where(tracked)
+    statement = dialect_insert(CoinInventory).from_select(["machine_id", "coin", "count"], rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[CoinInventory.machine_id, CoinInventory.coin],
+        set_={"count": CoinInventory.count + statement.excluded.count},
+    )
+    db.session.execute(
+        statement, [{"machine_id": machine_id, "coin": coin, "count": count} for coin, count in inserted.items()]
+    )
+
+
+def set_inventory(counts, machine_id=None):
+    """Set the count of the given coins, creating the rows if needed, and commit"""
+    machine_id = _machine_id(machine_id)
+    for coin, count in counts.items():
+        statement = dialect_insert(CoinInventory).values(machine_id=machine_id, coin=coin, count=count)
+        statement = statement.on_conflict_do_update(
+            index_elements=[CoinInventory.machine_id, CoinInventory.coin], set_={"count": count}
+        )
+        db.session.execute(statement)
+    db.session.commit()
@@ -0,0 +1,168 @@
+"""Engine and connection pool configuration
+
+``SQLALCHEMY_ENGINE_OPTIONS`` is built from the ``DATABASE_*`` settings unless
+it is set explicitly. Every worker process owns a pool of
+``DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW`` connections at most, size them
+so that ``workers x (size + overflow)`` stays below ``max_connections``.
+
+Behind PgBouncer in transaction mode (``DATABASE_PGBOUNCER``) the app keeps no
+pool of its own, PgBouncer does the pooling, and the statement timeout is set
+with ``SET LOCAL`` at the start of every transaction: session settings would
+leak to the other clients sharing the server connection.
+
+The pool reports checked out and overflow connections, and the time spent
+waiting for a connection, on ``/metrics``.
+
+The ASGI entry point reads through an async engine using the same settings,
+its URL is ``ASYNC_DATABASE_URI`` or the sync one switched to the async
+driver of the backend.
+"""
+import time
+
+from flask import current_app
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from vm.extensions import db, metrics
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+checkout_wait = metrics.histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+checkout_timeouts = metrics.counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after DATABASE_POOL_TIMEOUT"
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc()
+            raise
+        finally:
+            checkout_wait.observe(time.perf_counter() - started)
+
+
+def engine_options(config):
+    """Build engine options from the ``DATABASE_*`` settings
+
+    SQLite keeps the defaults of flask-sqlalchemy.
+    """
+    uri = config.get("SQLALCHEMY_DATABASE_URI")
+    if not uri or make_url(uri).get_backend_name() == "sqlite":
+        return {}
+
+    if config["DATABASE_PGBOUNCER"]:
+        return {"poolclass": NullPool}
+
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": config["DATABASE_POOL_SIZE"],
+        "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+        "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+        "pool_pre_ping": config["DATABASE_POOL_PRE_PING"],
+    }
+    if config["DATABASE_STATEMENT_TIMEOUT"]:
+        options["connect_args"] = {"options": f"-c statement_timeout={config['DATABASE_STATEMENT_TIMEOUT']}"}
+    return options
+
+
+def async_database_uri(config):
+    """Return the URL of the async engine
+
+    :raise ValueError: if the backend has no known async driver
+    """
+    if config.get("ASYNC_DATABASE_URI"):
+        return make_url(config["ASYNC_DATABASE_URI"])
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"no async driver for {url.get_backend_name()}, set ASYNC_DATABASE_URI")
+    return url.set(drivername=driver)
+
+
+def async_engine_options(config):
+    """Build async engine options from the ``DATABASE_*`` settings
+
+    Same pool sizes as the sync engine, the statement timeout is passed as
+    an asyncpg server setting. PgBouncer in transaction mode can not keep
+    prepared statements, asyncpg's statement cache is disabled then. SQLite
+    database files get a pool as well, SQLAlchemy 1.4 would open a
+    connection, and an aiosqlite thread, per checkout.
+    """
+    url = async_database_uri(config)
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return {}
+        return {"poolclass": AsyncAdaptedQueuePool, "pool_size": config["DATABASE_POOL_SIZE"]}
+
+    if config["DATABASE_PGBOUNCER"]:
+        return {"poolclass": NullPool, "connect_args": {"statement_cache_size": 0}}
+
+    options = {
+        "pool_size": config["DATABASE_POOL_SIZE"],
+        "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+        "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+        "pool_pre_ping": config["DATABASE_POOL_PRE_PING"],
+    }
+    if config["DATABASE_STATEMENT_TIMEOUT"]:
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(config["DATABASE_STATEMENT_TIMEOUT"])}
+        }
+    return options
+
+
+def _set_local_statement_timeout(session, transaction, connection):
+    config = current_app.config
+    if config["DATABASE_PGBOUNCER"] and config["DATABASE_STATEMENT_TIMEOUT"]:
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(config['DATABASE_STATEMENT_TIMEOUT'])}"))
+
+
+def _pool_stat(name):
+    def read():
+        pool = db.engine.pool
+        return getattr(pool, name)() if isinstance(pool, QueuePool) else None
+
+    return read
+
+
+def init_app(app):
+    """Set the engine options, to call before ``db.init_app``"""
+    app.config.setdefault("DATABASE_POOL_SIZE", 5)
+    app.config.setdefault("DATABASE_MAX_OVERFLOW", 10)
+    app.config.setdefault("DATABASE_POOL_TIMEOUT", 30)
+    app.config.setdefault("DATABASE_POOL_RECYCLE", 1800)
+    app.config.setdefault("DATABASE_POOL_PRE_PING", True)
+    app.config.setdefault("DATABASE_STATEMENT_TIMEOUT", 0)
+    app.config.setdefault("DATABASE_PGBOUNCER", False)
+    app.config.setdefault("DATABASE_REPLICAS", {})
+    # replicas are binds of their own, see vm.commons.replicas
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    binds.update(app.config["DATABASE_REPLICAS"])
+    app.config["SQLALCHEMY_BINDS"] = binds
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
+
+
+def instrument(app):
+    """Register pool gauges and PgBouncer settings, to call after ``db.init_app``"""
+    listener = _set_local_statement_timeout
+    if app.config["DATABASE_PGBOUNCER"] and not event.contains(db.session, "after_begin", listener):
+        event.listen(db.session, "after_begin", listener)
+
+    metrics.gauge("db_pool_size", "Connections kept in the pool", _pool_stat("size"))
+    metrics.gauge("db_pool_checked_out", "Connections currently checked out", _pool_stat("checkedout"))
+    metrics.gauge("db_pool_checked_in", "Idle connections in the pool", _pool_stat("checkedin"))
+    metrics.gauge(
+        "db_pool_overflow", "Connections opened above the pool size, negative while below", _pool_stat("overflow")
+    )
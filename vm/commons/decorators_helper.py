@@ -1,7 +1,6 @@
 from flask_jwt_extended.exceptions import NoAuthorizationError, WrongTokenError, RevokedTokenError
 from jwt.exceptions import ExpiredSignatureError
-from flask_jwt_extended import get_jwt_identity
-from vm.models.user import User
+from flask_jwt_extended import get_current_user
 
 
 def error_handler_jwt_extended(func):
@@ -17,9 +16,8 @@ def error_handler_jwt_extended(func):
 def check_is_role(role_name):
     def check_is_role_decorator(func):
         def inner_function(*args, **kwargs):
-            current_user = get_jwt_identity()
-            user = User.query.get(current_user)
-            if user.role.name != role_name:
+            user = get_current_user()
+            if user.role is None or user.role.name != role_name:
                 return {"msg": f"Error, your are not an {role_name}"}, 401
             return func(*args, **kwargs)
         return inner_function
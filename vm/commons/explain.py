@@ -0,0 +1,176 @@
+"""EXPLAIN the hot queries of the app
+
+Every query issued on a hot path is registered here with ``hot_query`` as a
+function calling the builder the app issues it with, with representative
+parameters. ``flask vm explain`` prints the plan of each of them and reports
+the tables read with a sequential scan, so a missing index shows up before it
+reaches production. Plans can be taken on Postgres and SQLite only.
+
+On Postgres the plans are taken with ``enable_seqscan`` off: with the few rows
+of a development database the planner would rather scan any table, disabling
+scans means a ``Seq Scan`` left in the plan has no index to use instead.
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Query
+
+from vm.api.resources.order import ORDERS_KEYSET, ROLLUPS_KEYSET, SALES_KEYSET, orders_query, rollups_query, \
+    sales_query
+from vm.auth.helpers import current_user_query, expired_tokens_query, login_query, revocation_query, \
+    revoked_tokens_query, watermarks_query
+from vm.commons.change import inventory_query
+from vm.commons.pagination import DEFAULT_PAGE_SIZE, keyset_page
+from vm.commons.purchase import basket_query
+from vm.extensions import db
+from vm.models import OrderItem, Product
+
+HOT_QUERIES = {}
+
+# "Seq Scan on product" on Postgres, "SCAN product" or "SCAN TABLE product" on
+# SQLite, scans walking an index ("SCAN product USING INDEX ...") are fine
+_SEQUENTIAL_SCAN = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"^SCAN (?:TABLE )?(\w+)$"),
+}
+
+
+def hot_query(name):
+    """Register a function returning a statement or a ``Query`` to EXPLAIN under ``name``"""
+
+    def register(func):
+        HOT_QUERIES[name] = func
+        return func
+
+    return register
+
+
+def explain_supported():
+    """Whether plans can be taken on the database of the app"""
+    return db.session.get_bind().dialect.name in _SEQUENTIAL_SCAN
+
+
+def explain(statement):
+    """Return the plan of ``statement`` as a list of lines"""
+    if isinstance(statement, Query):
+        statement = statement.statement
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if dialect.name == "postgresql":
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", params).all()
+        return [row[0] for row in rows]
+    if dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    raise NotImplementedError(f"EXPLAIN is not supported on {dialect.name}")
+
+
+def sequential_scans(plan):
+    """Return the tables read with a sequential scan in ``plan``"""
+    pattern = _SEQUENTIAL_SCAN[db.session.get_bind().dialect.name]
+    tables = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+def explain_hot_queries():
+    """Yield ``(name, plan, sequential scans)`` for every registered query"""
+    try:
+        for name, build in HOT_QUERIES.items():
+            plan = explain(build())
+            yield name, plan, sequential_scans(plan)
+    finally:
+        db.session.rollback()
+
+
+@hot_query("login")
+def login():
+    return login_query("admin")
+
+
+@hot_query("current user")
+def current_user():
+    return current_user_query(1)
+
+
+@hot_query("token revoked")
+def token_revoked():
+    return revocation_query("00000000-0000-0000-0000-000000000000", 1)
+
+
+@hot_query("revocation sync, tokens")
+def revocation_sync_tokens():
+    return revoked_tokens_query(100)
+
+
+@hot_query("revocation sync, watermarks")
+def revocation_sync_watermarks():
+    return watermarks_query(datetime(2022, 1, 1))
+
+
+@hot_query("expired tokens")
+def expired_tokens():
+    return expired_tokens_query(datetime(2022, 1, 1))
+
+
+@hot_query("product page")
+def product_page():
+    return keyset_page(Product.query, (Product.id,), DEFAULT_PAGE_SIZE, "next", [100])
+
+
+@hot_query("buy basket")
+def buy_basket():
+    return basket_query([1, 2, 3])
+
+
+@hot_query("coin inventory")
+def coin_inventory():
+    return inventory_query("default")
+
+
+@hot_query("my orders")
+def my_orders():
+    return keyset_page(orders_query(1, {}), ORDERS_KEYSET, DEFAULT_PAGE_SIZE, "next",
+                       ["2022-10-01T00:00:00", 100], descending=True)
+
+
+@hot_query("order items")
+def order_items():
+    # what selectinload(Order.items) of the orders page emits, it has no builder of ours
+    return select(OrderItem).where(OrderItem.order_id.in_([1, 2, 3]))
+
+
+@hot_query("seller sales")
+def seller_sales():
+    return keyset_page(sales_query(1, {"since": datetime(2022, 9, 1)}), SALES_KEYSET, DEFAULT_PAGE_SIZE, "next",
+                       ["2022-10-01T00:00:00", 100], descending=True)
+
+
+@hot_query("product sales")
+def product_sales():
+    args = {"product_id": 1, "since": datetime(2022, 9, 1)}
+    return keyset_page(sales_query(1, args), SALES_KEYSET, DEFAULT_PAGE_SIZE, "next", None, descending=True)
+
+
+@hot_query("seller sales rollup")
+def seller_sales_rollup():
+    args = {"granularity": "day", "since": datetime(2022, 9, 1), "until": datetime(2022, 10, 1)}
+    return keyset_page(rollups_query(1, args), ROLLUPS_KEYSET, DEFAULT_PAGE_SIZE, "next", None, descending=True)
+
+
+@hot_query("product sales rollup")
+def product_sales_rollup():
+    args = {"granularity": "hour", "product_id": 1, "since": datetime(2022, 9, 1)}
+    return keyset_page(rollups_query(1, args), ROLLUPS_KEYSET, DEFAULT_PAGE_SIZE, "next", None, descending=True)
@@ -0,0 +1,99 @@
+"""Per request latency and SQL accounting
+
+Every request is timed and the SQL statements it runs are counted and timed
+through the ``before_cursor_execute``/``after_cursor_execute`` engine events.
+The results feed per endpoint histograms on ``/metrics``, and requests over
+``SLOW_REQUEST_MS`` or ``SLOW_REQUEST_QUERIES`` are logged so an N+1 query
+pattern shows up before it becomes an incident.
+
+Statements run while a streamed response body is generated happen after the
+request is recorded and are not counted.
+"""
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from vm.extensions import metrics
+
+request_latency = metrics.histogram(
+    "http_request_duration_seconds", "Request latency", labelnames=("method", "endpoint")
+)
+request_total = metrics.counter(
+    "http_requests_total", "Requests served", labelnames=("method", "endpoint", "status")
+)
+request_statements = metrics.histogram(
+    "db_statements_per_request",
+    "SQL statements run by a request",
+    labelnames=("method", "endpoint"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+request_db_time = metrics.histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements by a request", labelnames=("method", "endpoint")
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement context, a statement that fails leaves nothing behind
+    if context is not None and has_request_context() and "request_started" in g:
+        context.statement_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "statement_started", None)
+    if started is not None and has_request_context() and "request_started" in g:
+        g.sql_time += time.perf_counter() - started
+        g.sql_count += 1
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+
+def _record(status):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    labels = {"method": request.method, "endpoint": endpoint}
+
+    request_latency.observe(duration, **labels)
+    request_total.inc(status=str(status), **labels)
+    request_statements.observe(g.sql_count, **labels)
+    request_db_time.observe(g.sql_time, **labels)
+
+    config = current_app.config
+    if duration * 1000 > config["SLOW_REQUEST_MS"] or g.sql_count > config["SLOW_REQUEST_QUERIES"]:
+        current_app.logger.warning(
+            "slow request %s %s status=%s duration_ms=%.1f sql_statements=%d sql_ms=%.1f",
+            request.method, request.path, status, duration * 1000, g.sql_count, g.sql_time * 1000,
+        )
+
+
+def _after_request(response):
+    _record(response.status_code)
+    return response
+
+
+def _teardown_request(error):
+    # only still pending when an exception skipped after_request
+    _record(500)
+
+
+def init_app(app):
+    """Install the request hooks, SQL events are shared by every engine"""
+    app.config.setdefault("SLOW_REQUEST_MS", 500)
+    app.config.setdefault("SLOW_REQUEST_QUERIES", 20)
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,412 @@
+"""Purchase journal, purchases settled in the database in batches
+
+With ``PURCHASE_JOURNAL_PATH`` set, the buy endpoint does not write to the
+database. A purchase is checked against the database and the holds of the
+purchases not settled yet, then appended to a journal kept in a local
+SQLite file in WAL mode, with its holds on stock, deposit and coins, in one
+local transaction. The response is sent once that transaction is on disk.
+
+Every ``PURCHASE_JOURNAL_SETTLE_INTERVAL`` seconds a background thread
+settles up to ``PURCHASE_JOURNAL_BATCH_SIZE`` orders in a single database
+transaction, 0 disables the thread and leaves settlement to ``flask vm
+settle``. The transaction also moves the ``JournalWatermark`` of the machine
+past the batch: a batch already applied by a worker that stopped before
+marking it settled, or by a concurrent one, is not applied twice. An order
+the database refuses, a product deleted or its stock lowered by its seller
+meanwhile, is marked failed and logged. Orders are recorded in ``orders``
+by the transaction settling them, dated when they were journaled.
+
+The journal and its holds belong to the host: other hosts do not see them
+and could sell the same stock. Enable it on the single host serving a
+machine. Until their orders are settled, purchases are not reflected in the
+stock, deposit and coins read from the database.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, select, update
+
+from vm.commons.change import dispense, largest_change, load_inventory, make_change
+from vm.commons.purchase import (
+    OrderLine, PlacedOrder, PurchaseError, Receipt, adjust_stock, debit_deposit, merge_basket, order_lines,
+    price_basket, record_orders,
+)
+from vm.commons.sql import dialect_insert
+from vm.extensions import catalog_cache, db, metrics
+from vm.models import JournalWatermark, Product, User
+
+PENDING = "pending"
+SETTLED = "settled"
+FAILED = "failed"
+
+STOCK = "stock"
+DEPOSIT = "deposit"
+COIN = "coin"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_order (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    basket TEXT NOT NULL,
+    spent INTEGER NOT NULL,
+    change TEXT NOT NULL,
+    lines TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_journal_order_pending ON journal_order (id) WHERE status = 'pending';
+CREATE TABLE IF NOT EXISTS journal_hold (
+    kind TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+settled_total = metrics.counter(
+    "purchase_journal_orders_total", "Journal orders settled in the database", labelnames=("status",)
+)
+settle_batch = metrics.histogram(
+    "purchase_journal_batch_size", "Orders settled per transaction", buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000)
+)
+
+
+class JournalOrder:
+    """Journal order, ``basket`` is ``{product_id: amount}`` and ``change`` ``{coin: count}``
+
+    ``lines`` are the ``OrderLine`` of the basket as it was priced.
+    """
+
+    def __init__(self, id, user_id, basket, spent, change, lines="[]", created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.basket = {int(product_id): amount for product_id, amount in json.loads(basket).items()}
+        self.spent = spent
+        self.change = {int(coin): count for coin, count in json.loads(change).items()}
+        self.lines = [OrderLine(*line) for line in json.loads(lines)]
+        self.created_at = datetime.utcfromtimestamp(created_at) if created_at is not None else None
+
+    def holds(self):
+        """``(kind, key, amount)`` held until the order is settled"""
+        yield from ((STOCK, product_id, amount) for product_id, amount in self.basket.items())
+        yield DEPOSIT, self.user_id, self.spent
+        yield from ((COIN, coin, count) for coin, count in self.change.items() if count)
+
+
+class _Refused(Exception):
+    """The database refused an order"""
+
+
+class PurchaseJournal:
+    """Local journal of the purchases of a host, see module documentation"""
+
+    def __init__(self, path, batch_size, settle_interval, machine_id):
+        self.path = path
+        self.batch_size = batch_size
+        self.settle_interval = settle_interval
+        self.machine_id = machine_id
+        self._local = threading.local()
+        self._worker = None
+        self._worker_pid = None
+        self._stopped = threading.Event()
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+        # journals created before orders were recorded
+        if "lines" not in {row[1] for row in conn.execute("PRAGMA table_info(journal_order)")}:
+            conn.execute("ALTER TABLE journal_order ADD COLUMN lines TEXT NOT NULL DEFAULT '[]'")
+
+    def _connection(self):
+        """Connection of the current thread, opened again in a forked process"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # a purchase is acknowledged once its transaction is on disk
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Local write transaction, purchases of every worker of the host are serialized on it"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _held(conn, kind, keys):
+        keys = list(keys)
+        rows = conn.execute(
+            f"SELECT key, amount FROM journal_hold WHERE kind = ? AND key IN ({','.join('?' * len(keys))})",
+            [kind, *keys],
+        )
+        return dict(rows.fetchall())
+
+    @staticmethod
+    def _hold(conn, holds, sign=1):
+        conn.executemany(
+            "INSERT INTO journal_hold (kind, key, amount) VALUES (?, ?, ?) "
+            "ON CONFLICT (kind, key) DO UPDATE SET amount = amount + excluded.amount",
+            [(kind, key, sign * amount) for kind, key, amount in holds],
+        )
+        conn.execute("DELETE FROM journal_hold WHERE amount = 0")
+
+    def _available_coins(self, conn):
+        inventory = load_inventory(self.machine_id)
+        if inventory is None:
+            return None, None
+        held = self._held(conn, COIN, inventory)
+        return inventory, {coin: count - held.get(coin, 0) for coin, count in inventory.items()}
+
+    def _deposit(self, conn, user_id):
+        """Return the user deposit and the part of it held by pending orders"""
+        deposit = db.session.execute(select(User.deposit).where(User.id == user_id)).scalar() or 0
+        return deposit, self._held(conn, DEPOSIT, [user_id]).get(user_id, 0)
+
+    def buy(self, user, items):
+        """Reserve a basket and append it to the journal, same contract as ``buy_products``"""
+        basket = merge_basket(items)
+        if not basket:
+            raise PurchaseError("No products to buy")
+
+        with self._transaction() as conn:
+            # database values are read once the local lock is held, holds of
+            # orders settled meanwhile are still there: a product is never
+            # counted as available twice
+            rows = db.session.execute(
+                select(Product.id, Product.product_name, Product.cost, Product.amount_available, Product.seller_id)
+                .where(Product.id.in_(basket))
+            ).all()
+            products_by_id = {row.id: row for row in rows}
+            total_spent = price_basket(basket, products_by_id, self._held(conn, STOCK, basket))
+
+            deposit, held = self._deposit(conn, user.id)
+            # the whole deposit not held yet is spent or paid back
+            deposit -= held
+            if deposit < total_spent:
+                raise PurchaseError("Deposit not sufficient for this product(s)")
+            _, coins = self._available_coins(conn)
+            change = make_change(deposit - total_spent, coins)
+            if change is None:
+                raise PurchaseError("Not able to return change for this purchase")
+
+            lines = json.dumps(order_lines(basket, products_by_id))
+            cursor = conn.execute(
+                "INSERT INTO journal_order (user_id, basket, spent, change, lines, created_at, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user.id, json.dumps(basket), deposit, json.dumps(change), lines, time.time(), PENDING),
+            )
+            order = JournalOrder(cursor.lastrowid, user.id, json.dumps(basket), deposit, json.dumps(change))
+            self._hold(conn, order.holds())
+
+        self.start_worker()
+        products_bought = [products_by_id[item.id].product_name for item in items]
+        return Receipt(total_spent=total_spent, products=products_bought, deposit=0, change=change)
+
+    def return_deposit(self, user):
+        """Pay back the deposit not held by pending orders, same contract as ``return_deposit``
+
+        Between the commit of a settlement and the release of its holds the
+        spent deposit is counted twice, what is free is then underestimated,
+        never below 0: the rest stays deposited for the next reset.
+        """
+        with self._transaction() as conn:
+            inventory, coins = self._available_coins(conn)
+            deposit, held = self._deposit(conn, user.id)
+            paid, change = largest_change(max(0, deposit - held), coins)
+            deposit = debit_deposit(user.id, paid)
+            if deposit is None or not dispense(change, inventory, self.machine_id):
+                db.session.rollback()
+                raise PurchaseError("Deposit changed meanwhile, please retry")
+            db.session.commit()
+        return max(0, deposit - held), change
+
+    def pending(self, limit=None):
+        rows = self._connection().execute(
+            "SELECT id, user_id, basket, spent, change, lines, created_at FROM journal_order "
+            "WHERE status = ? ORDER BY id LIMIT ?",
+            (PENDING, -1 if limit is None else limit),
+        )
+        return [JournalOrder(*row) for row in rows.fetchall()]
+
+    def _watermark(self):
+        db.session.execute(
+            dialect_insert(JournalWatermark)
+            .values(machine_id=self.machine_id, last_order_id=0)
+            .on_conflict_do_nothing(index_elements=[JournalWatermark.machine_id])
+        )
+        return db.session.execute(
+            select(JournalWatermark.last_order_id).where(JournalWatermark.machine_id == self.machine_id)
+        ).scalar()
+
+    def _move_watermark(self, previous, last_order_id):
+        """Move the watermark in the current transaction, False if another settler moved it first"""
+        statement = (
+            update(JournalWatermark)
+            .where(JournalWatermark.machine_id == self.machine_id, JournalWatermark.last_order_id == previous)
+            .values(last_order_id=last_order_id)
+            .execution_options(synchronize_session=False)
+        )
+        return db.session.execute(statement).rowcount == 1
+
+    def _apply(self, orders, inventory):
+        """Apply orders with one statement per table, raise _Refused if any row did not match"""
+        stock, debits, coins = {}, {}, {}
+        for order in orders:
+            for product_id, amount in order.basket.items():
+                stock[product_id] = stock.get(product_id, 0) - amount
+            debits[order.user_id] = debits.get(order.user_id, 0) + order.spent
+            for coin, count in order.change.items():
+                coins[coin] = coins.get(coin, 0) + count
+
+        if not adjust_stock(stock):
+            raise _Refused("Products not available in this quantity anymore")
+        debit = case(debits, value=User.id)
+        statement = (
+            update(User)
+            .where(User.id.in_(debits), User.deposit >= debit)
+            .values(deposit=User.deposit - debit)
+            .execution_options(synchronize_session=False)
+        )
+        if db.session.execute(statement).rowcount != len(debits):
+            raise _Refused("Deposit not sufficient for this product(s)")
+        if not dispense(coins, inventory, self.machine_id):
+            raise _Refused("Not able to return change for this purchase")
+        record_orders([PlacedOrder(order.user_id, order.lines, order.created_at) for order in orders])
+
+    def _settle_one_by_one(self, orders, watermark, inventory):
+        """Settle orders in a transaction each, after a batch was refused
+
+        :return: ``{order id: error}`` of the refused orders, None if another
+            settler moved the watermark
+        """
+        refused = {}
+        for order in orders:
+            try:
+                self._apply([order], inventory)
+            except _Refused as e:
+                db.session.rollback()
+                refused[order.id] = str(e)
+                current_app.logger.error("purchase journal order %s refused: %s", order.id, e)
+            if not self._move_watermark(watermark, order.id):
+                db.session.rollback()
+                return None
+            db.session.commit()
+            watermark = order.id
+        return refused
+
+    def settle(self):
+        """Settle the oldest pending orders in the database
+
+        :return: number of orders settled or refused
+        """
+        orders = self.pending(self.batch_size)
+        if not orders:
+            return 0
+
+        watermark = self._watermark()
+        # applied by a worker that stopped before marking them
+        applied = [order for order in orders if order.id <= watermark]
+        orders = [order for order in orders if order.id > watermark]
+        refused = {}
+        if orders:
+            inventory = load_inventory(self.machine_id)
+            try:
+                self._apply(orders, inventory)
+            except _Refused:
+                db.session.rollback()
+                refused = self._settle_one_by_one(orders, self._watermark(), inventory)
+            else:
+                if self._move_watermark(watermark, orders[-1].id):
+                    db.session.commit()
+                else:
+                    db.session.rollback()
+                    refused = None
+            if refused is None:
+                # another settler applied them
+                return 0
+            settle_batch.observe(len(orders))
+            catalog_cache.invalidate()
+
+        with self._transaction() as conn:
+            # another settler may have marked some of them meanwhile, the
+            # holds of an order are released once
+            ids = [order.id for order in applied + orders]
+            still_pending = {row[0] for row in conn.execute(
+                f"SELECT id FROM journal_order WHERE status = ? AND id IN ({','.join('?' * len(ids))})",
+                [PENDING, *ids],
+            )}
+            done = [order for order in applied + orders if order.id in still_pending]
+            conn.executemany(
+                "UPDATE journal_order SET status = ?, error = ? WHERE id = ?",
+                [(FAILED if order.id in refused else SETTLED, refused.get(order.id), order.id) for order in done],
+            )
+            self._hold(conn, [hold for order in done for hold in order.holds()], sign=-1)
+        failed = len([order for order in done if order.id in refused])
+        settled_total.inc(len(done) - failed, status=SETTLED)
+        if failed:
+            settled_total.inc(failed, status=FAILED)
+        return len(done)
+
+    def settle_all(self):
+        """Settle every pending order, return how many were settled or refused"""
+        total = 0
+        while True:
+            count = self.settle()
+            total += count
+            if count < self.batch_size:
+                return total
+
+    def start_worker(self):
+        """Start the settlement thread of this process if it is not running"""
+        if not self.settle_interval:
+            return
+        # the thread of a parent process does not survive a fork
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        app = current_app._get_current_object()
+        self._worker_pid = os.getpid()
+        self._worker = threading.Thread(target=self._run, args=(app,), name="purchase-settlement", daemon=True)
+        self._worker.start()
+
+    def stop_worker(self):
+        self._stopped.set()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _run(self, app):
+        while not self._stopped.wait(self.settle_interval):
+            with app.app_context():
+                try:
+                    self.settle_all()
+                except Exception:
+                    app.logger.exception("purchase journal settlement failed")
+                finally:
+                    db.session.remove()
+
+
+def init_app(app):
+    """Enable the purchase journal when ``PURCHASE_JOURNAL_PATH`` is set"""
+    app.config.setdefault("PURCHASE_JOURNAL_PATH", None)
+    app.config.setdefault("PURCHASE_JOURNAL_BATCH_SIZE", 200)
+    app.config.setdefault("PURCHASE_JOURNAL_SETTLE_INTERVAL", 1)
+    if app.config["PURCHASE_JOURNAL_PATH"]:
+        app.extensions["purchase_journal"] = PurchaseJournal(
+            app.config["PURCHASE_JOURNAL_PATH"],
+            app.config["PURCHASE_JOURNAL_BATCH_SIZE"],
+            app.config["PURCHASE_JOURNAL_SETTLE_INTERVAL"],
+            app.config.get("MACHINE_ID", "default"),
+        )
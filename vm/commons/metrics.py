@@ -0,0 +1,189 @@
+"""In process metrics exposed in the Prometheus text format
+
+Metrics live in the memory of each process, with several gunicorn workers
+every worker serves its own values on ``/metrics``: scrape the workers
+individually or sum them on the Prometheus side.
+
+``/metrics`` is only served when ``METRICS_TOKEN`` is set, scrapes send it as
+a bearer token (``authorization`` of the Prometheus scrape config).
+
+No client library is needed for the few metric types used here: counters,
+histograms and gauges whose value is read by a callback at scrape time.
+"""
+import bisect
+import hmac
+import math
+import threading
+
+from flask import Blueprint, Response, current_app, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+blueprint = Blueprint("metrics", __name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _sample(name, labels, value):
+    if labels:
+        labels = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+        return f"{name}{{{labels}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield _sample(self.name, self._labels(key), value)
+
+
+class Gauge(_Metric):
+    """Gauge read at scrape time, samples returning None are left out"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if value is not None:
+            yield _sample(self.name, [], value)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # counts per bucket, the last one is +Inf, then the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield _sample(f"{self.name}_bucket", labels + [("le", _format_value(bound))], cumulative)
+            yield _sample(f"{self.name}_sum", labels, total)
+            yield _sample(f"{self.name}_count", labels, cumulative)
+
+
+class Metrics:
+    """Registry of the app metrics, served on ``/metrics`` when ``METRICS_ENABLED`` and ``METRICS_TOKEN``"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("METRICS_ENABLED", True)
+        app.config.setdefault("METRICS_TOKEN", None)
+        app.extensions["metrics"] = self
+        if app.config["METRICS_ENABLED"] and app.config["METRICS_TOKEN"]:
+            app.register_blueprint(blueprint)
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def gauge(self, name, documentation, callback):
+        """Register a gauge, replacing the callback of an existing one"""
+        gauge = self._register(Gauge, name, documentation, callback)
+        gauge.callback = callback
+        return gauge
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+@blueprint.route("/metrics")
+def serve_metrics():
+    expected = f"Bearer {current_app.config['METRICS_TOKEN']}"
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), expected.encode()):
+        return Response("metrics token required\n", status=401, content_type="text/plain; charset=utf-8")
+    return Response(
+        current_app.extensions["metrics"].render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,10 +1,42 @@
 """Simple helper to paginate query
+
+Two modes share the same ``total/pages/next/prev/results`` envelope:
+
+* offset mode (default): ``?page=3&per_page=50``
+* keyset mode, for resources passing ``keyset`` columns: ``?cursor=`` starts
+  at the first page and the opaque ``next``/``prev`` links carry the cursor of
+  the following pages. Pages are read with ``WHERE key > :last ORDER BY key
+  LIMIT n``, so deep pages cost the same as the first one. ``next``/``prev``
+  are null when there is nothing to follow.
+
+Resources listing the most recent first pass ``descending=True``, keys are
+then walked with ``<`` in decreasing order. Keys may include datetime
+columns, their cursor values are ISO 8601 strings.
+
+The envelopes and keyset criteria are shared with the async catalog handlers
+of ``vm.commons.asgi``, which only differ in how they run the statements.
+
+``?count=false`` skips the ``COUNT(*)`` in keyset mode, ``total`` and ``pages``
+are then null. Counts are cached for ``PAGINATION_COUNT_CACHE_TTL`` seconds
+when set.
 """
-from flask import url_for, request
+import base64
+import binascii
+import json
+import time
+from datetime import datetime
+
+from flask import url_for, request, current_app
+from marshmallow import ValidationError
+from sqlalchemy import DateTime, Integer, String, tuple_
+
+from vm.commons.cache import TTLCache
 
 DEFAULT_PAGE_SIZE = 50
 DEFAULT_PAGE_NUMBER = 1
 
+_count_cache = TTLCache(maxsize=256)
+
 
 def extract_pagination(page=None, per_page=None, **request_args):
     page = int(page) if page is not None else DEFAULT_PAGE_NUMBER
@@ -12,28 +44,166 @@ def extract_pagination(page=None, per_page=None, **request_args):
     return page, per_page, request_args
 
 
-def paginate(query, schema):
-    page, per_page, other_request_args = extract_pagination(**request.args)
-    page_obj = query.paginate(page=page, per_page=per_page)
-    next_ = url_for(
-        request.endpoint,
-        page=page_obj.next_num if page_obj.has_next else page_obj.page,
-        per_page=per_page,
-        **other_request_args,
-        **request.view_args
-    )
-    prev = url_for(
-        request.endpoint,
-        page=page_obj.prev_num if page_obj.has_prev else page_obj.page,
-        per_page=per_page,
-        **other_request_args,
-        **request.view_args
-    )
+def encode_cursor(direction, values):
+    payload = json.dumps({"d": direction, "k": list(values)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _cursor_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
 
+def _key_value(column, value):
+    """Convert a cursor value back to the python type of its column
+
+    Cursors come from the client, a value of another type would reach the
+    database and fail there rather than be refused.
+    """
+    if isinstance(column.type, DateTime):
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValidationError({"cursor": ["Invalid cursor"]})
+    if isinstance(column.type, Integer):
+        valid = isinstance(value, int) and not isinstance(value, bool)
+    elif isinstance(column.type, String):
+        valid = isinstance(value, str)
+    else:
+        valid = value is None or isinstance(value, (int, float, str))
+    if not valid:
+        raise ValidationError({"cursor": ["Invalid cursor"]})
+    return value
+
+
+def decode_cursor(cursor):
+    """Return ``(direction, values)``, values is None for the first page"""
+    if not cursor:
+        return "next", None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, values = payload["d"], payload["k"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ValidationError({"cursor": ["Invalid cursor"]})
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        raise ValidationError({"cursor": ["Invalid cursor"]})
+    return direction, values
+
+
+def count(query):
+    """Count query rows, going through the count cache when enabled"""
+    ttl = current_app.config.get("PAGINATION_COUNT_CACHE_TTL", 0)
+    if not ttl:
+        return query.order_by(None).count()
+
+    compiled = query.statement.compile()
+    key = (str(compiled), tuple(sorted(compiled.params.items())))
+    total = _count_cache.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        _count_cache.set(key, total, time.time() + ttl)
+    return total
+
+
+def offset_envelope(page, per_page, total, results, link):
+    """Envelope of an offset page
+
+    :param link: callable building the url of the page passed as ``page=``
+    """
+    pages = -(-total // per_page) if total else 0
     return {
-        "total": page_obj.total,
-        "pages": page_obj.pages,
-        "next": next_,
-        "prev": prev,
-        "results": schema.dump(page_obj.items),
+        "total": total,
+        "pages": pages,
+        "next": link(page=page + 1 if page < pages else page),
+        "prev": link(page=page - 1 if page > 1 else page),
+        "results": results,
     }
+
+
+def keyset_criteria(keyset, direction, values, descending=False):
+    """Return ``(where, order_by)`` reading a keyset page, ``where`` is None on the first page"""
+    # walking towards greater keys
+    forward = (direction == "next") != descending
+    where = None
+    if values is not None:
+        if len(values) != len(keyset):
+            raise ValidationError({"cursor": ["Invalid cursor"]})
+        values = [_key_value(column, value) for column, value in zip(keyset, values)]
+        key = tuple_(*keyset) if len(keyset) > 1 else keyset[0]
+        bound = tuple_(*values) if len(keyset) > 1 else values[0]
+        where = key > bound if forward else key < bound
+    order_by = list(keyset) if forward else [column.desc() for column in keyset]
+    return where, order_by
+
+
+def keyset_page(query, keyset, per_page, direction, values, descending=False):
+    """Narrow a ``Query`` or a ``select`` to a keyset page and the row telling if more follow"""
+    where, order_by = keyset_criteria(keyset, direction, values, descending)
+    query = query.order_by(None)
+    if where is not None:
+        query = query.filter(where)
+    return query.order_by(*order_by).limit(per_page + 1)
+
+
+def keyset_envelope(rows, per_page, direction, values, total, keyset, dump, link):
+    """Envelope of a keyset page read with ``LIMIT per_page + 1``
+
+    :param dump: callable serializing the items of the page
+    :param link: callable building the url of the page passed as ``cursor=``
+    """
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if direction == "prev":
+        items.reverse()
+
+    def cursor_link(cursor_direction, item):
+        return link(cursor=encode_cursor(
+            cursor_direction, [_cursor_value(getattr(item, column.key)) for column in keyset]))
+
+    has_next = has_more if direction == "next" else values is not None
+    has_prev = has_more if direction == "prev" else values is not None
+
+    return {
+        "total": total,
+        "pages": -(-total // per_page) if total is not None else None,
+        "next": cursor_link("next", items[-1]) if items and has_next else None,
+        "prev": cursor_link("prev", items[0]) if items and has_prev else None,
+        "results": dump(items),
+    }
+
+
+def with_count(request_args):
+    """False when ``?count=false`` asks to skip the keyset mode count"""
+    return request_args.get("count", "true").lower() not in ("false", "0")
+
+
+def paginate(query, schema, keyset=None, descending=False):
+    """Paginate query and dump current page with schema
+
+    :param keyset: tuple of unique, indexed columns enabling keyset mode
+    :param descending: walk the keyset from the greatest key, the query
+        should be ordered the same way for offset mode
+    """
+    page, per_page, other_request_args = extract_pagination(**request.args)
+    if keyset is not None and "cursor" in other_request_args:
+        return paginate_keyset(query, schema, keyset, per_page, other_request_args, descending)
+
+    page_obj = query.paginate(page=page, per_page=per_page, count=False)
+
+    def link(**params):
+        return url_for(request.endpoint, **params, per_page=per_page, **other_request_args, **request.view_args)
+
+    return offset_envelope(page, per_page, count(query), schema.dump(page_obj.items), link)
+
+
+def paginate_keyset(query, schema, keyset, per_page, request_args, descending=False):
+    request_args = dict(request_args)
+    direction, values = decode_cursor(request_args.pop("cursor"))
+
+    total = count(query) if with_count(request_args) else None
+    rows = keyset_page(query, keyset, per_page, direction, values, descending).all()
+
+    def link(**params):
+        return url_for(request.endpoint, **params, per_page=per_page, **request_args, **request.view_args)
+
+    return keyset_envelope(rows, per_page, direction, values, total, keyset, schema.dump, link)
@@ -0,0 +1,245 @@
+"""Purchase engine used by the buy endpoint
+
+A basket is resolved with a single ``IN (...)`` query, validated in memory
+and the stock decrements are applied with one set-based UPDATE, so the cost
+of a purchase does not grow with the number of line items.
+
+Stock and deposit are never written back from values read in Python: both
+are decremented by conditional UPDATEs (``... WHERE amount_available >= :n``)
+and a purchase is rolled back if any row did not match. Concurrent buyers
+can therefore not oversell a product, whatever the number of workers.
+
+The change owed is paid back from the machine coin inventory in the same
+transaction, a purchase that can not be given exact change is refused.
+
+The purchase is recorded in ``orders`` and ``order_items`` and added to the
+seller sales rollups by the same transaction, with three statements whatever
+the size of the basket.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import case, insert, update
+
+from vm.commons.change import dispense, insert_coins, largest_change, load_inventory, make_change
+from vm.commons.rollup import add_sales
+from vm.commons.sql import reserve_ids, update_returning_supported
+from vm.extensions import db
+from vm.models import Order, OrderItem, Product, User
+
+
+LineItem = namedtuple("LineItem", ["id", "amount_to_buy"])
+Receipt = namedtuple("Receipt", ["total_spent", "products", "deposit", "change"])
+# product as sold, recorded in order_items
+OrderLine = namedtuple("OrderLine", ["product_id", "seller_id", "product_name", "cost", "amount"])
+PlacedOrder = namedtuple("PlacedOrder", ["user_id", "lines", "created_at"])
+
+
+class PurchaseError(Exception):
+    """Basket can not be bought, message is meant to be returned to the client"""
+
+
+def merge_basket(items):
+    """Merge line items by product id, keeping the order products were first seen
+
+    :param items: iterable of objects exposing ``id`` and ``amount_to_buy``
+    :return: dict of product id -> total amount to buy
+    """
+    basket = {}
+    for item in items:
+        basket[item.id] = basket.get(item.id, 0) + item.amount_to_buy
+    return basket
+
+
+def adjust_stock(deltas):
+    """Apply ``{product_id: delta}`` to ``amount_available`` in a single UPDATE
+
+    Rows whose stock would become negative are left untouched. Does not
+    commit, caller owns the transaction.
+
+    :return: True if every product was updated
+    """
+    if not deltas:
+        return True
+    delta = case(deltas, value=Product.id)
+    statement = (
+        update(Product)
+        .where(Product.id.in_(deltas), Product.amount_available + delta >= 0)
+        .values(amount_available=Product.amount_available + delta)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(statement).rowcount == len(deltas)
+
+
+def _update_deposit(user_id, statement):
+    """Run an UPDATE on a single user row and return the new deposit
+
+    Uses ``UPDATE ... RETURNING deposit`` when the database supports it and
+    falls back to reading the row back inside the same transaction.
+    """
+    statement = statement.execution_options(synchronize_session=False)
+    if update_returning_supported():
+        return db.session.execute(statement.returning(User.deposit)).scalar()
+    if db.session.execute(statement).rowcount != 1:
+        return None
+    return db.session.query(User.deposit).filter_by(id=user_id).scalar()
+
+
+def debit_deposit(user_id, amount):
+    """Atomically take ``amount`` from a user deposit
+
+    Does not commit, caller owns the transaction.
+
+    :return: the remaining deposit, None if the deposit does not cover amount
+    """
+    statement = (
+        update(User)
+        .where(User.id == user_id, User.deposit >= amount)
+        .values(deposit=User.deposit - amount)
+    )
+    return _update_deposit(user_id, statement)
+
+
+def add_deposit(user_id, coins):
+    """Atomically add inserted ``coins`` to a user deposit and to the machine inventory, and commit
+
+    :return: the new deposit, None if the user does not exist, the coins are
+        then not added to the inventory either
+    """
+    statement = update(User).where(User.id == user_id).values(deposit=User.deposit + sum(coins))
+    deposit = _update_deposit(user_id, statement)
+    if deposit is None:
+        db.session.rollback()
+        return None
+    insert_coins(coins)
+    db.session.commit()
+    return deposit
+
+
+def basket_query(basket):
+    """Products of a merged basket"""
+    return Product.query.filter(Product.id.in_(basket))
+
+
+def price_basket(basket, products_by_id, held=None):
+    """Return the total cost of a merged basket
+
+    :param products_by_id: objects exposing ``cost`` and ``amount_available``
+    :param held: ``{product_id: amount}`` of stock already promised to others
+    :raise PurchaseError: if a product does not exist or is not available in
+        the requested quantity
+    """
+    held = held or {}
+    total_spent = 0
+    for product_id, amount_to_buy in basket.items():
+        product = products_by_id.get(product_id)
+        if product is None:
+            raise PurchaseError(f"Product {product_id} does not exist")
+        if product.amount_available - held.get(product_id, 0) < amount_to_buy:
+            raise PurchaseError(f"Product {product_id} not available in this quantity")
+        total_spent += amount_to_buy * product.cost
+    return total_spent
+
+
+def order_lines(basket, products_by_id):
+    """Return the ``OrderLine`` of a merged basket
+
+    :param products_by_id: objects exposing ``product_name``, ``cost`` and ``seller_id``
+    """
+    return [
+        OrderLine(product_id, products_by_id[product_id].seller_id, products_by_id[product_id].product_name,
+                  products_by_id[product_id].cost, amount)
+        for product_id, amount in basket.items()
+    ]
+
+
+def record_orders(orders):
+    """Insert ``PlacedOrder`` with their items and add them to the rollups, does not commit
+
+    A single order is inserted for its id, a batch with ids reserved up front
+    and one executemany, the items of all of them with another one: the
+    statements do not grow with the number of orders.
+
+    :return: the ids of the orders
+    """
+    rows = [
+        {"user_id": order.user_id, "total_spent": sum(line.cost * line.amount for line in order.lines),
+         "created_at": order.created_at or datetime.utcnow()}
+        for order in orders
+    ]
+    if not rows:
+        return []
+    if len(rows) == 1:
+        ids = [db.session.execute(insert(Order).values(rows[0])).inserted_primary_key[0]]
+    else:
+        ids = reserve_ids(Order.id, len(rows))
+        db.session.execute(insert(Order), [dict(row, id=order_id) for row, order_id in zip(rows, ids)])
+
+    items = [
+        dict(line._asdict(), order_id=order_id, created_at=row["created_at"])
+        for order, row, order_id in zip(orders, rows, ids)
+        for line in order.lines
+    ]
+    if items:
+        db.session.execute(insert(OrderItem), items)
+        add_sales(items)
+    return ids
+
+
+def buy_products(user, items):
+    """Buy every line item of a basket for ``user``, pay back the change and commit
+
+    :raise PurchaseError: if the basket is empty, a product does not exist, is
+        not available in the requested quantity, the user deposit does not
+        cover the total or the machine can not give the change
+    """
+    basket = merge_basket(items)
+    if not basket:
+        raise PurchaseError("No products to buy")
+    products = basket_query(basket).all()
+    products_by_id = {product.id: product for product in products}
+    total_spent = price_basket(basket, products_by_id)
+
+    if user.deposit < total_spent:
+        raise PurchaseError("Deposit not sufficient for this product(s)")
+
+    inventory = load_inventory()
+    change = make_change(user.deposit - total_spent, inventory)
+    if change is None:
+        raise PurchaseError("Not able to return change for this purchase")
+
+    products_bought = [products_by_id[item.id].product_name for item in items]
+    if not adjust_stock({product_id: -amount for product_id, amount in basket.items()}):
+        db.session.rollback()
+        raise PurchaseError("Products not available in this quantity anymore")
+
+    # the whole deposit read is spent or paid back, coins inserted since stay
+    deposit = debit_deposit(user.id, user.deposit)
+    if deposit is None:
+        db.session.rollback()
+        raise PurchaseError("Deposit not sufficient for this product(s)")
+    if not dispense(change, inventory):
+        db.session.rollback()
+        raise PurchaseError("Not able to return change for this purchase")
+    record_orders([PlacedOrder(user.id, order_lines(basket, products_by_id), None)])
+    db.session.commit()
+
+    return Receipt(total_spent=total_spent, products=products_bought, deposit=deposit, change=change)
+
+
+def return_deposit(user):
+    """Pay back as much of the user deposit as the machine coins allow and commit
+
+    Whatever can not be paid back with the coins available stays deposited.
+
+    :return: ``(remaining deposit, change)``
+    :raise PurchaseError: if the deposit or the coins changed meanwhile
+    """
+    inventory = load_inventory()
+    paid, change = largest_change(user.deposit, inventory)
+    deposit = debit_deposit(user.id, paid)
+    if deposit is None or not dispense(change, inventory):
+        db.session.rollback()
+        raise PurchaseError("Deposit changed meanwhile, please retry")
+    db.session.commit()
+    return deposit, change
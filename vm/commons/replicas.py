@@ -0,0 +1,208 @@
+"""Read replica routing
+
+Replicas are listed in ``DATABASE_REPLICAS``, bind key -> URI like
+``SQLALCHEMY_BINDS`` to which they are added, so they get an engine of
+flask-sqlalchemy and the ``SQLALCHEMY_ENGINE_OPTIONS`` of the primary.
+
+Resources decorated with ``read_only`` run their queries on a replica picked
+at random among the ones whose lag is under ``DATABASE_REPLICA_MAX_LAG``
+seconds, the lag is measured every ``DATABASE_REPLICA_LAG_CHECK_INTERVAL``
+seconds. Without a healthy replica they read from the primary. Flushes and
+INSERT/UPDATE/DELETE statements always go to the primary.
+
+A user whose request wrote to the primary reads from it for the next
+``DATABASE_REPLICA_PIN_SECONDS`` so they see their own writes. Anonymous
+requests writing for a user, like registering or logging in, name that user
+with ``ReplicaRouter.wrote_for``. Resources decorated with ``read_only`` under
+``jwt_required`` load the token user from the primary. Pins live in
+the memory of each worker, like the other caches: a read served by another
+worker within the window can still be stale by up to the replica lag.
+"""
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import decode_token, get_jwt_identity
+from flask_jwt_extended.exceptions import JWTExtendedException
+from flask_sqlalchemy.session import Session
+from jwt import PyJWTError
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+
+from vm.commons.cache import TTLCache
+
+# users pinned to the primary at the same time
+PIN_CACHE_SIZE = 65536
+
+# seconds of replay lag, 0 when the replica replayed everything it received
+_POSTGRES_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def request_identity():
+    """Identity of the user making the request, None if anonymous
+
+    Uses the verified token when the resource requires one, the token is
+    otherwise only decoded: the identity selects a database, nothing more.
+    """
+    if not has_request_context():
+        return None
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        pass
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        return None
+    try:
+        return decode_token(header[len("Bearer "):])[current_app.config["JWT_IDENTITY_CLAIM"]]
+    except (PyJWTError, JWTExtendedException, KeyError):
+        return None
+
+
+class RoutingSession(Session):
+    """Session sending the reads of ``read_only`` resources to a replica
+
+    ``info["replica"]`` holds the bind key of the replica to read from, it is
+    set by ``ReplicaRouter.read_only``. Writes are flagged in ``info["wrote"]``,
+    ``info["writer"]`` holds the user they were made for when not the one of
+    the request.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info["wrote"] = True
+            elif self.info.get("replica") is not None:
+                return self._db.engines[self.info["replica"]]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _pin_writer(session):
+    writer = session.info.pop("writer", None)
+    if session.info.pop("wrote", False) and has_request_context():
+        router = current_app.extensions.get("replicas")
+        if router is not None and router.keys:
+            router.pin(writer if writer is not None else request_identity())
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_writes(session):
+    session.info.pop("wrote", None)
+    session.info.pop("writer", None)
+
+
+class ReplicaRouter:
+    """Choose the database read only resources read from"""
+
+    def __init__(self, app=None, db=None):
+        self.db = None
+        self.keys = ()
+        self.max_lag = 0
+        self.lag_interval = 0
+        self.pin_seconds = 0
+        self.pins = TTLCache(maxsize=0)
+        self._lags = {}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        """Configure the router, to call after ``db.init_app``"""
+        app.config.setdefault("DATABASE_REPLICAS", {})
+        app.config.setdefault("DATABASE_REPLICA_MAX_LAG", 5)
+        app.config.setdefault("DATABASE_REPLICA_LAG_CHECK_INTERVAL", 5)
+        app.config.setdefault("DATABASE_REPLICA_PIN_SECONDS", 5)
+
+        self.db = db
+        self.keys = tuple(app.config["DATABASE_REPLICAS"])
+        self.max_lag = app.config["DATABASE_REPLICA_MAX_LAG"]
+        self.lag_interval = app.config["DATABASE_REPLICA_LAG_CHECK_INTERVAL"]
+        self.pin_seconds = app.config["DATABASE_REPLICA_PIN_SECONDS"]
+        self.pins = TTLCache(maxsize=PIN_CACHE_SIZE)
+        self._lags = {}
+        app.extensions["replicas"] = self
+
+    def pin(self, user_id):
+        """Send the reads of a user to the primary for ``pin_seconds``"""
+        if user_id is not None:
+            self.pins.set(user_id, True, time.time() + self.pin_seconds)
+
+    def wrote_for(self, user_id):
+        """Pin ``user_id`` rather than the request user once the session commits its writes"""
+        self.db.session.info["writer"] = user_id
+
+    def measure_lag(self, key):
+        """Return the replication lag of a replica in seconds, None if it is unreachable"""
+        engine = self.db.engines[key]
+        if engine.dialect.name != "postgresql":
+            return 0.0
+        try:
+            with engine.connect() as connection:
+                lag = connection.execute(_POSTGRES_LAG).scalar()
+        except DBAPIError:
+            current_app.logger.warning("replica %s is unreachable", key, exc_info=True)
+            return None
+        # a database that is not a replica has no replay position
+        return float(lag or 0)
+
+    def lag(self, key):
+        """Return the last measured lag of a replica, measuring it again once stale"""
+        now = time.time()
+        with self._lock:
+            measured = self._lags.get(key)
+        if measured is not None and now - measured[0] < self.lag_interval:
+            return measured[1]
+        lag = self.measure_lag(key)
+        with self._lock:
+            self._lags[key] = (now, lag)
+        return lag
+
+    def choose(self, user_id=None):
+        """Return the bind key of the replica to read from, None for the primary"""
+        if user_id is not None and self.pins.get(user_id):
+            return None
+        healthy = []
+        for key in self.keys:
+            lag = self.lag(key)
+            if lag is not None and lag <= self.max_lag:
+                healthy.append(key)
+        return random.choice(healthy) if healthy else None
+
+    @contextmanager
+    def primary(self):
+        """Run the enclosed queries on the primary, even in a ``read_only`` resource"""
+        info = self.db.session.info
+        replica = info.pop("replica", None)
+        try:
+            yield
+        finally:
+            if replica is not None:
+                info["replica"] = replica
+
+    def read_only(self, func):
+        """Decorate a resource method that only reads, its queries go to a replica
+
+        Put it under ``jwt_required`` so the token user is loaded from the primary.
+        """
+
+        @functools.wraps(func)
+        def inner_function(*args, **kwargs):
+            if not self.keys:
+                return func(*args, **kwargs)
+            info = self.db.session.info
+            info["replica"] = self.choose(request_identity())
+            try:
+                return func(*args, **kwargs)
+            finally:
+                info.pop("replica", None)
+
+        return inner_function
@@ -0,0 +1,88 @@
+"""Seller sales rollups
+
+Units and revenue are summed per seller, product and hour or day bucket in
+``sales_rollup`` by the transaction recording the orders, with one upsert
+whatever the number of items. Dashboards then read a row per product and
+bucket instead of the orders of the range.
+
+Buckets start on the hour or at midnight UTC, like the order dates. Orders
+recorded before the rollups existed are added up by ``flask vm
+rollup-sales``.
+"""
+from sqlalchemy import delete, select
+
+from vm.commons.sql import dialect_insert
+from vm.extensions import db
+from vm.models import OrderItem, SalesRollup
+
+GRANULARITIES = {
+    "hour": lambda when: when.replace(minute=0, second=0, microsecond=0),
+    "day": lambda when: when.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+# rollup rows per statement when rebuilding
+REBUILD_CHUNK_SIZE = 1000
+
+
+def rollup_rows(items):
+    """Sum order items into rollup rows, ordered by their unique key
+
+    :param items: mappings with ``seller_id``, ``product_id``, ``cost``,
+        ``amount`` and ``created_at``
+    """
+    totals = {}
+    for item in items:
+        # products without a seller have nobody to report to
+        if item["seller_id"] is None:
+            continue
+        for granularity, bucket_start in GRANULARITIES.items():
+            key = (item["seller_id"], granularity, bucket_start(item["created_at"]), item["product_id"])
+            units, revenue = totals.get(key, (0, 0))
+            totals[key] = (units + item["amount"], revenue + item["amount"] * item["cost"])
+    return [
+        {"seller_id": seller_id, "granularity": granularity, "bucket": bucket, "product_id": product_id,
+         "units": units, "revenue": revenue}
+        for (seller_id, granularity, bucket, product_id), (units, revenue) in sorted(totals.items())
+    ]
+
+
+def _upsert(rows):
+    statement = dialect_insert(SalesRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=[SalesRollup.seller_id, SalesRollup.granularity, SalesRollup.bucket, SalesRollup.product_id],
+        set_={
+            "units": SalesRollup.units + statement.excluded.units,
+            "revenue": SalesRollup.revenue + statement.excluded.revenue,
+        },
+    )
+    db.session.execute(statement, rows)
+
+
+def add_sales(items):
+    """Add order items to the rollups, does not commit
+
+    Rows are upserted in the order of their unique key so concurrent
+    purchases lock them in the same order.
+    """
+    rows = rollup_rows(items)
+    if rows:
+        _upsert(rows)
+
+
+def rebuild_sales_rollups():
+    """Compute the rollups again from every order item and commit
+
+    Purchases recorded while it runs may be counted twice, run it with the
+    machines stopped, after the migration adding the rollups for instance.
+
+    :return: number of rollup rows
+    """
+    statement = select(
+        OrderItem.seller_id, OrderItem.product_id, OrderItem.cost, OrderItem.amount, OrderItem.created_at
+    ).execution_options(yield_per=REBUILD_CHUNK_SIZE)
+    rows = rollup_rows(db.session.execute(statement).mappings())
+    db.session.execute(delete(SalesRollup))
+    for start in range(0, len(rows), REBUILD_CHUNK_SIZE):
+        _upsert(rows[start:start + REBUILD_CHUNK_SIZE])
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,68 @@
+"""Compiled dump functions for marshmallow schemas
+
+Dumping through marshmallow walks every field of the schema for every object.
+For flat schemas made of plain Integer, String and Boolean fields the same
+output can be produced by a generated function reading the attributes
+directly, ``CompiledSchema`` builds such a function once and falls back to the
+schema for anything it does not know how to compile.
+
+Only dumping is compiled, loading still goes through a schema instance
+created per request.
+"""
+from marshmallow import fields
+
+# exact field class -> python expression converting the attribute value,
+# mirrors what each field ``_serialize`` does for non None values
+_CONVERTERS = {
+    fields.Integer: "int",
+    fields.String: "str",
+    fields.Boolean: "bool",
+}
+
+_DUMP_HOOKS = ("pre_dump", "post_dump")
+
+
+def compile_dump(schema):
+    """Generate a function dumping one object like ``schema.dump`` would
+
+    :return: the generated function, None if the schema can not be compiled
+    """
+    for tag in getattr(schema, "_hooks", {}):
+        # older marshmallow 3 releases key hooks by (tag, many)
+        if (tag[0] if isinstance(tag, tuple) else tag) in _DUMP_HOOKS:
+            return None
+
+    reads, items = [], []
+    for i, (name, field) in enumerate(schema.dump_fields.items()):
+        converter = _CONVERTERS.get(type(field))
+        if converter is None or getattr(field, "as_string", False):
+            return None
+        attribute = field.attribute or name
+        if not attribute.isidentifier():
+            return None
+        key = field.data_key if field.data_key is not None else name
+        reads.append(f"    v{i} = obj.{attribute}")
+        items.append(f"{key!r}: None if v{i} is None else {converter}(v{i})")
+
+    source = "def dump(obj):\n{}\n    return {{{}}}\n".format("\n".join(reads), ", ".join(items))
+    namespace = {}
+    exec(compile(source, f"<compiled dump {type(schema).__name__}>", "exec"), namespace)
+    return namespace["dump"]
+
+
+class CompiledSchema:
+    """Reusable, dump only stand-in for a schema instance"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.many = schema.many
+        self._dump_one = compile_dump(schema)
+
+    def dump(self, obj, many=None):
+        many = self.many if many is None else many
+        if self._dump_one is None:
+            return self.schema.dump(obj, many=many)
+        if many:
+            dump_one = self._dump_one
+            return [dump_one(item) for item in obj]
+        return self._dump_one(obj)
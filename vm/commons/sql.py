@@ -0,0 +1,45 @@
+"""Dialect specific SQL helpers
+
+The app runs on Postgres in production and SQLite in tests, statements that
+are not portable between the two are built here.
+"""
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from vm.extensions import db
+
+
+def update_returning_supported():
+    dialect = db.session.get_bind().dialect
+    # sqlalchemy 2 renamed full_returning to update_returning
+    return getattr(dialect, "update_returning", getattr(dialect, "full_returning", False))
+
+
+def dialect_insert(model):
+    """Return an INSERT construct supporting ``on_conflict_do_update``"""
+    name = db.session.get_bind().dialect.name
+    if name == "postgresql":
+        return postgresql.insert(model)
+    if name == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"upsert is not supported on {name}")
+
+
+def reserve_ids(column, count):
+    """Return ``count`` new values of an integer primary key, to insert rows with
+
+    Postgres takes them from the sequence of the column. SQLite has a single
+    writer: call it once the transaction wrote, the database is then locked
+    and the values after the greatest id are free.
+    """
+    connection = db.session.connection()
+    name = connection.dialect.name
+    if name == "postgresql":
+        statement = text(
+            "SELECT nextval(pg_get_serial_sequence(:table, :column)) FROM generate_series(1, :count)"
+        ).bindparams(table=column.table.name, column=column.name, count=count)
+        return list(db.session.execute(statement).scalars())
+    if name == "sqlite":
+        last = db.session.execute(select(func.coalesce(func.max(column), 0))).scalar()
+        return list(range(last + 1, last + 1 + count))
+    raise NotImplementedError(f"reserving ids is not supported on {name}")
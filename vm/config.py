@@ -8,5 +8,57 @@ ENV = os.getenv("FLASK_ENV")
 DEBUG = ENV == "development"
 SECRET_KEY = os.getenv("SECRET_KEY")
 
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", 29000))
+
 SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URI")
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# per worker pool, see vm.commons.database
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_TIMEOUT = int(os.getenv("DATABASE_POOL_TIMEOUT", 30))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", 1800))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# milliseconds, 0 disables it
+DATABASE_STATEMENT_TIMEOUT = int(os.getenv("DATABASE_STATEMENT_TIMEOUT", 0))
+DATABASE_PGBOUNCER = os.getenv("DATABASE_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+# read replicas, space separated URIs, see vm.commons.replicas
+DATABASE_REPLICAS = {f"replica_{i}": uri for i, uri in enumerate(os.getenv("DATABASE_REPLICAS", "").split())}
+# seconds
+DATABASE_REPLICA_MAX_LAG = int(os.getenv("DATABASE_REPLICA_MAX_LAG", 5))
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = int(os.getenv("DATABASE_REPLICA_LAG_CHECK_INTERVAL", 5))
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DATABASE_REPLICA_PIN_SECONDS", 5))
+
+# ASGI entry point, see vm.commons.asgi
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI")
+ASGI_BRIDGE_THREADS = int(os.getenv("ASGI_BRIDGE_THREADS", 15))
+
+JWT_REVOCATION_CACHE_SIZE = int(os.getenv("JWT_REVOCATION_CACHE_SIZE", 4096))
+JWT_REVOCATION_CACHE_TTL = int(os.getenv("JWT_REVOCATION_CACHE_TTL", 300))
+JWT_REVOCATION_SYNC_INTERVAL = int(os.getenv("JWT_REVOCATION_SYNC_INTERVAL", 5))
+
+# identifies the coin inventory of this machine
+MACHINE_ID = os.getenv("MACHINE_ID", "default")
+
+# local purchase journal settled in batches, see vm.commons.journal
+PURCHASE_JOURNAL_PATH = os.getenv("PURCHASE_JOURNAL_PATH")
+PURCHASE_JOURNAL_BATCH_SIZE = int(os.getenv("PURCHASE_JOURNAL_BATCH_SIZE", 200))
+# seconds, 0 leaves settlement to flask vm settle
+PURCHASE_JOURNAL_SETTLE_INTERVAL = int(os.getenv("PURCHASE_JOURNAL_SETTLE_INTERVAL", 1))
+
+PAGINATION_COUNT_CACHE_TTL = int(os.getenv("PAGINATION_COUNT_CACHE_TTL", 0))
+
+PRODUCT_EXPORT_BATCH_SIZE = int(os.getenv("PRODUCT_EXPORT_BATCH_SIZE", 1000))
+PRODUCT_BULK_MAX_ROWS = int(os.getenv("PRODUCT_BULK_MAX_ROWS", 5000))
+PRODUCT_BULK_BATCH_SIZE = int(os.getenv("PRODUCT_BULK_BATCH_SIZE", 500))
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 512))
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", 5))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# /metrics is not served without it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# requests over either budget are logged
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", 20))
@@ -10,11 +10,18 @@ from flask_marshmallow import Marshmallow
 from flask_migrate import Migrate
 
 from vm.commons.apispec import APISpecExt
+from vm.commons.cache import RevocationCache, ResponseCache
+from vm.commons.metrics import Metrics
+from vm.commons.replicas import ReplicaRouter, RoutingSession
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 jwt = JWTManager()
 ma = Marshmallow()
 apispec = APISpecExt()
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+revocation_cache = RevocationCache()
+catalog_cache = ResponseCache()
+metrics = Metrics()
+replicas = ReplicaRouter()
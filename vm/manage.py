@@ -1,4 +1,5 @@
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
 
@@ -29,5 +30,80 @@ def init():
     click.echo("created user admin")
 
 
+@cli.command("purge-tokens")
+@with_appcontext
+def purge_tokens():
+    """Delete revocations of expired tokens, meant to run periodically"""
+    from vm.auth.helpers import purge_expired_tokens
+    tokens, watermarks = purge_expired_tokens()
+    click.echo(f"deleted {tokens} revoked tokens and {watermarks} watermarks")
+
+
+@cli.command("coins")
+@click.argument("counts", nargs=-1)
+@with_appcontext
+def coins(counts):
+    """Set the coins held by this machine, e.g. ``flask vm coins 5=20 10=20``
+
+    Without arguments prints the current inventory. A machine never given
+    coins has an unlimited supply of every coin.
+    """
+    from vm.commons.change import DENOMINATIONS, load_inventory, set_inventory
+    inventory = {}
+    for count in counts:
+        coin, _, number = count.partition("=")
+        if not (coin.isdigit() and number.isdigit()) or int(coin) not in DENOMINATIONS:
+            raise click.BadParameter(f"expected COIN=COUNT with COIN in {DENOMINATIONS}, got {count}")
+        inventory[int(coin)] = int(number)
+    if inventory:
+        set_inventory(inventory)
+
+    current = load_inventory()
+    if current is None:
+        click.echo("unlimited supply of every coin")
+        return
+    for coin in DENOMINATIONS:
+        click.echo(f"{coin:>4}: {current.get(coin, 0)}")
+
+
+@cli.command("settle")
+@with_appcontext
+def settle():
+    """Settle the pending orders of the purchase journal"""
+    journal = current_app.extensions.get("purchase_journal")
+    if journal is None:
+        click.echo("purchase journal is disabled, set PURCHASE_JOURNAL_PATH")
+        raise SystemExit(1)
+    click.echo(f"{journal.settle_all()} orders settled or refused")
+
+
+@cli.command("rollup-sales")
+@with_appcontext
+def rollup_sales():
+    """Compute the sales rollups again from the order history, with the machines stopped"""
+    from vm.commons.rollup import rebuild_sales_rollups
+    click.echo(f"{rebuild_sales_rollups()} rollup rows")
+
+
+@cli.command("explain")
+@with_appcontext
+def explain():
+    """EXPLAIN the hot queries, fails when one reads a table sequentially"""
+    from vm.commons.explain import explain_hot_queries, explain_supported
+    from vm.extensions import db
+    if not explain_supported():
+        raise click.ClickException(f"explain supports Postgres and SQLite, not {db.engine.dialect.name}")
+    failed = False
+    for name, plan, scans in explain_hot_queries():
+        click.echo(f"-- {name}")
+        for line in plan:
+            click.echo(f"   {line}")
+        for table in scans:
+            failed = True
+            click.echo(f"   !! sequential scan on {table}")
+    if failed:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     cli()
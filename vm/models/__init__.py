@@ -1,7 +1,12 @@
 from vm.models.user import User
-from vm.models.blocklist import TokenBlocklist
+from vm.models.blocklist import TokenBlocklist, TokenWatermark
 from vm.models.product import Product
 from vm.models.role import Role
+from vm.models.coin import CoinInventory
+from vm.models.journal import JournalWatermark
+from vm.models.order import Order, OrderItem
+from vm.models.rollup import SalesRollup
 
 
-__all__ = ["User", "TokenBlocklist", "Role", "Product"]
+__all__ = ["User", "TokenBlocklist", "TokenWatermark", "Role", "Product", "CoinInventory", "JournalWatermark",
+           "Order", "OrderItem", "SalesRollup"]
@@ -18,14 +18,18 @@ from vm.extensions import db
 
 
 class TokenBlocklist(db.Model):
-    """Blocklist representation"""
+    """Blocklist representation
+
+    Only revoked tokens are stored, a token that is not listed is valid
+    unless it was issued before its user watermark.
+    """
 
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, unique=True)
     token_type = db.Column(db.String(10), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
     revoked = db.Column(db.Boolean, nullable=False)
-    expires = db.Column(db.DateTime, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
 
     user = db.relationship("User", lazy="joined")
 
@@ -38,3 +42,25 @@ class TokenBlocklist(db.Model):
             "revoked": self.revoked,
             "expires": self.expires,
         }
+
+
+class TokenWatermark(db.Model):
+    """Per user token state, one row per user that ever logged in
+
+    ``revoked_before``: every token issued before this time is revoked
+    ``active_until``: expiry of the last refresh token issued to the user
+    """
+
+    # revocation sync reads recently moved watermarks, most rows have none
+    __table_args__ = (
+        db.Index(
+            "ix_token_watermark_revoked_before",
+            "revoked_before",
+            postgresql_where=db.text("revoked_before IS NOT NULL"),
+            sqlite_where=db.text("revoked_before IS NOT NULL"),
+        ),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    revoked_before = db.Column(db.DateTime, nullable=True)
+    active_until = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,15 @@
+from vm.extensions import db
+
+
+class CoinInventory(db.Model):
+    """Coins held by a vending machine, one row per denomination
+
+    A machine without any row has an unlimited supply of every coin.
+    """
+
+    machine_id = db.Column(db.String(64), primary_key=True)
+    coin = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<CoinInventory %s %s x%s>" % (self.machine_id, self.coin, self.count)
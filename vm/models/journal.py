@@ -0,0 +1,15 @@
+from vm.extensions import db
+
+
+class JournalWatermark(db.Model):
+    """Last purchase journal order settled for a machine
+
+    Orders are settled in journal order, the watermark is moved in the
+    transaction applying them so a batch is never applied twice.
+    """
+
+    machine_id = db.Column(db.String(64), primary_key=True)
+    last_order_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<JournalWatermark %s %s>" % (self.machine_id, self.last_order_id)
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from vm.extensions import db
+
+
+class Order(db.Model):
+    """A purchase, written in the transaction applying it
+
+    "my orders" filters on user_id and pages on (created_at, id), most recent
+    first.
+    """
+
+    __tablename__ = "orders"
+    __table_args__ = (db.Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    # history outlives the users it belongs to
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"))
+    total_spent = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    items = db.relationship("OrderItem", back_populates="order", order_by="OrderItem.id")
+
+    def __repr__(self):
+        return "<Order %s>" % self.id
+
+
+class OrderItem(db.Model):
+    """A product line of an order
+
+    Name, cost, seller and date are copied from the product and the order when
+    the purchase is made: sales stay as they were sold and are scanned without
+    joins, by seller or by product, over a time range. ``product_id`` is not a
+    foreign key, orders outlive the products sellers delete.
+    """
+
+    __tablename__ = "order_items"
+    __table_args__ = (
+        db.Index("ix_order_items_seller_id_created_at_id", "seller_id", "created_at", "id"),
+        db.Index("ix_order_items_product_id_created_at_id", "product_id", "created_at", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    seller_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"))
+    product_name = db.Column(db.String(80), nullable=False)
+    cost = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    order = db.relationship("Order", back_populates="items")
+
+    def __repr__(self):
+        return "<OrderItem %s %s>" % (self.order_id, self.product_name)
@@ -5,6 +5,9 @@ from vm.extensions import db
 class Product(db.Model):
     """Basic product model"""
 
+    # seller scoped listings filter on seller_id and page on id
+    __table_args__ = (db.Index("ix_product_seller_id_id", "seller_id", "id"),)
+
     id = db.Column(db.Integer, primary_key=True)
     product_name = db.Column(db.String(80), unique=True, nullable=False)
     cost = db.Column(db.Integer, nullable=False, default=0)
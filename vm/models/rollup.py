@@ -0,0 +1,29 @@
+from vm.extensions import db
+
+
+class SalesRollup(db.Model):
+    """Units and revenue of a product over an hour or a day, starting at ``bucket``
+
+    Rows are added to by the transaction recording the orders. Dashboards
+    read a seller's buckets over a range from the unique index, one row per
+    product and bucket whatever the number of orders. The rollups of a
+    deleted seller are kept without a seller, like its sales.
+    """
+
+    __tablename__ = "sales_rollup"
+    __table_args__ = (
+        db.UniqueConstraint("seller_id", "granularity", "bucket", "product_id", name="uq_sales_rollup_bucket"),
+        # a single product over a range
+        db.Index("ix_sales_rollup_product_id", "product_id", "granularity", "bucket"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    seller_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"))
+    granularity = db.Column(db.String(4), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<SalesRollup %s %s %s>" % (self.product_id, self.granularity, self.bucket)